@@ -0,0 +1,213 @@
+"""Benchmark of requests to a route protected with ``auth_required``
+
+Compares the decorator of the working tree with the one at a git ref, e.g.
+the commit before a change, as it was with the rest of the library at the
+time:
+
+    python benchmarks/bench_auth_required.py --baseline <ref>
+
+Each tree is benchmarked in its own process, alternately for a number of
+rounds, and the median of all the timings is reported, as the results of a
+single run vary by more than the differences measured. No network access is
+needed, the public keys are served from a locally generated RSA key.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from flask import Flask, Response, make_response
+from flask.testing import FlaskClient
+from jwt.algorithms import RSAAlgorithm
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_POOL_ID = "eu-west-1_bench"
+ISSUER = f"https://cognito-idp.eu-west-1.amazonaws.com/{USER_POOL_ID}"
+CLIENT_ID = "bench-client-id"
+KID = "bench-key"
+
+# Timings of each scenario, in seconds per call of every repeat
+Results = Dict[str, Dict[str, List[float]]]
+
+
+def make_key() -> Tuple[Dict[str, Any], RSAPrivateKey]:
+    """Return the key set holding a freshly generated key, and its private key"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = RSAAlgorithm.to_jwk(key.public_key(), as_dict=True)
+    jwk.update({"kid": KID, "alg": "RS256", "use": "sig"})
+    return {"keys": [jwk]}, key
+
+
+def make_token(key: RSAPrivateKey) -> str:
+    now = int(time.time())
+    return jwt.encode(
+        {
+            "sub": "9048d38f-8174-49b9-8d59-3238172823d8",
+            "iss": ISSUER,
+            "client_id": CLIENT_ID,
+            "token_use": "access",
+            "scope": "openid email",
+            "auth_time": now,
+            "exp": now + 3600,
+            "iat": now,
+            "jti": "0fe29a9e-6e94-479b-987b-e45696d5843a",
+            "username": "bench",
+        },
+        key,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+
+def serve_keys(jwks: Dict[str, Any]) -> None:
+    """Serve ``jwks`` to every key download, whatever the version of the tree"""
+
+    def fetch_data(self: Any) -> Dict[str, Any]:
+        return jwks
+
+    jwt.PyJWKClient.fetch_data = fetch_data  # type: ignore[method-assign]
+    try:
+        from flask_cognito_lib.services.jwks_svc import JWKSClient
+    except ImportError:
+        # Downloaded with PyJWT before the key store was added
+        return
+    JWKSClient.fetch_data = fetch_data  # type: ignore[method-assign]
+
+
+def make_app(claims_cache: bool) -> Flask:
+    from flask_cognito_lib import CognitoAuth
+    from flask_cognito_lib.decorators import auth_required
+
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY="bench",
+        AWS_REGION="eu-west-1",
+        AWS_COGNITO_USER_POOL_ID=USER_POOL_ID,
+        AWS_COGNITO_USER_POOL_CLIENT_ID=CLIENT_ID,
+        AWS_COGNITO_DOMAIN="https://bench.auth.eu-west-1.amazoncognito.com",
+        AWS_COGNITO_REDIRECT_URL="http://localhost/postlogin",
+        AWS_COGNITO_LOGOUT_URL="http://localhost/postlogout",
+        AWS_COGNITO_CLAIMS_CACHE_TTL=300 if claims_cache else 0,
+    )
+    CognitoAuth(app)
+
+    @app.route("/private")
+    @auth_required()
+    def private() -> Response:
+        return make_response("ok")
+
+    return app
+
+
+def get(client: FlaskClient) -> None:
+    assert client.get("/private").status_code == 200
+
+
+def call_in_request(app: Flask, headers: Dict[str, str], fn: Callable[[], Any]) -> None:
+    """Call ``fn`` in a new request context, so nothing is memoised per request"""
+    with app.test_request_context("/private", headers=headers):
+        fn()
+
+
+def timings(fn: Callable[[], Any], number: int, repeat: int) -> List[float]:
+    """Return the time of a call to ``fn`` in each repeat, in seconds"""
+    fn()
+    return [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+
+
+def measure(number: int, repeat: int) -> Results:
+    """Benchmark the ``flask_cognito_lib`` that is imported by this process"""
+    jwks, key = make_key()
+    serve_keys(jwks)
+    token = make_token(key)
+    cookie = {"Cookie": f"cognito_access_token={token}"}
+
+    results: Results = {}
+    for scenario, claims_cache in (("full verify", False), ("claims cache", True)):
+        app = make_app(claims_cache)
+        client = app.test_client()
+        client.set_cookie(key="cognito_access_token", value=token)
+
+        # Whole requests through the test client...
+        requests = timings(partial(get, client), number, repeat)
+
+        # ...and the guarded view alone, in a new request context per call.
+        # The cost of the context itself is timed too, to be subtracted
+        view = app.view_functions["private"]
+        in_request = partial(call_in_request, app, cookie)
+        guard = timings(partial(in_request, view), number, repeat)
+        context = timings(partial(in_request, lambda: None), number, repeat)
+
+        results[scenario] = {"request": requests, "view": guard, "context": context}
+    return results
+
+
+def run_tree(src: str, number: int, repeat: int) -> Results:
+    """Benchmark the library in the ``src`` directory in a new process"""
+    env = {**os.environ, "PYTHONPATH": src}
+    command = [sys.executable, __file__, "--child", f"-n{number}", f"-r{repeat}"]
+    output = subprocess.run(command, env=env, check=True, capture_output=True)
+    return json.loads(output.stdout)
+
+
+def export_tree(ref: str, directory: str) -> str:
+    """Write the ``src`` directory of the git ``ref`` to ``directory``"""
+    archive = subprocess.run(
+        ["git", "-C", REPO, "archive", ref, "src"], check=True, capture_output=True
+    )
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+    return os.path.join(directory, "src")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-n", "--number", type=int, default=1000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--baseline", help="git ref to compare with")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(measure(args.number, args.repeat), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        trees = {"current": os.path.join(REPO, "src")}
+        if args.baseline:
+            trees = {"baseline": export_tree(args.baseline, directory), **trees}
+
+        # Alternate the trees, so they share any drift in the machine's speed
+        runs: Dict[str, List[Results]] = {name: [] for name in trees}
+        for _ in range(args.rounds):
+            for name, src in trees.items():
+                runs[name].append(run_tree(src, args.number, args.repeat))
+
+    for scenario in runs["current"][0]:
+        print(f"{scenario}:")
+        for name, results in runs.items():
+            requests = [t for r in results for t in r[scenario]["request"]]
+            view = [t for r in results for t in r[scenario]["view"]]
+            context = [t for r in results for t in r[scenario]["context"]]
+            in_view = statistics.median(view) - statistics.median(context)
+            print(
+                f"  {name:>8}: {1 / statistics.median(requests):8.0f} req/s, "
+                f"{in_view * 1e6:7.1f} us in the view"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Verify latency with inline vs process pool signature checks under load
+
+Simulates a threaded worker (e.g. gunicorn gthread): every thread alternates
+between pure-Python "application" work, which holds the GIL, and verifying
+a token. Reports the p50 and p99 latency of the verify calls.
+
+Run with ``python benchmarks/bench_offload.py``.
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from typing import List
+
+from bench_verify import CLIENT_ID, ISSUER, make_store, make_token
+
+from flask_cognito_lib.services.token_svc import (
+    FastVerifier,
+    OffloadVerifier,
+    Verifier,
+)
+
+
+def app_work(iterations: int) -> int:
+    total = 0
+    for i in range(iterations):
+        total += i * i
+    return total
+
+
+def run(
+    verifier: Verifier,
+    token: str,
+    threads: int,
+    requests: int,
+    work: int,
+) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker() -> None:
+        timings = []
+        start.wait()
+        for _ in range(requests):
+            app_work(work)
+            t0 = time.perf_counter()
+            verifier.verify_access(token)
+            timings.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(timings)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-t", "--threads", type=int, default=32)
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-w", "--work", type=int, default=20000)
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    store, key = make_store()
+    token = make_token(key)
+    verifiers = {
+        "inline": FastVerifier(ISSUER, CLIENT_ID, jwks=store),
+        "offload": OffloadVerifier(
+            ISSUER, CLIENT_ID, jwks=store, processes=args.processes
+        ),
+    }
+
+    print(
+        f"{args.threads} threads x {args.requests} requests, {args.processes} processes"
+    )
+    for name, verifier in verifiers.items():
+        # warm up (and start the worker processes)
+        run(verifier, token, threads=1, requests=10, work=0)
+
+        latencies = run(verifier, token, args.threads, args.requests, args.work)
+        centiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"{name:>8}: p50 {centiles[49] * 1e3:8.3f} ms"
+            f"  p99 {centiles[98] * 1e3:8.3f} ms"
+        )
+        verifier.close()
+
+
+if __name__ == "__main__":
+    main()
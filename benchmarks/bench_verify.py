@@ -0,0 +1,88 @@
+"""Microbenchmark of token verification with PyJWT vs the direct fast path
+
+Run with ``python benchmarks/bench_verify.py``. No network access is needed,
+the public keys are served from a locally generated RSA key.
+"""
+
+import argparse
+import time
+import timeit
+from functools import partial
+from typing import Tuple
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from jwt.algorithms import RSAAlgorithm
+
+from flask_cognito_lib.services.jwks_svc import JWKSStore
+from flask_cognito_lib.services.token_svc import FastVerifier, Verifier
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_bench"
+CLIENT_ID = "bench-client-id"
+KID = "bench-key"
+
+
+def make_store() -> Tuple[JWKSStore, RSAPrivateKey]:
+    """Return a key store holding a freshly generated key, and its private key"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = RSAAlgorithm.to_jwk(key.public_key(), as_dict=True)
+    jwk.update({"kid": KID, "alg": "RS256", "use": "sig"})
+
+    store = JWKSStore(f"{ISSUER}/.well-known/jwks.json")
+    store._client.fetch_data = lambda: {"keys": [jwk]}  # type: ignore[method-assign]
+    store.get_jwk_set()
+    return store, key
+
+
+def make_token(key: RSAPrivateKey) -> str:
+    now = int(time.time())
+    return jwt.encode(
+        {
+            "sub": "9048d38f-8174-49b9-8d59-3238172823d8",
+            "cognito:groups": ["admin"],
+            "iss": ISSUER,
+            "client_id": CLIENT_ID,
+            "token_use": "access",
+            "scope": "openid email",
+            "auth_time": now,
+            "exp": now + 3600,
+            "iat": now,
+            "jti": "0fe29a9e-6e94-479b-987b-e45696d5843a",
+            "username": "bench",
+        },
+        key,
+        algorithm="RS256",
+        headers={"kid": KID},
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=5000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    store, key = make_store()
+    token = make_token(key)
+    verifiers = {
+        "pyjwt": Verifier(ISSUER, CLIENT_ID, jwks=store),
+        "fast": FastVerifier(ISSUER, CLIENT_ID, jwks=store),
+    }
+
+    results = {}
+    for name, verifier in verifiers.items():
+        assert verifier.verify_access(token)["client_id"] == CLIENT_ID
+        timings = timeit.repeat(
+            partial(verifier.verify_access, token),
+            number=args.number,
+            repeat=args.repeat,
+        )
+        results[name] = min(timings) / args.number * 1e6
+        print(f"{name:>6}: {results[name]:8.2f} us/token")
+
+    print(f"speedup: {results['pyjwt'] / results['fast']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
-from typing import Any, List, Optional
+from typing import TYPE_CHECKING, Any, List, Optional
 from urllib.parse import quote
 
 from flask import current_app
 
 from .exceptions import ConfigurationError
 
+if TYPE_CHECKING:
+    from .services.refresh_svc import RefreshBackend
+
 
 def get(key: str, required: bool = False, default: Optional[Any] = None) -> Any:
     """Get a key from the current Flask application's configuration
@@ -43,10 +46,13 @@ class Config:
     Helper class to hold the configuration
     """
 
+    __slots__ = ()
+
     # Constants
     APP_EXTENSION_KEY = "cognito_auth_lib"
     CONTEXT_KEY_COGNITO_SERVICE = "aws_cognito_service"
     CONTEXT_KEY_TOKEN_SERVICE = "aws_jwt_service"
+    CONTEXT_KEY_CLAIMS = "aws_cognito_claims"
     COOKIE_NAME = "cognito_access_token"
     COOKIE_NAME_REFRESH = "cognito_refresh_token"
     COOKIE_NAME_ID = "cognito_id_token"
@@ -155,6 +161,309 @@ class Config:
             get("AWS_COGNITO_REFRESH_COOKIE_AGE_SECONDS", required=False, default=86400)
         )
 
+    @property
+    def jwks_cache_ttl(self) -> int:
+        """Return how long to cache the user pool public keys for, in seconds"""
+        return int(get("AWS_COGNITO_JWKS_CACHE_TTL", required=False, default=3600))
+
+    @property
+    def jwks_refresh_interval(self) -> int:
+        """Return the interval for refreshing the public keys in the background
+
+        If zero (default), no background refresher is started and the keys
+        are downloaded when a request finds them missing or expired.
+        """
+        return int(get("AWS_COGNITO_JWKS_REFRESH_INTERVAL", required=False, default=0))
+
+    @property
+    def jwks_max_staleness(self) -> int:
+        """Return how long past the cache TTL to keep using the last public keys
+
+        Used when the JWKS endpoint cannot be reached, in seconds.
+        """
+        return int(get("AWS_COGNITO_JWKS_MAX_STALENESS", required=False, default=0))
+
+    @property
+    def jwks_min_refetch_interval(self) -> int:
+        """Return the minimum time between key downloads for unknown key IDs
+
+        Limits how often a token signed with a key ID that is not in the cached
+        public keys can cause the keys to be downloaded again, in seconds.
+        """
+        return int(
+            get("AWS_COGNITO_JWKS_MIN_REFETCH_INTERVAL", required=False, default=30)
+        )
+
+    @property
+    def jwks_snapshot_path(self) -> Optional[str]:
+        """Return the path of the file to persist the public keys to
+
+        If set, the public keys are loaded from this file when the extension
+        is initialised and written back after every download, so new processes
+        can verify tokens without waiting for the keys to be downloaded.
+        """
+        return get("AWS_COGNITO_JWKS_SNAPSHOT_PATH", required=False)
+
+    @property
+    def jwks_snapshot_max_age(self) -> int:
+        """Return the maximum age of a public key snapshot to load, in seconds"""
+        return int(
+            get("AWS_COGNITO_JWKS_SNAPSHOT_MAX_AGE", required=False, default=86400)
+        )
+
+    @property
+    def fast_verify(self) -> bool:
+        """Return True to verify tokens directly with ``cryptography``
+
+        This skips PyJWT for tokens with the Cognito profile (RS256 with the
+        standard headers), accepting and rejecting exactly the same tokens.
+        """
+        return get("AWS_COGNITO_FAST_VERIFY", required=False, default=False)
+
+    @property
+    def verify_processes(self) -> int:
+        """Return the number of processes to verify token signatures on
+
+        If set, signatures are verified on a pool of worker processes started
+        with the public keys of the user pool, so they do not compete with the
+        application for the GIL. If zero (default), signatures are verified in
+        the calling thread.
+        """
+        return int(get("AWS_COGNITO_VERIFY_PROCESSES", required=False, default=0))
+
+    @property
+    def verify_process_timeout(self) -> float:
+        """Return the maximum time to wait for a worker process to verify a signature
+
+        If a signature is not verified on the process pool in time (e.g. the
+        workers are still starting), it is verified in the calling thread.
+        """
+        return float(
+            get("AWS_COGNITO_VERIFY_PROCESS_TIMEOUT", required=False, default=1)
+        )
+
+    @property
+    def batch_workers(self) -> Optional[int]:
+        """Return the number of threads used to verify batches of tokens
+
+        If not set (default), ``ThreadPoolExecutor`` chooses based on the
+        number of CPUs.
+        """
+        workers = get("AWS_COGNITO_BATCH_WORKERS", required=False)
+        return int(workers) if workers else None
+
+    @property
+    def claims_cache_ttl(self) -> int:
+        """Return the maximum time to cache the claims of verified tokens for
+
+        If zero (default), the claims cache is disabled and every token is
+        verified in full, in seconds.
+        """
+        return int(get("AWS_COGNITO_CLAIMS_CACHE_TTL", required=False, default=0))
+
+    @property
+    def claims_cache_max_entries(self) -> int:
+        """Return the maximum number of tokens to cache the claims of"""
+        return int(
+            get("AWS_COGNITO_CLAIMS_CACHE_MAX_ENTRIES", required=False, default=1024)
+        )
+
+    @property
+    def claims_cache_max_bytes(self) -> int:
+        """Return the maximum total size of the tokens to cache the claims of"""
+        return int(
+            get("AWS_COGNITO_CLAIMS_CACHE_MAX_BYTES", required=False, default=1048576)
+        )
+
+    @property
+    def rejected_cache_ttl(self) -> int:
+        """Return how long to remember tokens that failed verification for
+
+        Repeated requests with a rejected token are rejected again without
+        verifying the token. If zero (default), rejected tokens are not
+        remembered, in seconds.
+        """
+        return int(get("AWS_COGNITO_REJECTED_CACHE_TTL", required=False, default=0))
+
+    @property
+    def rejected_cache_max_entries(self) -> int:
+        """Return the maximum number of rejected tokens to remember"""
+        return int(
+            get("AWS_COGNITO_REJECTED_CACHE_MAX_ENTRIES", required=False, default=1024)
+        )
+
+    @property
+    def http_pool_size(self) -> int:
+        """Return the number of connections to keep open to each Cognito host
+
+        The connections are shared by all requests and threads in the process.
+        """
+        return int(get("AWS_COGNITO_HTTP_POOL_SIZE", required=False, default=10))
+
+    @property
+    def http_connect_timeout(self) -> float:
+        """Return the timeout to connect to Cognito, in seconds"""
+        return float(get("AWS_COGNITO_HTTP_CONNECT_TIMEOUT", required=False, default=5))
+
+    @property
+    def http_read_timeout(self) -> float:
+        """Return the timeout to wait for a response from Cognito, in seconds"""
+        return float(get("AWS_COGNITO_HTTP_READ_TIMEOUT", required=False, default=10))
+
+    @property
+    def retry_max_attempts(self) -> int:
+        """Return the maximum number of attempts of a request to Cognito
+
+        Failed requests to the token and revoke endpoints are retried with
+        exponential backoff. If 1 (default), requests are not retried.
+        """
+        return int(get("AWS_COGNITO_RETRY_MAX_ATTEMPTS", required=False, default=1))
+
+    @property
+    def retry_base_delay(self) -> float:
+        """Return the delay before the first retry, doubled for each retry"""
+        return float(get("AWS_COGNITO_RETRY_BASE_DELAY", required=False, default=0.1))
+
+    @property
+    def retry_max_delay(self) -> float:
+        """Return the maximum delay before a retry, in seconds
+
+        A request is not retried if Cognito asks for a longer delay with the
+        ``Retry-After`` header.
+        """
+        return float(get("AWS_COGNITO_RETRY_MAX_DELAY", required=False, default=5))
+
+    @property
+    def retry_jitter(self) -> float:
+        """Return the fraction of each retry delay that is randomised
+
+        Between 0 (no jitter) and 1 (default, "full jitter").
+        """
+        return float(get("AWS_COGNITO_RETRY_JITTER", required=False, default=1))
+
+    @property
+    def retry_status_codes(self) -> List[int]:
+        """Return the HTTP status codes of responses that are retried"""
+        return get(
+            "AWS_COGNITO_RETRY_STATUS_CODES",
+            required=False,
+            default=[429, 500, 502, 503, 504],
+        )
+
+    @property
+    def breaker_failure_rate(self) -> float:
+        """Return the failure rate that trips the circuit breaker open
+
+        Requests to a Cognito endpoint fail fast while its breaker is open.
+        Between 0 and 1, if zero (default) the circuit breaker is disabled.
+        """
+        return float(get("AWS_COGNITO_BREAKER_FAILURE_RATE", required=False, default=0))
+
+    @property
+    def breaker_window(self) -> int:
+        """Return the number of recent requests the failure rate is taken over"""
+        return int(get("AWS_COGNITO_BREAKER_WINDOW", required=False, default=20))
+
+    @property
+    def breaker_min_calls(self) -> int:
+        """Return the number of requests needed before the breaker can trip"""
+        return int(get("AWS_COGNITO_BREAKER_MIN_CALLS", required=False, default=10))
+
+    @property
+    def breaker_slow_call(self) -> float:
+        """Return the duration a request is counted as failed after, in seconds
+
+        If zero (default), only errors are counted as failures.
+        """
+        return float(get("AWS_COGNITO_BREAKER_SLOW_CALL", required=False, default=0))
+
+    @property
+    def breaker_open_seconds(self) -> float:
+        """Return how long the breaker stays open before a probe request"""
+        return float(
+            get("AWS_COGNITO_BREAKER_OPEN_SECONDS", required=False, default=30)
+        )
+
+    @property
+    def hedge_percentile(self) -> float:
+        """Return the latency percentile to hedge refresh token requests after
+
+        A refresh token request that has not completed within this percentile
+        (0-100) of the latency of recent requests is sent again, and the first
+        response is used. If zero (default), requests are not hedged. The
+        single-use authorisation code grant is never hedged.
+        """
+        return float(get("AWS_COGNITO_HEDGE_PERCENTILE", required=False, default=0))
+
+    @property
+    def hedge_max_rate(self) -> float:
+        """Return the maximum fraction of requests that are hedged"""
+        return float(get("AWS_COGNITO_HEDGE_MAX_RATE", required=False, default=0.05))
+
+    @property
+    def hedge_initial_delay(self) -> float:
+        """Return the hedge delay used until there are enough latency samples"""
+        return float(get("AWS_COGNITO_HEDGE_INITIAL_DELAY", required=False, default=1))
+
+    @property
+    def refresh_cache_ttl(self) -> float:
+        """Return how long to reuse the response to a refresh token exchange
+
+        Concurrent exchanges of the same refresh token always share a single
+        request to Cognito. If set, the response is also reused by exchanges
+        of the same refresh token for this long (never past the expiry of the
+        new tokens). If zero (default), only concurrent exchanges are shared,
+        in seconds.
+        """
+        return float(get("AWS_COGNITO_REFRESH_CACHE_TTL", required=False, default=0))
+
+    @property
+    def refresh_lock_dir(self) -> Optional[str]:
+        """Return the directory used to share refresh token exchanges
+
+        If set, exchanges of the same refresh token by different processes on
+        this host (e.g. gunicorn workers) are serialised with a file lock in
+        this directory, and the processes that waited reuse the response.
+        """
+        return get("AWS_COGNITO_REFRESH_LOCK_DIR", required=False, default=None)
+
+    @property
+    def refresh_lock_ttl(self) -> float:
+        """Return how long other processes reuse a refresh response, in seconds"""
+        return float(get("AWS_COGNITO_REFRESH_LOCK_TTL", required=False, default=10))
+
+    @property
+    def refresh_backend(self) -> Optional["RefreshBackend"]:
+        """Return a custom backend to share refresh token exchanges
+
+        Takes precedence over ``AWS_COGNITO_REFRESH_LOCK_DIR``.
+        """
+        return get("AWS_COGNITO_REFRESH_BACKEND", required=False, default=None)
+
+    @property
+    def revoke_queue_size(self) -> int:
+        """Return the maximum number of refresh tokens waiting to be revoked
+
+        If set, refresh tokens are revoked on logout by a background thread,
+        so the user is not kept waiting for Cognito. If the queue is full the
+        token is revoked before returning. If zero (default), tokens are
+        always revoked before returning.
+        """
+        return int(get("AWS_COGNITO_REVOKE_QUEUE_SIZE", required=False, default=0))
+
+    @property
+    def revoke_max_attempts(self) -> int:
+        """Return the maximum number of attempts to revoke a queued token"""
+        return int(get("AWS_COGNITO_REVOKE_MAX_ATTEMPTS", required=False, default=3))
+
+    @property
+    def revoke_retry_delay(self) -> float:
+        """Return the delay before retrying a queued revocation, in seconds
+
+        The delay doubles on every attempt.
+        """
+        return float(get("AWS_COGNITO_REVOKE_RETRY_DELAY", required=False, default=1))
+
     @property
     def secret_key(self) -> bytes:
         """Return Flask secret key"""
@@ -201,3 +510,54 @@ class Config:
     def revoke_endpoint(self) -> str:
         """Return the Cognito REVOKE endpoint URL"""
         return f"{self.domain}/oauth2/revoke"
+
+
+# Names of the configuration values, including the derived endpoints
+_FIELDS = tuple(
+    name for name, value in vars(Config).items() if isinstance(value, property)
+)
+
+
+# Needed to verify a token, so they must be set when a snapshot is created
+_REQUIRED = ("user_pool_id", "user_pool_client_id", "region")
+
+
+class ConfigSnapshot(Config):
+    """
+    Immutable copy of the configuration, read once from the Flask app
+
+    Every value (including the derived endpoints) is read from ``cfg`` when
+    the snapshot is created, which needs an app context and fails with a
+    ``ConfigurationError`` if a key needed to verify tokens is missing. After
+    that the values are plain attributes, so reading them does not touch the
+    app config. Changes to the app config are only seen by a new snapshot,
+    see ``CognitoAuth.reload_config``.
+
+    The values that could not be read, e.g. the login and logout endpoints
+    of an app that only verifies tokens, are read from ``cfg`` on every use
+    instead, raising a ``ConfigurationError`` then if still missing.
+    """
+
+    __slots__ = (*_FIELDS, "_cfg")
+
+    def __init__(self, cfg: Optional[Config] = None) -> None:
+        cfg = cfg or Config()
+        object.__setattr__(self, "_cfg", cfg)
+        for name in _FIELDS:
+            try:
+                object.__setattr__(self, name, getattr(cfg, name))
+            except ConfigurationError:
+                if name in _REQUIRED:
+                    raise
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for the values that were left unset
+        if name in _FIELDS:
+            return getattr(object.__getattribute__(self, "_cfg"), name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
@@ -1,5 +1,14 @@
-from functools import wraps
-from typing import Any, Callable, Dict, Iterable, Optional, TypeVar, Union, cast
+from functools import partial, wraps
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from flask import Response, redirect, request, session
 from flask import current_app as app
@@ -7,13 +16,15 @@ from typing_extensions import ParamSpec
 from werkzeug.local import LocalProxy
 
 from flask_cognito_lib.config import Config
-from flask_cognito_lib.exceptions import (
-    AuthorisationRequiredError,
-    CognitoError,
-    CognitoGroupRequiredError,
-    TokenVerifyError,
-)
+from flask_cognito_lib.exceptions import CognitoError
 from flask_cognito_lib.plugin import CognitoAuth
+from flask_cognito_lib.policy import (  # noqa: F401, re-exports check_group_membership
+    Policy,
+    authorise_request,
+    authorise_request_async,
+    check_group_membership,
+)
+from flask_cognito_lib.services.revoke_svc import get_revoke_queue
 from flask_cognito_lib.utils import (
     CognitoTokenResponse,
     generate_code_challenge,
@@ -27,6 +38,15 @@ R = TypeVar("R", bound=Response)
 cognito_auth: CognitoAuth = LocalProxy(lambda: app.extensions[Config.APP_EXTENSION_KEY])  # type: ignore
 
 
+def get_cognito_auth() -> CognitoAuth:
+    """Return the extension of the current app, without the ``cognito_auth`` proxy
+
+    Resolving it once per request saves going through the proxy on every
+    attribute access.
+    """
+    return app.extensions[Config.APP_EXTENSION_KEY]
+
+
 def remove_from_session(keys: Iterable[str]) -> None:
     """Remove an entry from the session"""
     with app.app_context():
@@ -59,6 +79,28 @@ def validate_and_store_tokens(
         session.update({"user_info": user_info})
 
 
+async def validate_and_store_tokens_async(
+    tokens: CognitoTokenResponse,
+    nonce: Optional[str] = None,
+) -> None:
+    """Validate and store the tokens in the session without blocking the event loop"""
+
+    if tokens.access_token is not None:
+        claims = await cognito_auth.verify_access_token_async(
+            token=tokens.access_token,
+            leeway=cognito_auth.cfg.cognito_expiration_leeway,
+        )
+        session.update({"claims": claims})
+
+    if tokens.id_token is not None:
+        user_info = await cognito_auth.verify_id_token_async(
+            token=tokens.id_token,
+            nonce=nonce,
+            leeway=cognito_auth.cfg.cognito_expiration_leeway,
+        )
+        session.update({"user_info": user_info})
+
+
 def store_token_in_cookie(
     resp: Response,
     token: Union[str, None],
@@ -100,6 +142,75 @@ def get_token_from_cookie(cookie_name: str) -> Union[str, None]:
     return token
 
 
+def store_tokens_in_cookies(
+    resp: Response,
+    tokens: CognitoTokenResponse,
+    store_refresh_token: bool = False,
+) -> None:
+    """Store the access token, ID token and optionally the refresh token in cookies"""
+    # Store the access token in a HTTP only secure cookie
+    store_token_in_cookie(
+        resp=resp,
+        token=tokens.access_token,
+        cookie_name=cognito_auth.cfg.COOKIE_NAME,
+        max_age=cognito_auth.cfg.max_cookie_age_seconds,
+    )
+
+    # Grab the refresh token and store in a HTTP only secure cookie
+    if store_refresh_token and tokens.refresh_token:
+        store_token_in_cookie(
+            resp=resp,
+            token=tokens.refresh_token,
+            cookie_name=cognito_auth.cfg.COOKIE_NAME_REFRESH,
+            max_age=cognito_auth.cfg.max_refresh_cookie_age_seconds,
+            encrypt=cognito_auth.cfg.refresh_cookie_encrypted,
+        )
+
+    # Store the ID token in a HTTP only secure cookie
+    if tokens.id_token is not None:
+        store_token_in_cookie(
+            resp=resp,
+            token=tokens.id_token,
+            cookie_name=cognito_auth.cfg.COOKIE_NAME_ID,
+            max_age=cognito_auth.cfg.max_cookie_age_seconds,
+        )
+
+
+def get_login_session() -> Tuple[str, str, str]:
+    """Get the code verifier, state and nonce stored in the session at login"""
+    # Sometimes this can fail so raise an error if it does
+    # See: https://github.com/mblackgeo/flask-cognito-lib/issues/81
+    try:
+        return session["code_verifier"], session["state"], session["nonce"]
+    except KeyError as err:
+        raise CognitoError("Session data missing or expired") from err
+
+
+def end_login_session() -> None:
+    """Remove the one-time use values from the session once logged in"""
+    remove_from_session(("code_challenge", "code_verifier", "nonce"))
+
+    # split out the random part of the state value (in case the user
+    # specified their own custom state value)
+    state = session.get("state", None)
+    if state is not None:
+        state = state.split("__")[-1]
+        session.update({"state": state})
+
+
+def get_refresh_token() -> str:
+    """Get the refresh token from the cookie, if the refresh flow is enabled"""
+    if not cognito_auth.cfg.refresh_flow_enabled:
+        raise CognitoError("Refresh flow is not enabled")
+
+    refresh_token = get_token_from_cookie(cognito_auth.cfg.COOKIE_NAME_REFRESH)
+
+    if not refresh_token:
+        raise CognitoError("No refresh token provided")
+
+    return refresh_token
+
+
 def cognito_login(fn: Callable[P, Any]) -> Callable[P, Response]:
     """A decorator that redirects to the Cognito hosted UI"""
 
@@ -147,14 +258,7 @@ def cognito_login_callback(fn: Callable[P, Any]) -> Callable[P, Response]:
     def wrapper(*args: P.args, **kwargs: P.kwargs) -> Response:
         with app.app_context():
             # Get the access token return after auth flow with Cognito
-            # Sometimes this can fail so raise an error if it does
-            # See: https://github.com/mblackgeo/flask-cognito-lib/issues/81
-            try:
-                code_verifier = session["code_verifier"]
-                state = session["state"]
-                nonce = session["nonce"]
-            except KeyError as err:
-                raise CognitoError("Session data missing or expired") from err
+            code_verifier, state, nonce = get_login_session()
 
             # exchange the code for an access token
             # also confirms the returned state is correct
@@ -168,44 +272,49 @@ def cognito_login_callback(fn: Callable[P, Any]) -> Callable[P, Response]:
             validate_and_store_tokens(tokens=tokens, nonce=nonce)
 
             # Remove one-time use variables now we have completed the auth flow
-            remove_from_session(("code_challenge", "code_verifier", "nonce"))
-
-            # split out the random part of the state value (in case the user
-            # specified their own custom state value)
-            state = session.get("state", None)
-            if state is not None:
-                state = state.split("__")[-1]
-                session.update({"state": state})
+            end_login_session()
 
             # return and set the JWT as a http only cookie
             resp = fn(*args, **kwargs)
-
-            # Store the access token in a HTTP only secure cookie
-            store_token_in_cookie(
+            store_tokens_in_cookies(
                 resp=resp,
-                token=tokens.access_token,
-                cookie_name=cognito_auth.cfg.COOKIE_NAME,
-                max_age=cognito_auth.cfg.max_cookie_age_seconds,
+                tokens=tokens,
+                store_refresh_token=cognito_auth.cfg.refresh_flow_enabled,
             )
 
-            # Grab the refresh token and store in a HTTP only secure cookie
-            if cognito_auth.cfg.refresh_flow_enabled and tokens.refresh_token:
-                store_token_in_cookie(
-                    resp=resp,
-                    token=tokens.refresh_token,
-                    cookie_name=cognito_auth.cfg.COOKIE_NAME_REFRESH,
-                    max_age=cognito_auth.cfg.max_refresh_cookie_age_seconds,
-                    encrypt=cognito_auth.cfg.refresh_cookie_encrypted,
-                )
+        return resp
 
-            # Store the ID token in a HTTP only secure cookie
-            if tokens.id_token is not None:
-                store_token_in_cookie(
-                    resp=resp,
-                    token=tokens.id_token,
-                    cookie_name=cognito_auth.cfg.COOKIE_NAME_ID,
-                    max_age=cognito_auth.cfg.max_cookie_age_seconds,
-                )
+    return wrapper
+
+
+def cognito_login_callback_async(
+    fn: Callable[P, Coroutine[Any, Any, Any]],
+) -> Callable[P, Coroutine[Any, Any, Response]]:
+    """The same as ``cognito_login_callback`` for an async view
+
+    The token exchange and verification do not block the event loop.
+    """
+
+    @wraps(fn)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Response:
+        with app.app_context():
+            code_verifier, state, nonce = get_login_session()
+
+            tokens = await cognito_auth.get_tokens_async(
+                request_args=request.args,
+                expected_state=state,
+                code_verifier=code_verifier,
+            )
+
+            await validate_and_store_tokens_async(tokens=tokens, nonce=nonce)
+            end_login_session()
+
+            resp = await fn(*args, **kwargs)
+            store_tokens_in_cookies(
+                resp=resp,
+                tokens=tokens,
+                store_refresh_token=cognito_auth.cfg.refresh_flow_enabled,
+            )
 
         return resp
 
@@ -218,13 +327,7 @@ def cognito_refresh_callback(fn: Callable[P, Any]) -> Callable[P, Response]:
     @wraps(fn)
     def wrapper(*args: P.args, **kwargs: P.kwargs) -> Response:
         with app.app_context():
-            if not cognito_auth.cfg.refresh_flow_enabled:
-                raise CognitoError("Refresh flow is not enabled")
-
-            refresh_token = get_token_from_cookie(cognito_auth.cfg.COOKIE_NAME_REFRESH)
-
-            if not refresh_token:
-                raise CognitoError("No refresh token provided")
+            refresh_token = get_refresh_token()
 
             # Exchange refresh token for the new access/id token.
             tokens = cognito_auth.exchange_refresh_token(
@@ -236,23 +339,31 @@ def cognito_refresh_callback(fn: Callable[P, Any]) -> Callable[P, Response]:
 
             # Return and set the JWT as a http only cookie
             resp = fn(*args, **kwargs)
+            store_tokens_in_cookies(resp=resp, tokens=tokens)
 
-            # Store the access token in a HTTP only secure cookie
-            store_token_in_cookie(
-                resp=resp,
-                token=tokens.access_token,
-                cookie_name=cognito_auth.cfg.COOKIE_NAME,
-                max_age=cognito_auth.cfg.max_cookie_age_seconds,
+        return resp
+
+    return wrapper
+
+
+def cognito_refresh_callback_async(
+    fn: Callable[P, Coroutine[Any, Any, Any]],
+) -> Callable[P, Coroutine[Any, Any, Response]]:
+    """The same as ``cognito_refresh_callback`` for an async view"""
+
+    @wraps(fn)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Response:
+        with app.app_context():
+            refresh_token = get_refresh_token()
+
+            tokens = await cognito_auth.exchange_refresh_token_async(
+                refresh_token=refresh_token,
             )
 
-            # Store the id token in a HTTP only secure cookie
-            if tokens.id_token is not None:
-                store_token_in_cookie(
-                    resp=resp,
-                    token=tokens.id_token,
-                    cookie_name=cognito_auth.cfg.COOKIE_NAME_ID,
-                    max_age=cognito_auth.cfg.max_cookie_age_seconds,
-                )
+            await validate_and_store_tokens_async(tokens=tokens)
+
+            resp = await fn(*args, **kwargs)
+            store_tokens_in_cookies(resp=resp, tokens=tokens)
 
         return resp
 
@@ -271,11 +382,19 @@ def cognito_logout(fn: Callable[P, Any]) -> Callable[P, Response]:
                 key=cognito_auth.cfg.COOKIE_NAME, domain=cognito_auth.cfg.cookie_domain
             )
 
-            # Revoke the refresh token if it exists
+            # Revoke the refresh token if it exists, in the background if the
+            # revocation queue is enabled
             if refresh_token := get_token_from_cookie(
                 cognito_auth.cfg.COOKIE_NAME_REFRESH
             ):
-                cognito_auth.revoke_refresh_token(refresh_token)
+                revoke_queue = get_revoke_queue(cognito_auth.cfg)
+                if revoke_queue is None or not revoke_queue.submit(
+                    partial(
+                        cognito_auth.cognito_service.revoke_refresh_token,
+                        refresh_token,
+                    )
+                ):
+                    cognito_auth.revoke_refresh_token(refresh_token)
                 resp.delete_cookie(
                     key=cognito_auth.cfg.COOKIE_NAME_REFRESH,
                     domain=cognito_auth.cfg.cookie_domain,
@@ -295,56 +414,66 @@ def cognito_logout(fn: Callable[P, Any]) -> Callable[P, Response]:
     return wrapper
 
 
-def check_group_membership(
-    claims: Dict[str, Iterable[str]],
-    groups: Iterable[str],
-    any_group: bool,
-) -> bool:
-    if "cognito:groups" not in claims:
-        raise CognitoGroupRequiredError("No groups found in claims")
-
-    if any_group:
-        return any(g in claims["cognito:groups"] for g in groups)
-    return all(g in claims["cognito:groups"] for g in groups)
-
-
 def auth_required(
     groups: Optional[Iterable[str]] = None,
     any_group: bool = False,
+    use_cache: bool = True,
 ) -> Callable[[Callable[P, R]], Callable[P, R]]:
-    """A decorator to protect a route with AWS Cognito"""
+    """A decorator to protect a route with AWS Cognito
+
+    Set ``use_cache=False`` to always verify the token in full on sensitive
+    routes, even if the claims cache or rejected token cache is enabled.
+    """
+    policy = Policy(
+        groups=tuple(groups or ()), any_group=any_group, use_cache=use_cache
+    )
 
     def wrapper(fn: Callable[P, R]) -> Callable[P, R]:
         @wraps(fn)
         def decorator(*args: P.args, **kwargs: P.kwargs) -> R:
-            with app.app_context():
-                # return early if the extension is disabled
-                if cognito_auth.cfg.disabled:
-                    return fn(*args, **kwargs)
+            # The request context is already active, so use its app context
+            # rather than pushing another one
+            auth = get_cognito_auth()
 
-                # Try and validate the access token stored in the cookie
-                try:
-                    access_token = request.cookies.get(cognito_auth.cfg.COOKIE_NAME)
+            # return early if the extension is disabled
+            if not auth.cfg.disabled:
+                authorise_request(auth, policy)
 
-                    if access_token is None:
-                        raise AuthorisationRequiredError
+            return fn(*args, **kwargs)
 
-                    claims = cognito_auth.verify_access_token(
-                        token=access_token,
-                        leeway=cognito_auth.cfg.cognito_expiration_leeway,
-                    )
-                    # Check for required group membership
-                    if groups:
-                        req_groups = cast(Iterable[str], groups)
-                        if not check_group_membership(claims, req_groups, any_group):
-                            raise CognitoGroupRequiredError
-
-                    return fn(*args, **kwargs)
-
-                except CognitoGroupRequiredError:
-                    raise
-                except (TokenVerifyError, KeyError):
-                    raise AuthorisationRequiredError
+        return decorator
+
+    return wrapper
+
+
+def auth_required_async(
+    groups: Optional[Iterable[str]] = None,
+    any_group: bool = False,
+    use_cache: bool = True,
+) -> Callable[
+    [Callable[P, Coroutine[Any, Any, R]]], Callable[P, Coroutine[Any, Any, R]]
+]:
+    """The same as ``auth_required`` for an async view
+
+    The token is verified without blocking the event loop, so other requests
+    are served while the public keys of the user pool are downloaded.
+    """
+    policy = Policy(
+        groups=tuple(groups or ()), any_group=any_group, use_cache=use_cache
+    )
+
+    def wrapper(
+        fn: Callable[P, Coroutine[Any, Any, R]],
+    ) -> Callable[P, Coroutine[Any, Any, R]]:
+        @wraps(fn)
+        async def decorator(*args: P.args, **kwargs: P.kwargs) -> R:
+            auth = get_cognito_auth()
+
+            # return early if the extension is disabled
+            if not auth.cfg.disabled:
+                await authorise_request_async(auth, policy)
+
+            return await fn(*args, **kwargs)
 
         return decorator
 
@@ -17,6 +17,10 @@ class CognitoError(FlaskCognitoError):
     pass
 
 
+class CircuitOpenError(CognitoError):
+    """The request was not sent as the Cognito endpoint is failing"""
+
+
 class AuthorisationRequiredError(HTTPException):
     code = 403
     description = "Authorization is required to access this resource."
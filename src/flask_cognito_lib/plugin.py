@@ -1,16 +1,120 @@
-from typing import Any, Callable, Dict, Optional
-
-from flask import Flask, g
+import threading
+from typing import Any, Callable, Dict, Mapping, Optional, Union, cast
+from weakref import WeakKeyDictionary
+
+from flask import (
+    Blueprint,
+    Flask,
+    current_app,
+    has_app_context,
+    has_request_context,
+    request,
+)
+from flask.blueprints import BlueprintSetupState
 from typing_extensions import Self
 
-from flask_cognito_lib.config import Config
-from flask_cognito_lib.exceptions import CognitoError
+from flask_cognito_lib.config import Config, ConfigSnapshot
+from flask_cognito_lib.exceptions import CognitoError, ConfigurationError
+from flask_cognito_lib.policy import Policy, PolicyIndex, authorise_request
 from flask_cognito_lib.services import cognito_service_factory, token_service_factory
+from flask_cognito_lib.services.breaker_svc import (
+    BreakerStats,
+    clear_breakers,
+    get_breaker,
+)
 from flask_cognito_lib.services.cognito_svc import CognitoService
-from flask_cognito_lib.services.token_svc import TokenService
+from flask_cognito_lib.services.hedge_svc import HedgeStats, clear_hedgers, get_hedger
+from flask_cognito_lib.services.http_svc import clear_http_sessions
+from flask_cognito_lib.services.jwks_svc import (
+    JWKSStats,
+    clear_jwks_stores,
+    get_jwks_store,
+)
+from flask_cognito_lib.services.refresh_svc import clear_refresh_coalescers
+from flask_cognito_lib.services.revoke_svc import (
+    RevokeStats,
+    clear_revoke_queues,
+    get_revoke_queue,
+)
+from flask_cognito_lib.services.token_cache import CacheStats, clear_token_caches
+from flask_cognito_lib.services.token_svc import TokenService, clear_verifiers
 from flask_cognito_lib.utils import CognitoTokenResponse
 
 
+class _SharedKeys(ConfigSnapshot):
+    """The values of a configuration that the process-wide objects are keyed by
+
+    Read with the configuration, as by the time it is reloaded a custom
+    config object already returns the new values. An endpoint that is not
+    configured, e.g. without a domain, keys no object, so it is read as an
+    empty URL.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name: str) -> Any:
+        if isinstance(getattr(Config, name, None), property):
+            return ""
+        raise AttributeError(name)
+
+
+def _shared_keys(cfg: Config) -> Optional[Config]:
+    # Must be called in an app context
+    try:
+        return _SharedKeys(cfg)
+    except ConfigurationError:
+        # No user pool is configured, so no shared object was created for it
+        return None
+
+
+class _AppState:
+    """The configuration and services of the extension for one app"""
+
+    def __init__(self, cfg: Config, snapshot: bool) -> None:
+        self.cfg = cfg
+        # Read the config from the app again on reload, unless it is custom
+        self.snapshot = snapshot
+        # The services hold no per-request state, so one of each is shared
+        # by all requests and threads until the config is reloaded
+        self.token_service: Optional[TokenService] = None
+        self.cognito_service: Optional[CognitoService] = None
+        # What to clear of the process-wide objects on reload
+        self.shared_keys: Optional[Config] = None
+        self.lock = threading.Lock()
+
+    def read_config(self) -> None:
+        # Must be called in an app context
+        if self.snapshot:
+            cfg = Config()
+            try:
+                self.cfg = ConfigSnapshot(cfg)
+            except ConfigurationError:
+                if not cfg.disabled:
+                    raise
+                # Nothing reads the missing keys while the extension is disabled
+                self.cfg = cfg
+        self.shared_keys = _shared_keys(self.cfg)
+
+        with self.lock:
+            self.token_service = None
+            self.cognito_service = None
+
+
+def _clear_shared(cfg: Config) -> None:
+    """Remove the process-wide objects for the user pool client in ``cfg``
+
+    They are built again, with the current configuration, on first use.
+    """
+    clear_revoke_queues(timeout=10, cfg=cfg)
+    clear_refresh_coalescers(cfg)
+    clear_hedgers(cfg)
+    clear_verifiers(cfg)
+    clear_jwks_stores(cfg)
+    clear_token_caches(cfg)
+    clear_breakers(cfg)
+    clear_http_sessions(cfg)
+
+
 class CognitoAuth:
     def __init__(
         self,
@@ -31,52 +135,326 @@ class CognitoAuth:
         """
         self.token_service_factory = _token_service_factory
         self.cognito_service_factory = _cognito_service_factory
+        # One extension can be shared by several apps, each with its own
+        # configuration and services
+        self._states: "WeakKeyDictionary[Flask, _AppState]" = WeakKeyDictionary()
         if app is not None:
             self.init_app(app=app, cfg=cfg)
 
     def init_app(self: Self, app: Flask, cfg: Optional[Config] = None) -> None:
         """Register the extension with a Flask application
 
+        Without ``cfg``, the configuration is read from the app config once,
+        into a ``ConfigSnapshot``, so it must be set before calling this. A
+        missing key needed to verify tokens raises an error here rather than
+        on the first request. Call ``reload_config`` after changing the app
+        config.
+
+        The extension can be registered with several apps, and uses the
+        configuration and services of the current app.
+
         Parameters
         ----------
         app : Flask
             Flask application
         cfg : Optional[Config], optional
-            Configuration object to use. If not provided, a default Config is used.
+            Configuration object to use. If not provided, a snapshot of the
+            default Config is used. A custom object is used as is, so its
+            properties are still read on every use.
+
+        Raises
+        ------
+        ConfigurationError
+            If a configuration key needed to verify tokens is missing
         """
-        if cfg:
-            self.cfg = cfg
-        else:
-            self.cfg = Config()
-        app.extensions[self.cfg.APP_EXTENSION_KEY] = self
+        state = _AppState(cfg=Config() if cfg is None else cfg, snapshot=cfg is None)
+        self._states[app] = state
+        app.extensions[Config.APP_EXTENSION_KEY] = self
+
+        with app.app_context():
+            state.read_config()
+            self._load_jwks_snapshot(state.cfg)
+
+    @staticmethod
+    def _load_jwks_snapshot(cfg: Config) -> None:
+        # Warm the key store from disk so the first requests can be verified
+        # without downloading the user pool public keys
+        if snapshot_path := cfg.jwks_snapshot_path:
+            get_jwks_store(cfg).load_snapshot(
+                path=snapshot_path,
+                max_age=cfg.jwks_snapshot_max_age,
+            )
+
+    def reload_config(self: Self) -> None:
+        """Read the configuration from the current Flask app again
+
+        The new ``ConfigSnapshot`` replaces the old one in a single step, so
+        requests see either the old or the new configuration, and the
+        services are created again with it on first use. If a custom
+        configuration object was passed to ``init_app`` only the services are
+        created again.
+
+        The objects shared by all requests for the user pool client of the
+        old configuration (key store, verifier, caches, circuit breakers,
+        hedger, refresh coalescer, revocation queue and HTTP sessions) are
+        removed, and built again from the new configuration on first use.
+        Queued revocations are sent first. As these objects are shared by the
+        apps of the process that use the same user pool client, they are
+        built from the configuration of the app that uses them first.
+
+        Raises
+        ------
+        ConfigurationError
+            If a required configuration key is missing (unless the extension
+            is disabled), in which case the old configuration is kept
+        """
+        state = self._state()
+        old_keys = state.shared_keys
+        state.read_config()
+
+        if old_keys is not None:
+            _clear_shared(old_keys)
+        self._load_jwks_snapshot(state.cfg)
+
+    def _app(self: Self) -> Flask:
+        """Return the current app, which the extension must be registered with
+
+        Raises
+        ------
+        RuntimeError
+            If the extension is not registered with the current app, or there
+            is no app context and it is registered with more than one app
+        """
+        if has_app_context():
+            app = current_app._get_current_object()  # type: ignore[attr-defined]
+            if app in self._states:
+                return app
+        elif len(self._states) == 1:
+            # Unambiguous without an app context
+            (app,) = self._states.keys()
+            return app
+
+        raise RuntimeError("CognitoAuth is not registered with the current app")
+
+    def _state(self: Self) -> _AppState:
+        """Return the state of the extension for the current app"""
+        return self._states[self._app()]
+
+    @property
+    def cfg(self: Self) -> Config:
+        """Return the configuration of the extension for the current app
+
+        Returns
+        -------
+        Config
+            The ``ConfigSnapshot`` read by ``init_app`` or ``reload_config``,
+            or the custom config object passed to ``init_app`` or set here
+        """
+        return self._state().cfg
+
+    @cfg.setter
+    def cfg(self: Self, cfg: Config) -> None:
+        """Replace the configuration of the extension for the current app
+
+        ``cfg`` is used as is, as a custom config passed to ``init_app``, and
+        the services are created again with it on first use.
+        """
+        app = self._app()
+        state = _AppState(cfg=cfg, snapshot=False)
+        with app.app_context():
+            state.read_config()
+        self._states[app] = state
 
     @property
     def token_service(self: Self) -> TokenService:
-        """Instantiate an instance of the TokenService within the app context
+        """Return the TokenService, created on first use and shared by all requests
 
         Returns
         -------
         TokenService
-            An instance of TokenService
+            An instance of TokenService for the current app
         """
-        if not hasattr(g, self.cfg.CONTEXT_KEY_TOKEN_SERVICE):
-            token_service = self.token_service_factory(cfg=self.cfg)
-            setattr(g, self.cfg.CONTEXT_KEY_TOKEN_SERVICE, token_service)
-        return getattr(g, self.cfg.CONTEXT_KEY_TOKEN_SERVICE)
+        state = self._state()
+        token_service = state.token_service
+        if token_service is None:
+            with state.lock:
+                token_service = state.token_service
+                if token_service is None:
+                    token_service = self.token_service_factory(cfg=state.cfg)
+                    state.token_service = token_service
+        return token_service
 
     @property
     def cognito_service(self: Self) -> CognitoService:
-        """Instantiate an instance of the CognitoService within the app context
+        """Return the CognitoService, created on first use and shared by all requests
 
         Returns
         -------
         CognitoService
-            An instance of CognitoService
+            An instance of CognitoService for the current app
+        """
+        state = self._state()
+        cognito_service = state.cognito_service
+        if cognito_service is None:
+            with state.lock:
+                cognito_service = state.cognito_service
+                if cognito_service is None:
+                    cognito_service = self.cognito_service_factory(cfg=state.cfg)
+                    state.cognito_service = cognito_service
+        return cognito_service
+
+    def protect(
+        self: Self,
+        target: Union[Flask, Blueprint],
+        rules: Optional[Mapping[str, Optional[Policy]]] = None,
+        default: Optional[Policy] = Policy(),
+    ) -> PolicyIndex:
+        """Protect every route of an app or blueprint with AWS Cognito
+
+        Registers a single ``before_request`` hook on ``target`` that applies
+        the same checks as ``auth_required``, with the policy found for the
+        route in a ``PolicyIndex`` of ``rules``. For example, to require a
+        login for every route of a blueprint, the "admin" group under
+        "/admin", and no login for its "api.health" endpoint:
+
+            cognito_auth.protect(api, {
+                "/admin": Policy(groups=("admin",)),
+                "api.health": None,
+            })
+
+        When protecting an app, remember its "static" endpoint.
+
+        The rules for endpoints are checked here for an app, and when it is
+        registered with an app for a blueprint, so call this once the routes
+        they name are defined. The endpoints of a nested blueprint can be
+        named relative to it, e.g. "child.view" for "parent.child.view".
+
+        Parameters
+        ----------
+        target : Union[Flask, Blueprint]
+            The app or blueprint to protect
+        rules : Optional[Mapping[str, Optional[Policy]]], optional
+            Policies keyed by endpoint name or URL prefix, None makes a route
+            public, by default no rules
+        default : Optional[Policy], optional
+            Policy for the routes that match no rule, by default any logged
+            in user
+
+        Returns
+        -------
+        PolicyIndex
+            The index the policies of the routes are looked up in
+
+        Raises
+        ------
+        ConfigurationError
+            If a rule is for an endpoint of ``target`` that does not exist
         """
-        if not hasattr(g, self.cfg.CONTEXT_KEY_COGNITO_SERVICE):
-            cognito_service = self.cognito_service_factory(cfg=self.cfg)
-            setattr(g, self.cfg.CONTEXT_KEY_COGNITO_SERVICE, cognito_service)
-        return getattr(g, self.cfg.CONTEXT_KEY_COGNITO_SERVICE)
+        index = PolicyIndex(rules or {}, default)
+        if isinstance(target, Flask):
+            index.check(target)
+        else:
+
+            def register(state: BlueprintSetupState) -> None:
+                # Endpoints are named "parent.child.view", as the blueprint
+                # is registered (Flask < 2.0.1 has neither attribute)
+                name = getattr(state, "name", target.name)
+                prefix = getattr(state, "name_prefix", "")
+                index.qualify(target.name, f"{prefix}.{name}".lstrip("."))
+                index.check(cast(Flask, state.app))
+
+            target.record_once(register)
+
+        def check_policy() -> None:
+            if self.cfg.disabled:
+                return
+            policy = index.lookup(request.url_rule, request.path, current_app.url_map)
+            if policy is not None:
+                authorise_request(self, policy)
+
+        target.before_request(check_policy)
+        return index
+
+    def jwks_stats(self: Self) -> JWKSStats:
+        """Return statistics on the cached public keys of the user pool
+
+        Returns
+        -------
+        JWKSStats
+            A dataclass that holds the key store statistics, including the
+            time since the keys were last refreshed
+        """
+        return self.token_service.jwks.stats()
+
+    def claims_cache_stats(self: Self) -> Optional[CacheStats]:
+        """Return the hit and miss counters of the verified claims cache
+
+        Returns
+        -------
+        Optional[CacheStats]
+            A dataclass that holds the cache statistics, or None if the claims
+            cache is not enabled
+        """
+        cache = self.token_service.claims_cache
+        return cache.stats() if cache is not None else None
+
+    def rejected_cache_stats(self: Self) -> Optional[CacheStats]:
+        """Return the hit and miss counters of the rejected token cache
+
+        Returns
+        -------
+        Optional[CacheStats]
+            A dataclass that holds the cache statistics, or None if the
+            rejected token cache is not enabled
+        """
+        cache = self.token_service.rejected_cache
+        return cache.stats() if cache is not None else None
+
+    def breaker_stats(self: Self) -> Dict[str, BreakerStats]:
+        """Return the state of the circuit breakers of the Cognito endpoints
+
+        Returns
+        -------
+        Dict[str, BreakerStats]
+            Dataclasses that hold the state and statistics of the breakers of
+            the "token", "revoke" and "jwks" endpoints, empty if the circuit
+            breaker is not enabled
+        """
+        endpoints = {
+            "token": self.cfg.token_endpoint,
+            "revoke": self.cfg.revoke_endpoint,
+            "jwks": self.cfg.jwk_endpoint,
+        }
+        stats = {}
+        for name, url in endpoints.items():
+            breaker = get_breaker(url, self.cfg)
+            if breaker is not None:
+                stats[name] = breaker.stats()
+        return stats
+
+    def hedge_stats(self: Self) -> Optional[HedgeStats]:
+        """Return statistics on the hedged requests to the token endpoint
+
+        Returns
+        -------
+        Optional[HedgeStats]
+            A dataclass that holds the hedging statistics, or None if hedging
+            is not enabled
+        """
+        hedger = get_hedger(self.cfg.token_endpoint, self.cfg)
+        return hedger.stats() if hedger is not None else None
+
+    def revoke_stats(self: Self) -> Optional[RevokeStats]:
+        """Return statistics on the refresh tokens revoked in the background
+
+        Returns
+        -------
+        Optional[RevokeStats]
+            A dataclass that holds the queue depth and the number of revoked
+            and failed tokens, or None if the revocation queue is not enabled
+        """
+        revoke_queue = get_revoke_queue(self.cfg)
+        return revoke_queue.stats() if revoke_queue is not None else None
 
     def get_tokens(
         self: Self,
@@ -112,6 +490,28 @@ class CognitoAuth:
             If the request to the TOKEN endpoint fails
             If the TOKEN endpoint returns an error code
         """
+        code = self._check_state(request_args, expected_state)
+        return self.cognito_service.exchange_code_for_token(
+            code=code,
+            code_verifier=code_verifier,
+        )
+
+    async def get_tokens_async(
+        self: Self,
+        request_args: Dict[str, str],
+        expected_state: str,
+        code_verifier: str,
+    ) -> CognitoTokenResponse:
+        """The same as ``get_tokens`` without blocking the event loop"""
+        code = self._check_state(request_args, expected_state)
+        return await self.cognito_service.exchange_code_for_token_async(
+            code=code,
+            code_verifier=code_verifier,
+        )
+
+    @staticmethod
+    def _check_state(request_args: Dict[str, str], expected_state: str) -> str:
+        # Return the access code if the state returned from Cognito is correct
         try:
             code = request_args["code"]
             state = request_args["state"]
@@ -123,10 +523,7 @@ class CognitoAuth:
         if state != expected_state:
             raise CognitoError("State for CSRF is not correct")
 
-        return self.cognito_service.exchange_code_for_token(
-            code=code,
-            code_verifier=code_verifier,
-        )
+        return code
 
     def exchange_refresh_token(
         self: Self,
@@ -154,6 +551,15 @@ class CognitoAuth:
             refresh_token=refresh_token,
         )
 
+    async def exchange_refresh_token_async(
+        self: Self,
+        refresh_token: str,
+    ) -> CognitoTokenResponse:
+        """The same as ``exchange_refresh_token`` without blocking the event loop"""
+        return await self.cognito_service.exchange_refresh_token_async(
+            refresh_token=refresh_token,
+        )
+
     def revoke_refresh_token(
         self: Self,
         refresh_token: str,
@@ -177,7 +583,21 @@ class CognitoAuth:
             refresh_token=refresh_token,
         )
 
-    def verify_access_token(self: Self, token: str, leeway: float) -> Dict[str, Any]:
+    async def revoke_refresh_token_async(
+        self: Self,
+        refresh_token: str,
+    ) -> None:
+        """The same as ``revoke_refresh_token`` without blocking the event loop"""
+        await self.cognito_service.revoke_refresh_token_async(
+            refresh_token=refresh_token,
+        )
+
+    def verify_access_token(
+        self: Self,
+        token: str,
+        leeway: float,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
         """Verify the claims & signature of an access token in JWT format from Cognito
 
         This will check the audience, issuer, expiry and validate the signature
@@ -189,24 +609,102 @@ class CognitoAuth:
             The encoded JWT
         leeway : float
             A time margin in seconds for the expiration check
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
 
         Returns
         -------
         Dict[str, Any]
-            The verified claims from the encoded JWT
+            The verified claims from the encoded JWT. In a request, they are
+            also kept until the end of the request (see ``current_claims``)
+            and returned again for the same token without verifying it,
+            unless ``use_cache`` is False
 
         Raises
         ------
         TokenVerifyError
             If not token is passed, or any checks fail
         """
-        return self.token_service.verify_access_token(token=token, leeway=leeway)
+        memo = self._memoised_claims(token, leeway) if use_cache else None
+        if memo is not None:
+            return memo
+
+        claims = self.token_service.verify_access_token(
+            token=token,
+            leeway=leeway,
+            use_cache=use_cache,
+        )
+        self._memoise_claims(token, leeway, claims)
+        return claims
+
+    async def verify_access_token_async(
+        self: Self,
+        token: str,
+        leeway: float,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """The same as ``verify_access_token`` without blocking the event loop"""
+        memo = self._memoised_claims(token, leeway) if use_cache else None
+        if memo is not None:
+            return memo
+
+        claims = await self.token_service.verify_access_token_async(
+            token=token,
+            leeway=leeway,
+            use_cache=use_cache,
+        )
+        self._memoise_claims(token, leeway, claims)
+        return claims
+
+    @property
+    def current_claims(self: Self) -> Optional[Dict[str, Any]]:
+        """Return the claims of the access token verified in the current request
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            The claims of the access token last verified with
+            ``verify_access_token`` (e.g. by ``auth_required``), or None if no
+            access token has been verified in the current request
+        """
+        if not has_request_context():
+            return None
+        memo = getattr(request, self.cfg.CONTEXT_KEY_CLAIMS, None)
+        return dict(memo[2]) if memo is not None else None
+
+    def _memoised_claims(
+        self: Self,
+        token: str,
+        leeway: float,
+    ) -> Optional[Dict[str, Any]]:
+        # Claims of the same token already verified in this request
+        if not has_request_context():
+            return None
+        memo = getattr(request, self.cfg.CONTEXT_KEY_CLAIMS, None)
+        if memo is not None and memo[0] == token and memo[1] == leeway:
+            # A copy, so a caller changing it does not affect later guards
+            return dict(memo[2])
+        return None
+
+    def _memoise_claims(
+        self: Self,
+        token: str,
+        leeway: float,
+        claims: Dict[str, Any],
+    ) -> None:
+        # Kept on the request rather than on g, as an app context can be
+        # shared by several requests and outlive the token
+        if has_request_context():
+            memo = (token, leeway, dict(claims))
+            setattr(request, self.cfg.CONTEXT_KEY_CLAIMS, memo)
 
     def verify_id_token(
         self: Self,
         token: str,
         leeway: float,
         nonce: Optional[str] = None,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
         """Verify the claims & signature of an id token in JWT format from Cognito
 
@@ -221,6 +719,9 @@ class CognitoAuth:
             A time margin in seconds for the expiration check
         nonce : Optional[str]
             An optional nonce value to validate to prevent replay attacks
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
 
         Returns
         -------
@@ -236,4 +737,20 @@ class CognitoAuth:
             token=token,
             leeway=leeway,
             nonce=nonce,
+            use_cache=use_cache,
+        )
+
+    async def verify_id_token_async(
+        self: Self,
+        token: str,
+        leeway: float,
+        nonce: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """The same as ``verify_id_token`` without blocking the event loop"""
+        return await self.token_service.verify_id_token_async(
+            token=token,
+            leeway=leeway,
+            nonce=nonce,
+            use_cache=use_cache,
         )
@@ -0,0 +1,317 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from flask import Flask, request
+from werkzeug.routing import Map, Rule
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import (
+    AuthorisationRequiredError,
+    CognitoGroupRequiredError,
+    ConfigurationError,
+    TokenVerifyError,
+)
+
+if TYPE_CHECKING:
+    from flask_cognito_lib.plugin import CognitoAuth
+
+
+@dataclass(frozen=True)
+class Policy:
+    """The access required to a route, as set by ``auth_required``
+
+    Parameters
+    ----------
+    groups : Tuple[str, ...], optional
+        Groups the user must be a member of, by default none
+    any_group : bool, optional
+        Require membership of any one of the groups rather than all of them,
+        by default False
+    use_cache : bool, optional
+        Use the claims cache and rejected token cache (if enabled), by
+        default True
+    """
+
+    groups: Tuple[str, ...] = ()
+    any_group: bool = False
+    use_cache: bool = True
+
+
+def check_group_membership(
+    claims: Dict[str, Iterable[str]],
+    groups: Iterable[str],
+    any_group: bool,
+) -> bool:
+    if "cognito:groups" not in claims:
+        raise CognitoGroupRequiredError("No groups found in claims")
+
+    if any_group:
+        return any(g in claims["cognito:groups"] for g in groups)
+    return all(g in claims["cognito:groups"] for g in groups)
+
+
+@contextmanager
+def _authorisation_errors() -> Iterator[None]:
+    # A missing or invalid token means the user must log in again
+    try:
+        yield
+    except CognitoGroupRequiredError:
+        raise
+    except (TokenVerifyError, KeyError):
+        raise AuthorisationRequiredError
+
+
+def _get_access_token(cfg: Config) -> str:
+    access_token = request.cookies.get(cfg.COOKIE_NAME)
+    if access_token is None:
+        raise AuthorisationRequiredError
+    return access_token
+
+
+def _check_groups(claims: Dict[str, Any], policy: Policy) -> None:
+    # Check for required group membership
+    if policy.groups:
+        if not check_group_membership(claims, policy.groups, policy.any_group):
+            raise CognitoGroupRequiredError
+
+
+def authorise_request(auth: "CognitoAuth", policy: Policy) -> Dict[str, Any]:
+    """Check the access token of the current request meets ``policy``
+
+    Parameters
+    ----------
+    auth : CognitoAuth
+        The extension of the current app
+    policy : Policy
+        The access required
+
+    Returns
+    -------
+    Dict[str, Any]
+        The verified claims of the access token
+
+    Raises
+    ------
+    AuthorisationRequiredError
+        If there is no access token, or it is not valid
+    CognitoGroupRequiredError
+        If the user is not a member of the required groups
+    """
+    cfg = auth.cfg
+    with _authorisation_errors():
+        claims = auth.verify_access_token(
+            token=_get_access_token(cfg),
+            leeway=cfg.cognito_expiration_leeway,
+            use_cache=policy.use_cache,
+        )
+        _check_groups(claims, policy)
+    return claims
+
+
+async def authorise_request_async(
+    auth: "CognitoAuth",
+    policy: Policy,
+) -> Dict[str, Any]:
+    """The same as ``authorise_request`` without blocking the event loop"""
+    cfg = auth.cfg
+    with _authorisation_errors():
+        claims = await auth.verify_access_token_async(
+            token=_get_access_token(cfg),
+            leeway=cfg.cognito_expiration_leeway,
+            use_cache=policy.use_cache,
+        )
+        _check_groups(claims, policy)
+    return claims
+
+
+def _matches(path: str, prefix: str) -> bool:
+    # Prefixes match whole path segments, "/admin" does not match "/admins"
+    return not prefix or path == prefix or path.startswith(prefix + "/")
+
+
+def _check_endpoints(endpoints: Iterable[str], known: Iterable[str]) -> None:
+    unknown = set(endpoints) - set(known)
+    if unknown:
+        raise ConfigurationError(
+            f"No routes for the protected endpoints: {', '.join(sorted(unknown))}"
+        )
+
+
+class PolicyIndex:
+    def __init__(
+        self,
+        rules: Mapping[str, Optional[Policy]],
+        default: Optional[Policy] = Policy(),
+    ) -> None:
+        """Finds the policy of a route from rules for endpoints and URL prefixes
+
+        A rule for an endpoint name (as used with ``url_for``, e.g.
+        "admin.edit") takes precedence over rules for URL prefixes (starting
+        with "/"), where the longest matching prefix wins. Routes matched by
+        no rule get the ``default`` policy. A policy of None makes a route
+        public. Prefixes are matched against the path of the request, so a
+        rule for "/api/admin" also applies to "/api/admin/users" when served
+        by a catch-all route such as "/api/<path:p>".
+
+        The policy of every route of the app is resolved once, on the first
+        request, as routes cannot be added after that. Each request then
+        takes a single dictionary lookup, except for routes with a variable
+        part that a longer prefix may match, such as the catch-all route
+        above, whose policy is resolved from the path of every request.
+
+        Parameters
+        ----------
+        rules : Mapping[str, Optional[Policy]]
+            Policies keyed by endpoint name or URL prefix
+        default : Optional[Policy], optional
+            Policy for the routes that match no rule, by default any logged
+            in user
+        """
+        self.endpoints = {k: v for k, v in rules.items() if not k.startswith("/")}
+        self.prefixes: List[Tuple[str, Optional[Policy]]] = sorted(
+            ((k.rstrip("/"), v) for k, v in rules.items() if k.startswith("/")),
+            key=lambda rule: len(rule[0]),
+            reverse=True,
+        )
+        self.default = default
+        self._index: Optional[Dict[Tuple[str, str], Optional[Policy]]] = None
+
+    def resolve(self, endpoint: str, path: str) -> Optional[Policy]:
+        """Return the policy of the route with ``endpoint`` and URL ``path``"""
+        if endpoint in self.endpoints:
+            return self.endpoints[endpoint]
+        for prefix, policy in self.prefixes:
+            if _matches(path, prefix):
+                return policy
+        return self.default
+
+    def _by_path(self, endpoint: str, rule: str) -> bool:
+        # A prefix longer than the static start of a rule, e.g. "/api/admin"
+        # for "/api/<path:p>", matches some of its paths and not others
+        if endpoint in self.endpoints or "<" not in rule:
+            return False
+        static = rule.partition("<")[0]
+        return any(
+            len(prefix) > len(static) and prefix.startswith(static)
+            for prefix, _ in self.prefixes
+        )
+
+    def qualify(self, name: str, registered_name: str) -> None:
+        """Rename the endpoint rules of a nested blueprint after registration
+
+        The endpoints of a blueprint registered within another are prefixed
+        with the name of its parent, e.g. "child.view" becomes
+        "parent.child.view", so rules can name them either way.
+
+        Parameters
+        ----------
+        name : str
+            The name of the blueprint
+        registered_name : str
+            The name of the blueprint as registered with the app
+        """
+        if registered_name == name:
+            return
+        self.endpoints = {
+            registered_name + k[len(name) :] if k.startswith(name + ".") else k: v
+            for k, v in self.endpoints.items()
+        }
+
+    def check(self, app: Flask) -> None:
+        """Check the endpoint rules of ``app`` and its blueprints have routes
+
+        Called when the app or blueprint is protected, so a misconfiguration
+        is found at startup. Endpoints of blueprints that are not registered
+        yet, such as those nested in the protected blueprint, are checked
+        when the index is built, on the first request.
+
+        Parameters
+        ----------
+        app : Flask
+            The app, with the routes of the protected app or blueprint
+
+        Raises
+        ------
+        ConfigurationError
+            If a rule is for an endpoint that does not exist
+        """
+        # Endpoints are named after their blueprint, e.g. "admin.edit"
+        registered = {"", *app.blueprints}
+        endpoints = [e for e in self.endpoints if e.rpartition(".")[0] in registered]
+        _check_endpoints(endpoints, app.view_functions)
+
+    def build(self, url_map: Map) -> Dict[Tuple[str, str], Optional[Policy]]:
+        """Resolve the policy of every route in ``url_map``
+
+        Routes whose policy depends on the path of the request are left out.
+        The index is kept even if a rule is for an endpoint that does not
+        exist, as such a rule matches no route, so the error is raised once
+        rather than on every request.
+
+        Returns
+        -------
+        Dict[Tuple[str, str], Optional[Policy]]
+            The policies keyed by endpoint and URL rule
+
+        Raises
+        ------
+        ConfigurationError
+            If a rule is for an endpoint that does not exist
+        """
+        rules = list(url_map.iter_rules())
+        index = {
+            (rule.endpoint, rule.rule): self.resolve(rule.endpoint, rule.rule)
+            for rule in rules
+            if not self._by_path(rule.endpoint, rule.rule)
+        }
+        # Requests racing to build the index build the same one
+        self._index = index
+
+        _check_endpoints(self.endpoints, (rule.endpoint for rule in rules))
+        return index
+
+    def lookup(
+        self,
+        rule: Optional[Rule],
+        path: str,
+        url_map: Map,
+    ) -> Optional[Policy]:
+        """Return the policy of the route ``rule`` of a request
+
+        Parameters
+        ----------
+        rule : Optional[Rule]
+            The URL rule matched by the request, None if none matched
+        path : str
+            The path of the request
+        url_map : Map
+            The URL map of the app, used to build the index on first use
+
+        Returns
+        -------
+        Optional[Policy]
+            The policy of the route, or None if the route is public or there
+            is no route for the request
+        """
+        if rule is None:
+            return None
+
+        index = self._index
+        if index is None:
+            index = self.build(url_map)
+
+        key = (rule.endpoint, rule.rule)
+        if key in index:
+            return index[key]
+        return self.resolve(rule.endpoint, path)
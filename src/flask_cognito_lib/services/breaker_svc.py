@@ -0,0 +1,253 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CircuitOpenError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Called with the endpoint, the old state and the new state
+Listener = Callable[[str, str, str], None]
+
+
+@dataclass
+class BreakerStats:
+    endpoint: str
+    state: str
+    failure_rate: float
+    calls: int
+    rejected: int
+    transitions: int
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        endpoint: str,
+        failure_rate: float,
+        window: int = 20,
+        min_calls: int = 10,
+        slow_call: float = 0,
+        open_seconds: float = 30,
+    ) -> None:
+        """A circuit breaker for the requests to one Cognito endpoint
+
+        The outcome of the last ``window`` requests is recorded. Once at least
+        ``min_calls`` have been recorded and the fraction that failed (or were
+        slower than ``slow_call``) reaches ``failure_rate`` the breaker opens,
+        and requests fail fast with ``CircuitOpenError`` rather than waiting
+        on a degraded endpoint. After ``open_seconds`` the breaker is half
+        open: a single probe request is let through, which closes the breaker
+        if it succeeds or opens it again if it fails.
+
+        Parameters
+        ----------
+        endpoint : str
+            URL of the endpoint
+        failure_rate : float
+            Fraction of failed requests that opens the breaker, between 0 and 1
+        window : int, optional
+            Number of recent requests to take the failure rate over, by
+            default 20
+        min_calls : int, optional
+            Minimum number of recorded requests before the breaker can open,
+            by default 10
+        slow_call : float, optional
+            Count requests that take longer than this (in seconds) as failed,
+            by default 0 (disabled)
+        open_seconds : float, optional
+            Time (in seconds) to fail fast for before probing, by default 30
+        """
+        self.endpoint = endpoint
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._rejected = 0
+        self._transitions = 0
+        self._listeners: List[Listener] = []
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def add_listener(self, callback: Listener) -> None:
+        """Call ``callback(endpoint, old_state, new_state)`` on every transition
+
+        The callback is called in the thread that made the request, and must
+        not raise.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def before_request(self) -> bool:
+        """Check the breaker before sending a request
+
+        Must be followed by ``record`` once the request has finished.
+
+        Returns
+        -------
+        bool
+            True if the request is the probe of a half open breaker
+
+        Raises
+        ------
+        CircuitOpenError
+            If the breaker is open, or half open and already probing
+        """
+        with self._lock:
+            old = self._state
+            if old == CLOSED:
+                return False
+
+            if old == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = HALF_OPEN
+
+            if self._state != HALF_OPEN or self._probing:
+                self._rejected += 1
+                raise CircuitOpenError(
+                    f"Requests to {self.endpoint} are failing, try again later"
+                )
+            self._probing = True
+
+        if old != HALF_OPEN:
+            self._transition(old, HALF_OPEN)
+        return True
+
+    def record(self, ok: bool, elapsed: float, probe: bool = False) -> None:
+        """Record the outcome of a request let through by ``before_request``
+
+        Parameters
+        ----------
+        ok : bool
+            False if the request failed, e.g. a connection error or HTTP 5xx
+        elapsed : float
+            Duration of the request, in seconds
+        probe : bool
+            The value returned by ``before_request`` for the request
+        """
+        failed = not ok or bool(self.slow_call and elapsed > self.slow_call)
+        with self._lock:
+            old = self._state
+            if probe:
+                # The probe decides if the endpoint has recovered
+                self._probing = False
+                self._outcomes.clear()
+                self._state = OPEN if failed else CLOSED
+            else:
+                self._outcomes.append(not failed)
+                if old == CLOSED and self._tripped():
+                    self._state = OPEN
+
+            if self._state == OPEN and old != OPEN:
+                self._opened_at = time.monotonic()
+            new = self._state
+
+        if old != new:
+            self._transition(old, new)
+
+    def _tripped(self) -> bool:
+        # Must be called holding the lock
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return False
+        failures = calls - sum(self._outcomes)
+        return failures / calls >= self.failure_rate
+
+    def _transition(self, old: str, new: str) -> None:
+        with self._lock:
+            self._transitions += 1
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(self.endpoint, old, new)
+
+    def stats(self) -> BreakerStats:
+        """Return the state and statistics of the breaker
+
+        Returns
+        -------
+        BreakerStats
+            A dataclass that holds the state of the breaker, the failure rate
+            of the recent requests and the number of requests rejected while
+            open and of state transitions
+        """
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = calls - sum(self._outcomes)
+            return BreakerStats(
+                endpoint=self.endpoint,
+                state=self._state,
+                failure_rate=failures / calls if calls else 0.0,
+                calls=calls,
+                rejected=self._rejected,
+                transitions=self._transitions,
+            )
+
+
+# Process-wide circuit breakers, keyed by endpoint URL
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint: str, cfg: Config) -> Optional[CircuitBreaker]:
+    """Return the process-wide circuit breaker for ``endpoint``
+
+    Parameters
+    ----------
+    endpoint : str
+        URL of the Cognito endpoint, e.g. ``cfg.token_endpoint``
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[CircuitBreaker]
+        The breaker shared by all requests to this endpoint, or None if
+        ``AWS_COGNITO_BREAKER_FAILURE_RATE`` is not set
+    """
+    if not cfg.breaker_failure_rate:
+        return None
+
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    failure_rate=cfg.breaker_failure_rate,
+                    window=cfg.breaker_window,
+                    min_calls=cfg.breaker_min_calls,
+                    slow_call=cfg.breaker_slow_call,
+                    open_seconds=cfg.breaker_open_seconds,
+                )
+                _breakers[endpoint] = breaker
+    return breaker
+
+
+def clear_breakers(cfg: Optional[Config] = None) -> None:
+    """Remove the circuit breakers
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the breakers of the Cognito endpoints in ``cfg``, by
+        default all breakers are removed
+    """
+    with _breakers_lock:
+        if cfg is None:
+            _breakers.clear()
+        else:
+            for endpoint in (cfg.token_endpoint, cfg.revoke_endpoint, cfg.jwk_endpoint):
+                _breakers.pop(endpoint, None)
@@ -1,4 +1,7 @@
-from typing import Dict, List, Optional
+import asyncio
+import time
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import quote
 
 import requests
@@ -6,6 +9,15 @@ from requests import JSONDecodeError, Response
 
 from flask_cognito_lib.config import Config
 from flask_cognito_lib.exceptions import CognitoError
+from flask_cognito_lib.services.breaker_svc import get_breaker
+from flask_cognito_lib.services.hedge_svc import get_hedger
+from flask_cognito_lib.services.http_svc import (
+    RetryPolicy,
+    get_http_session,
+    get_timeout,
+    request_not_sent,
+)
+from flask_cognito_lib.services.refresh_svc import get_refresh_coalescer
 from flask_cognito_lib.utils import CognitoTokenResponse
 
 
@@ -105,6 +117,10 @@ class CognitoService:
     ) -> CognitoTokenResponse:
         """Exchange a refresh token for a new set of tokens
 
+        Concurrent exchanges of the same refresh token in this process share
+        a single request to Cognito (see ``RefreshCoalescer``), as do those in
+        other processes if ``AWS_COGNITO_REFRESH_LOCK_DIR`` is set.
+
         Parameters:
         -----------
         refresh_token : str
@@ -128,7 +144,10 @@ class CognitoService:
             "refresh_token": refresh_token,
         }
 
-        return self._request_token(data)
+        # Concurrent exchanges of the same refresh token share one request
+        return get_refresh_coalescer(self.cfg).exchange(
+            refresh_token, partial(self._request_token, data)
+        )
 
     # Original typo in method name - keep for backward compatibility.
     exhange_refresh_token = exchange_refresh_token
@@ -158,6 +177,41 @@ class CognitoService:
 
         self._request(url=self.cfg.revoke_endpoint, data=data)
 
+    async def exchange_code_for_token_async(
+        self,
+        code: str,
+        code_verifier: str,
+    ) -> CognitoTokenResponse:
+        """Exchange an authorisation code for tokens without blocking the event loop
+
+        See ``exchange_code_for_token``. The request is made in a thread.
+        """
+        return await asyncio.to_thread(
+            self.exchange_code_for_token, code=code, code_verifier=code_verifier
+        )
+
+    async def exchange_refresh_token_async(
+        self,
+        refresh_token: str,
+    ) -> CognitoTokenResponse:
+        """Exchange a refresh token for tokens without blocking the event loop
+
+        See ``exchange_refresh_token``. The request is made in a thread.
+        """
+        return await asyncio.to_thread(
+            self.exchange_refresh_token, refresh_token=refresh_token
+        )
+
+    async def revoke_refresh_token_async(
+        self,
+        refresh_token: str,
+    ) -> None:
+        """Revoke a refresh token without blocking the event loop
+
+        See ``revoke_refresh_token``. The request is made in a thread.
+        """
+        await asyncio.to_thread(self.revoke_refresh_token, refresh_token=refresh_token)
+
     def _request_token(self, data: Dict[str, str]) -> CognitoTokenResponse:
         """Request a token from the Cognito token endpoint
 
@@ -177,22 +231,46 @@ class CognitoService:
             If the request to the endpoint fails
             If the endpoint returns an error code
         """
-        response = self._request(url=self.cfg.token_endpoint, data=data)
+        # An authorisation code can only be used once, so the request must not
+        # be retried if Cognito may have received it, or hedged
+        response = self._request(
+            url=self.cfg.token_endpoint,
+            data=data,
+            idempotent=data["grant_type"] != "authorization_code",
+            hedge=data["grant_type"] == "refresh_token",
+        )
 
         try:
             return CognitoTokenResponse(**response.json())
         except JSONDecodeError as e:
             raise CognitoError(str(e)) from e
 
-    def _request(self, url: str, data: Dict[str, str]) -> Response:
+    def _request(
+        self,
+        url: str,
+        data: Dict[str, str],
+        idempotent: bool = True,
+        hedge: bool = False,
+    ) -> Response:
         """Make a request to the Cognito endpoint
 
+        The request is sent over the process-wide keep-alive session for the
+        Cognito domain (see ``get_http_session``), and retried as set by the
+        ``AWS_COGNITO_RETRY_*`` config.
+
         Parameters
         ----------
         url : str
             The URL of the endpoint
         data : Dict[str, str]
             The data to be sent as part of the request
+        idempotent : bool
+            If False, the request is only retried if it failed before it was
+            sent or was throttled (HTTP 429), never once the server may have
+            processed it, by default True
+        hedge : bool
+            Send the request again if it is slow, as set by the
+            ``AWS_COGNITO_HEDGE_*`` config (see ``Hedger``), by default False
 
         Returns
         -------
@@ -213,15 +291,38 @@ class CognitoService:
         else:
             auth = None
 
-        try:
-            response = requests.post(
-                url=url,
-                data=data,
-                auth=auth,
-            )
-
-        except requests.exceptions.RequestException as e:
-            raise CognitoError(str(e)) from e
+        send = partial(self._send, url=url, data=data, auth=auth)
+        hedger = get_hedger(url, self.cfg) if hedge else None
+        if hedger is not None:
+            send = partial(hedger.run, send)
+
+        policy = RetryPolicy.from_config(self.cfg)
+        attempt = 1
+        while True:
+            retry_after = None
+            try:
+                response = send()
+            except requests.exceptions.RequestException as e:
+                if attempt >= policy.max_attempts or not (
+                    idempotent or request_not_sent(e)
+                ):
+                    raise CognitoError(str(e)) from e
+            else:
+                status = response.status_code
+                if (
+                    attempt >= policy.max_attempts
+                    or status not in policy.status_codes
+                    or not (idempotent or status == 429)
+                ):
+                    break
+                retry_after = response.headers.get("Retry-After")
+
+            delay = policy.delay(attempt, retry_after)
+            if delay == float("inf"):
+                # Cognito asked us to wait for longer than we are willing to
+                break
+            time.sleep(delay)
+            attempt += 1
 
         try:
             response_json = response.json()
@@ -237,3 +338,37 @@ class CognitoService:
             pass
 
         return response
+
+    def _send(
+        self,
+        url: str,
+        data: Dict[str, str],
+        auth: Optional[Tuple[str, str]],
+    ) -> Response:
+        """Send a single request, guarded by the endpoint circuit breaker
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit breaker of the endpoint is open
+        requests.exceptions.RequestException
+            If the request fails
+        """
+        session = get_http_session(url, self.cfg.http_pool_size)
+        breaker = get_breaker(url, self.cfg)
+        if breaker is None:
+            return session.post(
+                url=url, data=data, auth=auth, timeout=get_timeout(self.cfg)
+            )
+
+        probe = breaker.before_request()
+        started = time.monotonic()
+        ok = False
+        try:
+            response = session.post(
+                url=url, data=data, auth=auth, timeout=get_timeout(self.cfg)
+            )
+            ok = response.status_code < 500 and response.status_code != 429
+            return response
+        finally:
+            breaker.record(ok, time.monotonic() - started, probe)
@@ -0,0 +1,258 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+from flask_cognito_lib.config import Config
+
+T = TypeVar("T")
+
+# Latency samples needed before the hedge delay is taken from them
+MIN_SAMPLES = 20
+
+
+@dataclass
+class HedgeStats:
+    requests: int
+    hedged: int
+    hedge_wins: int
+    delay: float
+
+
+class Hedger:
+    def __init__(
+        self,
+        percentile: float,
+        max_rate: float = 0.05,
+        initial_delay: float = 1,
+        window: int = 100,
+        max_workers: int = 20,
+    ) -> None:
+        """Sends a second copy of a slow request, and uses the first response
+
+        A request that has not completed within the ``percentile`` latency of
+        recent requests is sent again, so a small fraction of slow responses
+        no longer sets the tail latency. Only use this for idempotent
+        requests, as both copies may be processed by the server.
+
+        The extra requests are capped with a token bucket: every request adds
+        ``max_rate`` tokens (up to one) and every hedge spends a whole token,
+        so at most that fraction of requests are hedged, even when the
+        endpoint is slow for everybody.
+
+        A request is only sent from a worker thread while it could be hedged
+        and a worker is free, so it starts at once and the hedge delay is not
+        spent waiting for a worker. Otherwise (no budget, or ``max_workers``
+        requests already in flight) it is sent from the calling thread and
+        not hedged, so an overloaded process does not add more requests.
+
+        Parameters
+        ----------
+        percentile : float
+            Percentile (0-100) of recent latencies to wait for before hedging
+        max_rate : float, optional
+            Maximum fraction of requests that are hedged, by default 0.05
+        initial_delay : float, optional
+            Delay (in seconds) used until enough requests have completed to
+            take the percentile, by default 1
+        window : int, optional
+            Number of recent latencies to keep, by default 100
+        max_workers : int, optional
+            Maximum number of requests in flight on worker threads, by
+            default 20
+        """
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.initial_delay = initial_delay
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._budget = 1.0
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+        # Free workers, so a request is never queued behind others
+        self._free = threading.Semaphore(max_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cognito-hedge"
+        )
+
+    def delay(self) -> float:
+        """Return how long to wait for a response before hedging, in seconds"""
+        with self._lock:
+            return self._delay()
+
+    def _delay(self) -> float:
+        # Must be called holding the lock
+        if len(self._latencies) < MIN_SAMPLES:
+            return self.initial_delay
+        latencies = sorted(self._latencies)
+        return latencies[round(self.percentile / 100 * (len(latencies) - 1))]
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        started = time.monotonic()
+        result = fn()
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    def _run_on_worker(self, fn: Callable[[], T]) -> T:
+        try:
+            return self._timed(fn)
+        finally:
+            self._free.release()
+
+    def _submit(self, fn: Callable[[], T]) -> "Optional[Future[T]]":
+        # Returns None rather than queueing if no worker is free
+        if not self._free.acquire(blocking=False):
+            return None
+        # Run in a copy of the caller's context, e.g. the Flask app context
+        context = contextvars.copy_context()
+        try:
+            return self._executor.submit(context.run, self._run_on_worker, fn)
+        except RuntimeError:
+            # Closed, e.g. replaced after the config was reloaded
+            self._free.release()
+            return None
+
+    def run(self, fn: Callable[[], T]) -> T:
+        """Call ``fn``, calling it again if the first call is slow
+
+        Parameters
+        ----------
+        fn : Callable[[], T]
+            The request to make
+
+        Returns
+        -------
+        T
+            The result of whichever call succeeded first
+
+        Raises
+        ------
+        Exception
+            The error of the last call to fail, if neither succeeded
+        """
+        with self._lock:
+            self._requests += 1
+            self._budget = min(1.0, self._budget + self.max_rate)
+            delay = self._delay()
+            can_hedge = self._budget >= 1
+
+        first = self._submit(fn) if can_hedge else None
+        if first is None:
+            return self._timed(fn)
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        with self._lock:
+            hedge = self._budget >= 1
+            if hedge:
+                self._budget -= 1
+        second = self._submit(fn) if hedge else None
+        with self._lock:
+            if second is None and hedge:
+                # No worker to send the hedge from, refund it
+                self._budget += 1
+            elif second is not None:
+                self._hedged += 1
+        if second is None:
+            return first.result()
+
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (first, second):
+                if future in done and future.exception() is None:
+                    if future is second:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return future.result()
+
+        # Both failed
+        return second.result()
+
+    def stats(self) -> HedgeStats:
+        """Return statistics on the hedged requests
+
+        Returns
+        -------
+        HedgeStats
+            A dataclass that holds the number of requests, how many of them
+            were hedged and how often the hedge responded first, and the
+            current hedge delay
+        """
+        with self._lock:
+            return HedgeStats(
+                requests=self._requests,
+                hedged=self._hedged,
+                hedge_wins=self._hedge_wins,
+                delay=self._delay(),
+            )
+
+    def close(self) -> None:
+        """Stop the worker threads once the requests in flight have finished"""
+        self._executor.shutdown(wait=False)
+
+
+# Process-wide hedgers, keyed by endpoint URL
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(endpoint: str, cfg: Config) -> Optional[Hedger]:
+    """Return the process-wide hedger for requests to ``endpoint``
+
+    Parameters
+    ----------
+    endpoint : str
+        URL of the Cognito endpoint
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[Hedger]
+        The hedger shared by all requests to this endpoint, or None if
+        ``AWS_COGNITO_HEDGE_PERCENTILE`` is not set
+    """
+    if not cfg.hedge_percentile:
+        return None
+
+    hedger = _hedgers.get(endpoint)
+    if hedger is None:
+        with _hedgers_lock:
+            hedger = _hedgers.get(endpoint)
+            if hedger is None:
+                hedger = Hedger(
+                    percentile=cfg.hedge_percentile,
+                    max_rate=cfg.hedge_max_rate,
+                    initial_delay=cfg.hedge_initial_delay,
+                    max_workers=2 * cfg.http_pool_size,
+                )
+                _hedgers[endpoint] = hedger
+    return hedger
+
+
+def clear_hedgers(cfg: Optional[Config] = None) -> None:
+    """Stop the worker threads of the hedgers and remove them
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the hedgers of the Cognito endpoints in ``cfg``, by
+        default all hedgers are removed
+    """
+    with _hedgers_lock:
+        if cfg is None:
+            hedgers = list(_hedgers.values())
+            _hedgers.clear()
+        else:
+            endpoints = (cfg.token_endpoint, cfg.revoke_endpoint, cfg.jwk_endpoint)
+            popped = (_hedgers.pop(endpoint, None) for endpoint in endpoints)
+            hedgers = [hedger for hedger in popped if hedger is not None]
+
+    for hedger in hedgers:
+        hedger.close()
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from flask_cognito_lib.config import Config
+
+# Process-wide sessions, keyed by the scheme and host of the URL
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # The session is shared by all users, never keep cookies from a response
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_http_session(url: str, pool_size: int = 10) -> requests.Session:
+    """Return the process-wide session for the host of ``url``
+
+    The session keeps a pool of keep-alive connections to the host, so
+    requests from any thread reuse an open connection rather than paying for
+    a new TCP and TLS handshake.
+
+    Parameters
+    ----------
+    url : str
+        A URL on the Cognito host
+    pool_size : int, optional
+        Maximum number of connections to keep open if the session is created
+        by this call (``AWS_COGNITO_HTTP_POOL_SIZE``), by default 10
+
+    Returns
+    -------
+    requests.Session
+        The session shared by all requests to this host
+    """
+    origin = _origin(url)
+    session = _sessions.get(origin)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(origin)
+            if session is None:
+                session = _sessions[origin] = _new_session(pool_size)
+    return session
+
+
+def get_timeout(cfg: Config) -> Tuple[float, float]:
+    """Return the (connect, read) timeout for requests to Cognito"""
+    return (cfg.http_connect_timeout, cfg.http_read_timeout)
+
+
+def clear_http_sessions(cfg: Optional[Config] = None) -> None:
+    """Close the connections of the sessions and remove them
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the sessions for the Cognito hosts in ``cfg``, by default
+        all sessions are removed
+    """
+    with _sessions_lock:
+        if cfg is None:
+            sessions = list(_sessions.values())
+            _sessions.clear()
+        else:
+            origins = {_origin(cfg.token_endpoint), _origin(cfg.jwk_endpoint)}
+            popped = (_sessions.pop(origin, None) for origin in origins)
+            sessions = [session for session in popped if session is not None]
+
+    for session in sessions:
+        session.close()
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """When and how long to wait before retrying a failed request
+
+    Retries back off exponentially from ``base_delay``, with a random
+    ``jitter`` fraction so clients that failed together do not retry
+    together, and honour the ``Retry-After`` header of a response.
+    """
+
+    max_attempts: int = 1
+    base_delay: float = 0.1
+    max_delay: float = 5
+    jitter: float = 1
+    status_codes: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+
+    @classmethod
+    def from_config(cls, cfg: Config) -> "RetryPolicy":
+        return cls(
+            max_attempts=cfg.retry_max_attempts,
+            base_delay=cfg.retry_base_delay,
+            max_delay=cfg.retry_max_delay,
+            jitter=cfg.retry_jitter,
+            status_codes=frozenset(cfg.retry_status_codes),
+        )
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Return the delay in seconds before retrying after ``attempt`` failed
+
+        Parameters
+        ----------
+        attempt : int
+            The number of the attempt that failed, starting from 1
+        retry_after : Optional[str]
+            The ``Retry-After`` header of the failed response, if any
+
+        Returns
+        -------
+        float
+            The delay, or infinity if ``Retry-After`` asks for longer than
+            ``max_delay``
+        """
+        wait = parse_retry_after(retry_after) if retry_after else None
+        if wait is not None:
+            return wait if wait <= self.max_delay else float("inf")
+
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return backoff * (1 - self.jitter * random.random())
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """Return the delay in seconds of a ``Retry-After`` header, or None"""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def request_not_sent(err: requests.RequestException) -> bool:
+    """Return True if the request failed before it could reach the server
+
+    Only these failures are safe to retry for requests that must not be
+    processed twice, as any other failure (e.g. a read timeout) may happen
+    after the server has acted on the request.
+    """
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(err, requests.exceptions.ConnectionError) and err.args:
+        reason = err.args[0]
+        if isinstance(reason, MaxRetryError):
+            return isinstance(reason.reason, NewConnectionError)
+    return False
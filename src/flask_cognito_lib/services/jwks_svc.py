@@ -0,0 +1,681 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
+
+import requests
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from jwt import PyJWK, PyJWKClient, PyJWKClientError, PyJWKSet, PyJWTError
+from jwt.exceptions import PyJWKClientConnectionError
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CircuitOpenError
+from flask_cognito_lib.services.breaker_svc import CircuitBreaker, get_breaker
+from flask_cognito_lib.services.http_svc import get_http_session, get_timeout
+
+
+class KeyNotFoundError(PyJWKClientError):
+    """The key set was downloaded but does not contain the requested key ID"""
+
+
+class JWKSClient(PyJWKClient):
+    def __init__(
+        self,
+        uri: str,
+        session: requests.Session,
+        timeout: Tuple[float, float],
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        """Downloads the key set over a shared keep-alive ``requests`` session
+
+        Parameters
+        ----------
+        uri : str
+            URL of the user pool ``jwks.json`` endpoint
+        session : requests.Session
+            The session to download the key set with
+        timeout : Tuple[float, float]
+            The connect and read timeouts, in seconds
+        breaker : Optional[CircuitBreaker]
+            The circuit breaker of the endpoint, if enabled
+        """
+        super().__init__(uri, cache_jwk_set=False)
+        self.session = session
+        self.http_timeout = timeout
+        self.breaker = breaker
+
+    def fetch_data(self) -> Any:
+        probe = False
+        if self.breaker is not None:
+            try:
+                probe = self.breaker.before_request()
+            except CircuitOpenError as e:
+                raise PyJWKClientConnectionError(str(e)) from e
+
+        started = time.monotonic()
+        ok = False
+        try:
+            response = self.session.get(
+                self.uri, timeout=self.http_timeout, allow_redirects=False
+            )
+            response.raise_for_status()
+            data = response.json()
+            ok = True
+        except (requests.RequestException, ValueError) as e:
+            raise PyJWKClientConnectionError(
+                f'Fail to fetch data from the url, err: "{e}"'
+            ) from e
+        finally:
+            if self.breaker is not None:
+                self.breaker.record(ok, time.monotonic() - started, probe)
+
+        if not isinstance(data, dict):
+            raise PyJWKClientError("The JWKS endpoint did not return a JSON object")
+        return data
+
+
+@dataclass
+class JWKSStats:
+    jwk_endpoint: str
+    key_count: int
+    last_refresh_age: Optional[float]
+    stale: bool
+    refreshing: bool
+    refresher_running: bool
+    refresh_count: int
+    error_count: int
+    last_error: Optional[str] = None
+
+
+class _Flight:
+    """An in-progress download of the key set that other threads can wait on"""
+
+    def __init__(self) -> None:
+        self._done = threading.Event()
+        self._result: Optional[PyJWKSet] = None
+        self._error: Optional[PyJWKClientError] = None
+
+    def finish(
+        self,
+        result: Optional[PyJWKSet] = None,
+        error: Optional[PyJWKClientError] = None,
+    ) -> None:
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def wait(self) -> PyJWKSet:
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return cast(PyJWKSet, self._result)
+
+
+class JWKSStore:
+    def __init__(
+        self,
+        jwk_endpoint: str,
+        ttl: float = 3600,
+        max_staleness: float = 0,
+        min_refetch_interval: float = 30,
+        snapshot_path: Optional[str] = None,
+        session: Optional[requests.Session] = None,
+        timeout: Tuple[float, float] = (5, 10),
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        """A thread-safe cache of the JSON Web Key Set (JWKS) of a user pool
+
+        A single store is shared by every request and thread in the process
+        (see ``get_jwks_store``) so the key set is only downloaded when it is
+        first needed, once the TTL has passed, or when a token is signed with
+        a key ID that is not in the cached set (i.e. the keys were rotated).
+
+        Parameters
+        ----------
+        jwk_endpoint : str
+            URL of the user pool ``jwks.json`` endpoint
+        ttl : float, optional
+            Time (in seconds) to cache the key set for, by default 3600
+        max_staleness : float, optional
+            Time (in seconds) past the TTL that the last good key set is still
+            served for if the JWKS endpoint cannot be reached, by default 0
+        min_refetch_interval : float, optional
+            Minimum time (in seconds) between downloads caused by tokens with
+            an unknown key ID, by default 30
+        snapshot_path : Optional[str], optional
+            File to write a snapshot of the key set to after every successful
+            download (see ``load_snapshot``), by default None
+        session : Optional[requests.Session], optional
+            The session to download the key set with, by default the
+            process-wide session for the endpoint host (see
+            ``get_http_session``)
+        timeout : Tuple[float, float], optional
+            The connect and read timeouts of the download in seconds, by
+            default (5, 10)
+        breaker : Optional[CircuitBreaker], optional
+            The circuit breaker of the endpoint, by default None
+        """
+        self.jwk_endpoint = jwk_endpoint
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.min_refetch_interval = min_refetch_interval
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = 0.0
+        self._client = JWKSClient(
+            jwk_endpoint,
+            session=session or get_http_session(jwk_endpoint),
+            timeout=timeout,
+            breaker=breaker,
+        )
+        self._lock = threading.Lock()
+        self._jwks: Optional[Dict[str, Any]] = None
+        self._jwk_set: Optional[PyJWKSet] = None
+        self._keys: Dict[str, RSAPublicKey] = {}
+        self._fetched_at = 0.0
+        self._inflight: Optional[_Flight] = None
+        self._refresh_count = 0
+        self._error_count = 0
+        self._last_error: Optional[str] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @property
+    def age(self) -> float:
+        """Return the time (in seconds) since the key set was last fetched"""
+        return time.monotonic() - self._fetched_at
+
+    @property
+    def expired(self) -> bool:
+        """Return True if the key set has not been fetched or the TTL has passed"""
+        return self._jwk_set is None or self.age > self.ttl
+
+    @property
+    def usable_when_stale(self) -> bool:
+        """Return True if an expired key set is within the max staleness window"""
+        return self._jwk_set is not None and self.age <= self.ttl + self.max_staleness
+
+    def fetch(self, min_age: float = 0) -> PyJWKSet:
+        """Download and parse the key set from the user pool, replacing the cache
+
+        Concurrent calls are coalesced into a single request (single-flight):
+        a thread that calls this while a download is in progress waits for it
+        and shares its result rather than making its own request.
+
+        Parameters
+        ----------
+        min_age : float, optional
+            Return the cached key set instead if it was downloaded less than
+            ``min_age`` seconds ago, by default 0
+
+        Returns
+        -------
+        PyJWKSet
+            The freshly downloaded key set
+
+        Raises
+        ------
+        PyJWKClientError
+            If the request to the JWKS endpoint fails or returns no valid keys
+        """
+        with self._lock:
+            flight = self._inflight
+            if flight is None:
+                jwk_set = self._jwk_set
+                if jwk_set is not None and min_age and self.age < min_age:
+                    return jwk_set
+                flight = self._inflight = _Flight()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            data = self._client.fetch_data()
+            jwk_set = PyJWKSet.from_dict(data)
+
+        except Exception as exc:
+            # Waiting threads must always be released, whatever the failure
+            err = exc if isinstance(exc, PyJWKClientError) else PyJWKClientError(exc)
+            with self._lock:
+                self._inflight = None
+                self._error_count += 1
+                self._last_error = str(err)
+            flight.finish(error=err)
+            if err is exc:
+                raise
+            raise err from exc
+
+        keys = _index_keys(jwk_set)
+        with self._lock:
+            self._inflight = None
+            self._refresh_count += 1
+            changed = self._install(data, jwk_set, keys)
+        flight.finish(result=jwk_set)
+
+        if changed:
+            self._notify(data)
+
+        if self.snapshot_path:
+            self.save_snapshot(self.snapshot_path)
+
+        return jwk_set
+
+    def load_snapshot(self, path: str, max_age: float) -> bool:
+        """Load a key set previously written by ``save_snapshot``
+
+        This allows a new process to verify tokens before it has made any
+        request to the JWKS endpoint. A loaded key set keeps the age it had
+        when written, so one older than the TTL is downloaded again on first
+        use, and is only used meanwhile within the max staleness window.
+
+        Parameters
+        ----------
+        path : str
+            Path of the snapshot file
+        max_age : float
+            Ignore the snapshot if it was written more than ``max_age``
+            seconds ago
+
+        Returns
+        -------
+        bool
+            True if the snapshot was loaded, False if it is missing, invalid,
+            too old or for a different user pool
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            age = time.time() - float(snapshot["saved_at"])
+            if snapshot["jwk_endpoint"] != self.jwk_endpoint or not 0 <= age <= max_age:
+                return False
+            data = snapshot["jwks"]
+            jwk_set = PyJWKSet.from_dict(data)
+        except (OSError, ValueError, TypeError, KeyError, PyJWTError):
+            return False
+
+        keys = _index_keys(jwk_set)
+        with self._lock:
+            changed = self._install(data, jwk_set, keys, age=age)
+
+        if changed:
+            self._notify(data)
+        return True
+
+    def _install(
+        self,
+        data: Dict[str, Any],
+        jwk_set: PyJWKSet,
+        keys: Dict[str, RSAPublicKey],
+        age: float = 0,
+    ) -> bool:
+        # Must be called holding the lock. The key index is replaced rather
+        # than updated so readers never need the lock. Returns True if the
+        # keys are different from the ones already installed. ``age`` is the
+        # time since the keys were downloaded, for keys loaded from a file.
+        changed = data != self._jwks
+        self._jwks = data
+        self._jwk_set = jwk_set
+        self._keys = keys
+        self._fetched_at = time.monotonic() - age
+        return changed
+
+    @property
+    def jwks(self) -> Optional[Dict[str, Any]]:
+        """Return the cached key set as returned by the JWKS endpoint"""
+        return self._jwks
+
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Call ``callback`` with the new key set whenever the keys change
+
+        The callback is called from the thread that downloaded or loaded the
+        keys, after they have been installed.
+
+        Parameters
+        ----------
+        callback : Callable[[Dict[str, Any]], None]
+            Called with the key set as returned by the JWKS endpoint
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Stop calling a callback added with ``add_listener``"""
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _notify(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(data)
+
+    def save_snapshot(self, path: str) -> bool:
+        """Atomically write the current key set to a file
+
+        The key set is written to a temporary file in the same directory that
+        then replaces ``path``, so readers never see a partially written file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the snapshot file
+
+        Returns
+        -------
+        bool
+            True if the snapshot was written, False if there is no key set or
+            the file could not be written
+        """
+        data = self._jwks
+        if data is None:
+            return False
+
+        snapshot = {
+            "jwk_endpoint": self.jwk_endpoint,
+            "saved_at": time.time(),
+            "jwks": data,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix=".jwks-", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            # The snapshot only speeds up cold starts, never fail a request
+            return False
+
+        return True
+
+    def get_jwk_set(self) -> PyJWKSet:
+        """Return the cached key set, fetching it if missing or expired
+
+        An expired key set is still returned (stale-while-revalidate) while
+        another thread or the background refresher is downloading a new one,
+        and (stale-if-error) if the download fails but the key set is within
+        the max staleness window.
+
+        Returns
+        -------
+        PyJWKSet
+            The key set of the user pool
+
+        Raises
+        ------
+        PyJWKClientError
+            If the key set cannot be fetched and there is no usable stale copy
+        """
+        jwk_set = self._jwk_set
+        if jwk_set is not None:
+            if not self.expired:
+                return jwk_set
+
+            if self.usable_when_stale and (self.refreshing or self.refresher_running):
+                # Let the refresher (or the other thread) revalidate the keys
+                self._wake.set()
+                return jwk_set
+
+        try:
+            return self.fetch()
+        except PyJWKClientError:
+            if jwk_set is not None and self.usable_when_stale:
+                return jwk_set
+            raise
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        """Return the public key with the given key ID
+
+        If the key ID is not in the cached set, the set is downloaded again in
+        case the user pool keys have been rotated. Concurrent misses share one
+        download, and no more than one download per ``min_refetch_interval`` is
+        made for unknown key IDs so forged ``kid`` headers cannot be used to
+        flood the JWKS endpoint.
+
+        Parameters
+        ----------
+        kid : str
+            The key ID from the header of a JWT
+
+        Returns
+        -------
+        PyJWK
+            The matching public key
+
+        Raises
+        ------
+        KeyNotFoundError
+            If the key set does not contain the key ID
+        PyJWKClientError
+            If the key set cannot be fetched
+        """
+        try:
+            return self.get_jwk_set()[kid]
+        except KeyError:
+            pass
+
+        try:
+            return self.fetch(min_age=self.min_refetch_interval)[kid]
+        except KeyError as err:
+            raise KeyNotFoundError(
+                f'Unable to find a signing key that matches: "{kid}"'
+            ) from err
+
+    def has_key(self, kid: str) -> bool:
+        """Return True if ``get_key`` can return the key without downloading"""
+        return kid in self._keys and not self.expired
+
+    def get_key(self, kid: str) -> RSAPublicKey:
+        """Return the parsed RSA public key with the given key ID
+
+        This is the fast path for verifying tokens: while the key set is fresh
+        it is a single lookup in an index of ready-to-use ``cryptography`` keys
+        that is built once per key set, without taking any lock. Otherwise it
+        falls back to ``get_signing_key``.
+
+        Parameters
+        ----------
+        kid : str
+            The key ID from the header of a JWT
+
+        Returns
+        -------
+        RSAPublicKey
+            The matching public key
+
+        Raises
+        ------
+        KeyNotFoundError
+            If the key set does not contain the key ID
+        PyJWKClientError
+            If the key set cannot be fetched
+        """
+        key = self._keys.get(kid)
+        if key is not None and not self.expired:
+            return key
+        return self.get_signing_key(kid).key
+
+    @property
+    def refreshing(self) -> bool:
+        """Return True if the key set is being downloaded"""
+        return self._inflight is not None
+
+    @property
+    def refresher_running(self) -> bool:
+        """Return True if the background refresher thread is running"""
+        return self._refresher is not None and self._refresher.is_alive()
+
+    def start_refresher(self, interval: float) -> None:
+        """Start a daemon thread that downloads the key set every ``interval``
+
+        The interval should be shorter than the TTL so that requests never have
+        to wait for the key set to be downloaded. Calling this again while the
+        refresher is running only updates the interval.
+
+        Parameters
+        ----------
+        interval : float
+            Time (in seconds) between refreshes
+        """
+        with self._lock:
+            self.refresh_interval = interval
+            if self.refresher_running:
+                return
+
+            self._stop.clear()
+            self._wake.clear()
+            self._refresher = threading.Thread(
+                target=self._refresh_loop,
+                name="flask-cognito-lib-jwks-refresher",
+                daemon=True,
+            )
+            self._refresher.start()
+
+    def stop_refresher(self, timeout: Optional[float] = None) -> None:
+        """Stop the background refresher thread (if running)
+
+        Parameters
+        ----------
+        timeout : Optional[float], optional
+            Time (in seconds) to wait for the thread to finish, by default None
+        """
+        with self._lock:
+            thread = self._refresher
+            self._refresher = None
+            self._stop.set()
+            self._wake.set()
+
+        if thread is not None:
+            thread.join(timeout)
+
+    def _refresh_loop(self) -> None:
+        while True:
+            # Refresh when the interval has passed, or sooner if a request
+            # found the key set expired
+            delay = 0.0
+            if self._jwk_set is not None:
+                delay = max(self.refresh_interval - self.age, 0)
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+
+            try:
+                self.fetch()
+            except PyJWKClientError:
+                # Recorded in the stats, keep serving the last good keys and
+                # try again at the next interval (ignoring nudges from requests)
+                if self._stop.wait(self.refresh_interval):
+                    return
+
+    def stats(self) -> JWKSStats:
+        """Return statistics on the state of the key store
+
+        Returns
+        -------
+        JWKSStats
+            A dataclass that holds the key store statistics
+        """
+        jwk_set = self._jwk_set
+        return JWKSStats(
+            jwk_endpoint=self.jwk_endpoint,
+            key_count=len(jwk_set.keys) if jwk_set is not None else 0,
+            last_refresh_age=self.age if jwk_set is not None else None,
+            stale=self.expired,
+            refreshing=self.refreshing,
+            refresher_running=self.refresher_running,
+            refresh_count=self._refresh_count,
+            error_count=self._error_count,
+            last_error=self._last_error,
+        )
+
+
+def _index_keys(jwk_set: PyJWKSet) -> Dict[str, RSAPublicKey]:
+    """Map the key ID of each RSA signing key in a key set to its public key"""
+    return {
+        jwk.key_id: jwk.key
+        for jwk in jwk_set.keys
+        if jwk.key_id
+        and jwk.public_key_use in ("sig", None)
+        and isinstance(jwk.key, RSAPublicKey)
+    }
+
+
+_stores: Dict[str, JWKSStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_jwks_store(cfg: Config) -> JWKSStore:
+    """Return the process-wide key store for the user pool issuer in ``cfg``
+
+    The background refresher is started the first time the store is used with
+    ``AWS_COGNITO_JWKS_REFRESH_INTERVAL`` set.
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    JWKSStore
+        The key store shared by all requests for this issuer
+    """
+    issuer = cfg.issuer
+    store = _stores.get(issuer)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(issuer)
+            if store is None:
+                store = JWKSStore(
+                    cfg.jwk_endpoint,
+                    ttl=cfg.jwks_cache_ttl,
+                    max_staleness=cfg.jwks_max_staleness,
+                    min_refetch_interval=cfg.jwks_min_refetch_interval,
+                    snapshot_path=cfg.jwks_snapshot_path,
+                    session=get_http_session(cfg.jwk_endpoint, cfg.http_pool_size),
+                    timeout=get_timeout(cfg),
+                    breaker=get_breaker(cfg.jwk_endpoint, cfg),
+                )
+                _stores[issuer] = store
+
+    if cfg.jwks_refresh_interval and not store.refresher_running:
+        store.start_refresher(cfg.jwks_refresh_interval)
+
+    return store
+
+
+def clear_jwks_stores(cfg: Optional[Config] = None) -> None:
+    """Stop any background refreshers and remove the cached key stores
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the store for the user pool issuer in ``cfg``, by default
+        all stores are removed
+    """
+    with _stores_lock:
+        if cfg is None:
+            stores = list(_stores.values())
+            _stores.clear()
+        else:
+            store = _stores.pop(cfg.issuer, None)
+            stores = [store] if store is not None else []
+
+    for store in stores:
+        store.stop_refresher()
@@ -0,0 +1,206 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.hashes import SHA256
+from jwt import PyJWKSet
+
+from flask_cognito_lib.services.jwks_svc import JWKSStore, _index_keys
+
+# Public keys of the worker process, set when the worker starts
+_worker_keys: Dict[str, RSAPublicKey] = {}
+
+
+def _init_worker(jwks: Dict[str, Any]) -> None:
+    global _worker_keys
+    _worker_keys = _index_keys(PyJWKSet.from_dict(jwks))
+
+
+def _ping() -> None:
+    pass
+
+
+def _verify_signature(
+    kid: str,
+    signing_input: bytes,
+    signature: bytes,
+) -> Optional[bool]:
+    """Verify an RS256 signature in a worker process
+
+    Returns None if the worker does not have the key, so the caller can
+    verify the signature itself.
+    """
+    key = _worker_keys.get(kid)
+    if key is None:
+        return None
+
+    try:
+        key.verify(signature, signing_input, PKCS1v15(), SHA256())
+    except InvalidSignature:
+        return False
+    return True
+
+
+@dataclass
+class OffloadStats:
+    processes: int
+    pool_running: bool
+    pool_restarts: int
+    offloaded: int
+    inline: int
+    timeouts: int
+
+
+class SignatureOffloader:
+    def __init__(self, jwks: JWKSStore, processes: int, timeout: float = 1) -> None:
+        """Verifies RSA signatures on a pool of worker processes
+
+        Signature checks are CPU bound and hold the GIL in the calling process
+        for part of their run time, so on threaded workers they compete with
+        the application. The pool is started with the current public keys of
+        the user pool and replaced with a pool started with the new keys
+        whenever the key set changes, so the workers never need to download
+        or parse keys while verifying.
+
+        The worker processes are spawned rather than forked, as forking a
+        process with running threads is not safe.
+
+        Parameters
+        ----------
+        jwks : JWKSStore
+            The store of the user pool public keys
+        processes : int
+            Number of worker processes
+        timeout : float, optional
+            Maximum time (in seconds) to wait for a worker to verify a
+            signature, by default 1
+        """
+        self.jwks = jwks
+        self.processes = processes
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._restarts = 0
+        self._offloaded = 0
+        self._inline = 0
+        self._timeouts = 0
+        self._closed = False
+        jwks.add_listener(self._keys_changed)
+
+    def _start(self, jwks: Dict[str, Any]) -> ProcessPoolExecutor:
+        # Must be called holding the lock
+        pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(jwks,),
+        )
+        # Start the workers now rather than on the first verification
+        for _ in range(self.processes):
+            pool.submit(_ping)
+        return pool
+
+    def _keys_changed(self, jwks: Dict[str, Any]) -> None:
+        with self._lock:
+            old, self._pool = self._pool, None
+            if old is not None and not self._closed:
+                self._pool = self._start(jwks)
+                self._restarts += 1
+
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self._pool is None and not self._closed:
+                if (jwks := self.jwks.jwks) is not None:
+                    self._pool = self._start(jwks)
+            return self._pool
+
+    def verify(
+        self, kid: str, signing_input: bytes, signature: bytes
+    ) -> Optional[bool]:
+        """Verify an RS256 signature with the key ``kid`` on the process pool
+
+        Parameters
+        ----------
+        kid : str
+            The key ID from the header of the JWT
+        signing_input : bytes
+            The signed header and payload segments of the JWT
+        signature : bytes
+            The decoded signature of the JWT
+
+        Returns
+        -------
+        Optional[bool]
+            True if the signature is valid, or None if it could not be
+            verified on the pool (e.g. the pool is restarting with new keys,
+            or no worker answered within the timeout) and should be verified
+            by the caller
+        """
+        pool = self._get_pool()
+        result = None
+        timed_out = False
+        if pool is not None:
+            try:
+                future = pool.submit(_verify_signature, kid, signing_input, signature)
+                result = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # The workers are slow to start or stuck, don't hold up the
+                # request any longer
+                future.cancel()
+                timed_out = True
+            except (BrokenProcessPool, RuntimeError):
+                # The pool was replaced or shut down while submitting
+                self._reset(pool)
+
+        with self._lock:
+            self._timeouts += timed_out
+            if result is None:
+                self._inline += 1
+            else:
+                self._offloaded += 1
+        return result
+
+    def _reset(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def close(self) -> None:
+        """Shut down the worker processes"""
+        self.jwks.remove_listener(self._keys_changed)
+        with self._lock:
+            self._closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self) -> OffloadStats:
+        """Return statistics on the process pool
+
+        Returns
+        -------
+        OffloadStats
+            A dataclass that holds how many signatures were verified on the
+            pool and in the calling process, and how many of those in the
+            calling process waited for the pool in vain
+        """
+        with self._lock:
+            return OffloadStats(
+                processes=self.processes,
+                pool_running=self._pool is not None,
+                pool_restarts=self._restarts,
+                offloaded=self._offloaded,
+                inline=self._inline,
+                timeouts=self._timeouts,
+            )
@@ -0,0 +1,408 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from dataclasses import asdict, replace
+from typing import Callable, Dict, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import ConfigurationError
+from flask_cognito_lib.services.token_cache import CacheKey, _LRUCache, token_digest
+from flask_cognito_lib.services.token_svc import TokenService
+from flask_cognito_lib.utils import CognitoTokenResponse
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+def _size(tokens: CognitoTokenResponse) -> int:
+    return sum(
+        len(token or "")
+        for token in (tokens.access_token, tokens.id_token, tokens.refresh_token)
+    )
+
+
+class RefreshBackend(ABC):
+    """Shares refresh token exchanges between the processes of a deployment
+
+    Subclasses must implement ``exchange`` so that, for a given refresh token
+    digest, one process sends the request to Cognito and the others reuse its
+    response, e.g. the workers of a gunicorn server.
+    """
+
+    @abstractmethod
+    def exchange(
+        self,
+        digest: bytes,
+        request: Callable[[], CognitoTokenResponse],
+    ) -> CognitoTokenResponse:
+        """Exchange the refresh token with ``digest``, or reuse a response
+
+        Parameters
+        ----------
+        digest : bytes
+            The SHA-256 digest of the refresh token
+        request : Callable[[], CognitoTokenResponse]
+            Sends the exchange request to Cognito
+
+        Returns
+        -------
+        CognitoTokenResponse
+            The token response, from ``request`` or another process
+        """
+
+
+class FileRefreshBackend(RefreshBackend):
+    def __init__(
+        self,
+        directory: str,
+        key: bytes,
+        ttl: float = 10,
+        lock_timeout: float = 30,
+    ) -> None:
+        """Shares refresh token exchanges between the processes on one host
+
+        Exchanges hold an exclusive file lock for the refresh token digest
+        while the request is sent, so only exchanges of the same refresh
+        token wait for each other. The response is written to a result file
+        next to it, encrypted with Fernet. Processes that were waiting for
+        the lock read that file instead of sending another request, until it
+        is ``ttl`` seconds old. Expired result files, and lock files that
+        nobody holds, are removed when a new result is written.
+
+        Parameters
+        ----------
+        directory : str
+            Directory for the lock and result files, created if missing. It
+            must be on a local filesystem that supports ``flock``.
+        key : bytes
+            The Fernet key used to encrypt the result files
+        ttl : float, optional
+            Time (in seconds) to reuse a response for, by default 10
+        lock_timeout : float, optional
+            Time (in seconds) to wait for the lock before sending the request
+            anyway, by default 30
+
+        Raises
+        ------
+        ConfigurationError
+            If file locks are not supported on this platform
+        """
+        if fcntl is None:
+            raise ConfigurationError("File locks are not supported on this platform")
+
+        self.directory = directory
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._fernet = Fernet(key)
+        self._shared = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @property
+    def shared(self) -> int:
+        """The number of exchanges that reused the response of another one"""
+        with self._lock:
+            return self._shared
+
+    def exchange(
+        self,
+        digest: bytes,
+        request: Callable[[], CognitoTokenResponse],
+    ) -> CognitoTokenResponse:
+        lock_path = os.path.join(self.directory, f"{digest.hex()}.lock")
+        result_path = os.path.join(self.directory, f"{digest.hex()}.result")
+
+        fd, locked = self._open_locked(lock_path)
+        try:
+            if locked:
+                tokens = self._read(result_path)
+                if tokens is not None:
+                    with self._lock:
+                        self._shared += 1
+                    return tokens
+
+            tokens = request()
+            try:
+                self._write(result_path, tokens)
+            except OSError:
+                # Sharing the response is best effort, the new tokens must
+                # reach the caller as the refresh token may have been rotated
+                pass
+            return tokens
+
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def _open_locked(self, path: str) -> Tuple[int, bool]:
+        # Open the lock file and lock it, returning whether it is locked
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            # Each open file has its own lock, so threads exclude each other too
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if not self._acquire(fd, deadline):
+                return fd, False
+
+            # The file may have been removed while waiting for the lock, in
+            # which case another process may hold the lock of a new one
+            try:
+                if os.path.samestat(os.fstat(fd), os.stat(path)):
+                    return fd, True
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _acquire(self, fd: int, deadline: float) -> bool:
+        # flock has no timeout, so poll without blocking until the deadline
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.01)
+
+    def _read(self, path: str) -> Optional[CognitoTokenResponse]:
+        try:
+            with open(path, "rb") as f:
+                result = json.loads(self._fernet.decrypt(f.read()))
+        except (OSError, InvalidToken, ValueError):
+            return None
+
+        if result["expires_at"] <= time.time():
+            return None
+        return CognitoTokenResponse(**result["tokens"])
+
+    def _write(self, path: str, tokens: CognitoTokenResponse) -> None:
+        now = time.time()
+        ttl = min(self.ttl, tokens.expires_in or self.ttl)
+        result = {"expires_at": now + ttl, "tokens": asdict(tokens)}
+        data = self._fernet.encrypt(json.dumps(result).encode())
+
+        # Write to a temporary file first so readers never see part of it
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+        self._remove_expired(now)
+
+    def _remove_expired(self, now: float) -> None:
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime + self.ttl >= now:
+                        continue
+                    if entry.name.endswith(".result"):
+                        os.unlink(entry.path)
+                    elif entry.name.endswith(".lock"):
+                        self._remove_lock(entry.path)
+                except FileNotFoundError:
+                    # Removed by another process
+                    pass
+
+    def _remove_lock(self, path: str) -> None:
+        # Only remove a lock file nobody holds, and hold its lock while doing
+        # so, as waiters check that the file they locked is still in place
+        fd = os.open(path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        else:
+            if os.path.samestat(os.fstat(fd), os.stat(path)):
+                os.unlink(path)
+        finally:
+            os.close(fd)
+
+
+class RefreshCoalescer(_LRUCache):
+    def __init__(
+        self,
+        ttl: float = 0,
+        max_entries: int = 1024,
+        max_bytes: int = 4 * 1024 * 1024,
+        backend: Optional[RefreshBackend] = None,
+    ) -> None:
+        """Shares one refresh token exchange between concurrent callers
+
+        When the access token expires, every open tab of a user refreshes it
+        at the same time with the same refresh token. Concurrent exchanges of
+        the same refresh token (keyed by its digest) wait for the first one
+        and share its response, so only one request is sent to Cognito.
+
+        If ``ttl`` is set the response is also cached for callers that arrive
+        shortly after, until the earlier of ``ttl`` seconds or the expiry of
+        the new tokens. Errors are never cached.
+
+        A ``backend`` also shares the exchanges with other processes, see
+        ``FileRefreshBackend``.
+
+        Parameters
+        ----------
+        ttl : float, optional
+            Time (in seconds) to cache the response for, by default 0
+            (only concurrent exchanges are shared)
+        max_entries : int, optional
+            Maximum number of cached responses, by default 1024
+        max_bytes : int, optional
+            Maximum total length of the cached tokens, by default 4MiB
+        backend : Optional[RefreshBackend], optional
+            Shares the exchanges between processes, by default None
+        """
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes)
+        self.ttl = ttl
+        self.backend = backend
+        self._flights: Dict[CacheKey, "Future[CognitoTokenResponse]"] = {}
+        self._coalesced = 0
+
+    @property
+    def coalesced(self) -> int:
+        """The number of exchanges that waited for another caller's request"""
+        with self._lock:
+            return self._coalesced
+
+    def exchange(
+        self,
+        refresh_token: str,
+        request: Callable[[], CognitoTokenResponse],
+    ) -> CognitoTokenResponse:
+        """Exchange ``refresh_token`` with ``request`` unless already in flight
+
+        Parameters
+        ----------
+        refresh_token : str
+            The refresh token to exchange
+        request : Callable[[], CognitoTokenResponse]
+            Sends the exchange request to Cognito
+
+        Returns
+        -------
+        CognitoTokenResponse
+            A copy of the shared token response
+
+        Raises
+        ------
+        CognitoError
+            If the shared request fails
+        """
+        key = ("refresh", token_digest(refresh_token))
+        if self.ttl:
+            cached = self._get(key)
+            if cached is not None:
+                return replace(cached)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = Future()
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            return replace(flight.result())
+
+        try:
+            if self.backend is None:
+                tokens = request()
+            else:
+                tokens = self.backend.exchange(key[1], request)
+            if self.ttl:
+                expires_in = min(self.ttl, tokens.expires_in or self.ttl)
+                self._put(key, tokens, time.time() + expires_in, _size(tokens))
+            flight.set_result(tokens)
+            return replace(tokens)
+
+        except BaseException as err:
+            flight.set_exception(err)
+            raise
+
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+
+def get_refresh_backend(cfg: Config) -> Optional[RefreshBackend]:
+    """Return the backend that shares refresh token exchanges between processes
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[RefreshBackend]
+        ``AWS_COGNITO_REFRESH_BACKEND`` if set, else a ``FileRefreshBackend``
+        if ``AWS_COGNITO_REFRESH_LOCK_DIR`` is set, else None
+    """
+    if cfg.refresh_backend is not None:
+        return cfg.refresh_backend
+    if cfg.refresh_lock_dir:
+        return FileRefreshBackend(
+            directory=cfg.refresh_lock_dir,
+            key=TokenService.get_encryption_key(cfg),
+            ttl=cfg.refresh_lock_ttl,
+        )
+    return None
+
+
+_coalescers: Dict[Tuple[str, str], RefreshCoalescer] = {}
+_coalescers_lock = threading.Lock()
+
+
+def get_refresh_coalescer(cfg: Config) -> RefreshCoalescer:
+    """Return the process-wide refresh coalescer for the client in ``cfg``
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    RefreshCoalescer
+        The coalescer shared by all requests for this user pool client
+    """
+    key = (cfg.token_endpoint, cfg.user_pool_client_id)
+    coalescer = _coalescers.get(key)
+    if coalescer is None:
+        with _coalescers_lock:
+            coalescer = _coalescers.get(key)
+            if coalescer is None:
+                coalescer = RefreshCoalescer(
+                    ttl=cfg.refresh_cache_ttl,
+                    backend=get_refresh_backend(cfg),
+                )
+                _coalescers[key] = coalescer
+    return coalescer
+
+
+def clear_refresh_coalescers(cfg: Optional[Config] = None) -> None:
+    """Remove the refresh coalescers and their cached responses
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the coalescer for the user pool client in ``cfg``, by
+        default all coalescers are removed
+    """
+    with _coalescers_lock:
+        if cfg is None:
+            _coalescers.clear()
+        else:
+            _coalescers.pop((cfg.token_endpoint, cfg.user_pool_client_id), None)
@@ -0,0 +1,241 @@
+import atexit
+import contextvars
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CircuitOpenError, CognitoError
+
+_Job = Tuple[contextvars.Context, Callable[[], None]]
+
+
+@dataclass
+class RevokeStats:
+    depth: int
+    revoked: int
+    retried: int
+    failed: int
+    rejected: int
+
+
+def is_transient(err: CognitoError) -> bool:
+    """Return True if a failed request to Cognito is worth retrying
+
+    The endpoint was unreachable, timed out or its circuit breaker is open.
+    Errors returned by Cognito, e.g. an invalid token, are not transient.
+    """
+    return isinstance(err, CircuitOpenError) or isinstance(
+        err.__cause__, requests.exceptions.RequestException
+    )
+
+
+class RevokeQueue:
+    def __init__(
+        self,
+        max_size: int,
+        max_attempts: int = 3,
+        retry_delay: float = 1,
+    ) -> None:
+        """Revokes refresh tokens in a background thread
+
+        Logging out then does not wait for the request to Cognito. Jobs are
+        run in order by a single worker thread, in a copy of the context they
+        were submitted from (e.g. the Flask app context). A job that fails
+        with a transient error (see ``is_transient``) is retried after
+        ``retry_delay`` seconds, doubling on every attempt.
+
+        The queue holds at most ``max_size`` jobs; ``submit`` returns False
+        when it is full so the caller can revoke the token itself. ``close``
+        runs the jobs left in the queue before the worker stops, and is
+        called for every queue when the interpreter exits.
+
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of jobs waiting in the queue
+        max_attempts : int, optional
+            Maximum number of attempts per job, by default 3
+        retry_delay : float, optional
+            Delay (in seconds) before the first retry, by default 1
+        """
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max_size)
+        self._closing = threading.Event()
+        self._revoked = 0
+        self._retried = 0
+        self._failed = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(
+            target=self._run, name="cognito-revoke", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, revoke: Callable[[], None]) -> bool:
+        """Queue a call to revoke a refresh token
+
+        Parameters
+        ----------
+        revoke : Callable[[], None]
+            Sends the revocation request to Cognito
+
+        Returns
+        -------
+        bool
+            True if queued, False if the queue is full or closed
+        """
+        with self._lock:
+            if not self._closing.is_set():
+                try:
+                    self._queue.put_nowait((contextvars.copy_context(), revoke))
+                    return True
+                except queue.Full:
+                    pass
+            self._rejected += 1
+            return False
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._revoke(*job)
+            finally:
+                self._queue.task_done()
+
+    def _revoke(self, context: contextvars.Context, revoke: Callable[[], None]) -> None:
+        attempt = 1
+        while True:
+            try:
+                context.run(revoke)
+                with self._lock:
+                    self._revoked += 1
+                return
+
+            except Exception as err:
+                # No more retries once closing, so the queue drains quickly
+                if (
+                    attempt >= self.max_attempts
+                    or self._closing.is_set()
+                    or not isinstance(err, CognitoError)
+                    or not is_transient(err)
+                ):
+                    break
+
+            with self._lock:
+                self._retried += 1
+            self._closing.wait(self.retry_delay * 2 ** (attempt - 1))
+            attempt += 1
+
+        with self._lock:
+            self._failed += 1
+
+    def stats(self) -> RevokeStats:
+        """Return statistics on the queued revocations
+
+        Returns
+        -------
+        RevokeStats
+            A dataclass that holds the number of jobs waiting, the number of
+            tokens revoked, retried and that failed to be revoked, and the
+            number of jobs rejected as the queue was full
+        """
+        with self._lock:
+            return RevokeStats(
+                depth=self._queue.qsize(),
+                revoked=self._revoked,
+                retried=self._retried,
+                failed=self._failed,
+                rejected=self._rejected,
+            )
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting jobs, and wait for the queued jobs to be run
+
+        Parameters
+        ----------
+        timeout : Optional[float], optional
+            Maximum time (in seconds) to wait, by default None (no limit)
+        """
+        with self._lock:
+            if self._closing.is_set():
+                return
+            self._closing.set()
+        # The sentinel is queued after every job, and blocks while it is full
+        threading.Thread(target=self._queue.put, args=(None,), daemon=True).start()
+        self._worker.join(timeout)
+
+
+# Process-wide revocation queues, keyed by endpoint URL and client ID
+_queues: Dict[Tuple[str, str], RevokeQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_revoke_queue(cfg: Config) -> Optional[RevokeQueue]:
+    """Return the process-wide revocation queue for the client in ``cfg``
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[RevokeQueue]
+        The queue shared by all requests for this user pool client, or None
+        if ``AWS_COGNITO_REVOKE_QUEUE_SIZE`` is not set
+    """
+    if not cfg.revoke_queue_size:
+        return None
+
+    key = (cfg.revoke_endpoint, cfg.user_pool_client_id)
+    revoke_queue = _queues.get(key)
+    if revoke_queue is None:
+        with _queues_lock:
+            revoke_queue = _queues.get(key)
+            if revoke_queue is None:
+                revoke_queue = RevokeQueue(
+                    max_size=cfg.revoke_queue_size,
+                    max_attempts=cfg.revoke_max_attempts,
+                    retry_delay=cfg.revoke_retry_delay,
+                )
+                _queues[key] = revoke_queue
+    return revoke_queue
+
+
+def clear_revoke_queues(
+    timeout: Optional[float] = None,
+    cfg: Optional[Config] = None,
+) -> None:
+    """Drain and stop the revocation queues, then remove them
+
+    Parameters
+    ----------
+    timeout : Optional[float], optional
+        Maximum time (in seconds) to wait for each queue, by default None
+    cfg : Optional[Config], optional
+        Only remove the queue for the user pool client in ``cfg``, by default
+        all queues are removed
+    """
+    with _queues_lock:
+        if cfg is None:
+            queues = list(_queues.values())
+            _queues.clear()
+        else:
+            key = (cfg.revoke_endpoint, cfg.user_pool_client_id)
+            revoke_queue = _queues.pop(key, None)
+            queues = [revoke_queue] if revoke_queue is not None else []
+
+    for revoke_queue in queues:
+        revoke_queue.close(timeout)
+
+
+# Revoke the queued tokens before the worker threads are killed at exit
+atexit.register(clear_revoke_queues, timeout=10)
@@ -0,0 +1,308 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha256
+from typing import Any, Dict, Optional, Tuple
+
+from flask_cognito_lib.config import Config
+
+CacheKey = Tuple[str, bytes]
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    entries: int
+    size_bytes: int
+
+
+@dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    size: int
+
+
+def token_digest(token: str) -> bytes:
+    """Return the SHA-256 digest of a token, used as a cache key"""
+    return sha256(token.encode()).digest()
+
+
+class _LRUCache:
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key: CacheKey) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.value
+
+    def _put(self, key: CacheKey, value: Any, expires_at: float, size: int) -> None:
+        if expires_at <= time.time() or size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = _Entry(value, expires_at, size)
+            self._size += size
+
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: CacheKey) -> None:
+        # Must be called holding the lock
+        self._size -= self._entries.pop(key).size
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._size = self._hits = self._misses = 0
+
+    def stats(self) -> CacheStats:
+        """Return the hit and miss counters and current size of the cache
+
+        Returns
+        -------
+        CacheStats
+            A dataclass that holds the cache statistics
+        """
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                entries=len(self._entries),
+                size_bytes=self._size,
+            )
+
+
+class ClaimsCache(_LRUCache):
+    def __init__(
+        self,
+        max_ttl: float = 60,
+        max_entries: int = 1024,
+        max_bytes: int = 1024 * 1024,
+    ) -> None:
+        """A thread-safe LRU cache of the verified claims of tokens
+
+        Entries are keyed by the token type and a digest of the full token,
+        and expire at the earlier of the token expiry (less the leeway used
+        when verifying it) and ``max_ttl`` seconds after being added. The
+        cache is bounded by both the number of entries and the approximate
+        size of the cached tokens.
+
+        Parameters
+        ----------
+        max_ttl : float, optional
+            Maximum time (in seconds) to cache claims for, by default 60
+        max_entries : int, optional
+            Maximum number of cached tokens, by default 1024
+        max_bytes : int, optional
+            Maximum total length of the cached tokens, by default 1MiB
+        """
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes)
+        self.max_ttl = max_ttl
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached claims, or None if missing or expired
+
+        Parameters
+        ----------
+        key : CacheKey
+            The token type and digest of the token
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            The verified claims of the token
+        """
+        claims = self._get(key)
+        return dict(claims) if claims is not None else None
+
+    def put(
+        self,
+        key: CacheKey,
+        claims: Dict[str, Any],
+        leeway: float,
+        size: int,
+    ) -> None:
+        """Cache the verified claims of a token
+
+        Parameters
+        ----------
+        key : CacheKey
+            The token type and digest of the token
+        claims : Dict[str, Any]
+            The verified claims of the token
+        leeway : float
+            The leeway (in seconds) used for the expiration check
+        size : int
+            The approximate size of the entry in bytes (i.e. the token length)
+        """
+        expires_at = min(float(claims["exp"]) - leeway, time.time() + self.max_ttl)
+        self._put(key, dict(claims), expires_at=expires_at, size=size)
+
+
+class RejectedTokenCache(_LRUCache):
+    def __init__(
+        self,
+        ttl: float = 10,
+        max_entries: int = 1024,
+        max_bytes: int = 1024 * 1024,
+    ) -> None:
+        """A thread-safe LRU cache of recently rejected tokens
+
+        Repeated requests with the same invalid token (e.g. an expired cookie
+        replayed by a stale browser tab) are rejected without verifying the
+        token again. Only tokens that failed verification are added, never
+        tokens that could not be verified because the public keys of the user
+        pool could not be downloaded.
+
+        Parameters
+        ----------
+        ttl : float, optional
+            Time (in seconds) to remember a rejected token for, by default 10
+        max_entries : int, optional
+            Maximum number of cached tokens, by default 1024
+        max_bytes : int, optional
+            Maximum total length of the cached tokens, by default 1MiB
+        """
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes)
+        self.ttl = ttl
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        """Return the reason a token was rejected, or None if not rejected
+
+        Parameters
+        ----------
+        key : CacheKey
+            The token type and digest of the token
+
+        Returns
+        -------
+        Optional[str]
+            The reason the token failed verification
+        """
+        return self._get(key)
+
+    def put(self, key: CacheKey, reason: str, size: int) -> None:
+        """Remember that a token was rejected
+
+        Parameters
+        ----------
+        key : CacheKey
+            The token type and digest of the token
+        reason : str
+            The reason the token failed verification
+        size : int
+            The approximate size of the entry in bytes (i.e. the token length)
+        """
+        self._put(key, reason, expires_at=time.time() + self.ttl, size=size)
+
+
+_claims_caches: Dict[Tuple[str, str], ClaimsCache] = {}
+_rejected_caches: Dict[Tuple[str, str], RejectedTokenCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_claims_cache(cfg: Config) -> Optional[ClaimsCache]:
+    """Return the process-wide claims cache for the user pool client in ``cfg``
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[ClaimsCache]
+        The claims cache shared by all requests for this user pool client, or
+        None if ``AWS_COGNITO_CLAIMS_CACHE_TTL`` is not set
+    """
+    if not cfg.claims_cache_ttl:
+        return None
+
+    key = (cfg.issuer, cfg.user_pool_client_id)
+    cache = _claims_caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _claims_caches.get(key)
+            if cache is None:
+                cache = ClaimsCache(
+                    max_ttl=cfg.claims_cache_ttl,
+                    max_entries=cfg.claims_cache_max_entries,
+                    max_bytes=cfg.claims_cache_max_bytes,
+                )
+                _claims_caches[key] = cache
+    return cache
+
+
+def get_rejected_cache(cfg: Config) -> Optional[RejectedTokenCache]:
+    """Return the process-wide rejected token cache for the client in ``cfg``
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Optional[RejectedTokenCache]
+        The rejected token cache shared by all requests for this user pool
+        client, or None if ``AWS_COGNITO_REJECTED_CACHE_TTL`` is not set
+    """
+    if not cfg.rejected_cache_ttl:
+        return None
+
+    key = (cfg.issuer, cfg.user_pool_client_id)
+    cache = _rejected_caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _rejected_caches.get(key)
+            if cache is None:
+                cache = RejectedTokenCache(
+                    ttl=cfg.rejected_cache_ttl,
+                    max_entries=cfg.rejected_cache_max_entries,
+                )
+                _rejected_caches[key] = cache
+    return cache
+
+
+def clear_token_caches(cfg: Optional[Config] = None) -> None:
+    """Remove the cached claims and rejected tokens (e.g. between tests)
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the caches for the user pool client in ``cfg``, by default
+        all caches are removed
+    """
+    with _caches_lock:
+        if cfg is None:
+            _claims_caches.clear()
+            _rejected_caches.clear()
+        else:
+            key = (cfg.issuer, cfg.user_pool_client_id)
+            _claims_caches.pop(key, None)
+            _rejected_caches.pop(key, None)
@@ -1,20 +1,683 @@
-from base64 import urlsafe_b64encode
+import asyncio
+import json
+import threading
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from hashlib import sha256
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 from urllib.error import HTTPError
 
 import jwt
+from cryptography.exceptions import InvalidSignature
 from cryptography.fernet import Fernet, InvalidToken
-from jwt import PyJWK, PyJWKClient, PyJWKClientError
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.hashes import SHA256
+from jwt import PyJWK, PyJWKClientError
 
 from flask_cognito_lib.config import Config
-from flask_cognito_lib.exceptions import CognitoError, TokenVerifyError
+from flask_cognito_lib.exceptions import (
+    CircuitOpenError,
+    CognitoError,
+    FlaskCognitoError,
+    TokenVerifyError,
+)
+from flask_cognito_lib.services.jwks_svc import (
+    JWKSStore,
+    KeyNotFoundError,
+    get_jwks_store,
+)
+from flask_cognito_lib.services.offload_svc import SignatureOffloader
+from flask_cognito_lib.services.token_cache import (
+    CacheKey,
+    get_claims_cache,
+    get_rejected_cache,
+    token_digest,
+)
+
+ALGORITHMS = ["RS256"]
+
+ACCESS_TOKEN_OPTIONS: Dict[str, Any] = {
+    "verify_signature": True,
+    "verify_aud": False,  # JWT from Cognito will set client_id
+    "verify_iss": True,
+    "verify_exp": True,
+    "verify_iat": True,
+    "verify_nbf": False,  # Not issued
+    "require": ["iss", "exp", "iat", "client_id"],
+}
+
+ID_TOKEN_OPTIONS: Dict[str, Any] = {
+    "verify_signature": True,
+    "verify_aud": True,  # ID token does contain correct audience
+    "verify_iss": True,
+    "verify_exp": True,
+    "verify_iat": True,
+    "verify_nbf": False,  # Not issued
+    "require": ["aud", "iss", "exp", "iat"],
+}
+
+
+# Headers that Cognito sets, any others are left to PyJWT by the fast path
+COGNITO_HEADERS = frozenset(("alg", "kid", "typ"))
+
+
+@dataclass
+class VerifyResult:
+    """The outcome of verifying one token of a batch"""
+
+    claims: Optional[Dict[str, Any]] = None
+    error: Optional[FlaskCognitoError] = None
+
+    @property
+    def ok(self) -> bool:
+        """Return True if the token was verified"""
+        return self.error is None
+
+
+class _Token(NamedTuple):
+    """The unverified segments of a JWT"""
+
+    header: Dict[str, Any]
+    payload: Dict[str, Any]
+    signing_input: bytes
+    signature: bytes
+
+
+def _b64decode(segment: str) -> bytes:
+    """Decode a base64url segment, rejecting junk and non-canonical encodings
+
+    At least as strict as PyJWT: padding and trailing bits must be
+    canonical, which older versions of PyJWT did not check, so such tokens
+    are rejected here whatever the version.
+
+    Raises
+    ------
+    ValueError
+        If the segment is not valid base64url
+    """
+    stripped = segment.rstrip("=")
+    padding = len(segment) - len(stripped)
+    if padding > 2 or (padding and len(segment) % 4):
+        raise ValueError("Invalid padding")
+
+    decoded = urlsafe_b64decode(stripped + "=" * (-len(stripped) % 4))
+    if urlsafe_b64encode(decoded).rstrip(b"=") != stripped.encode():
+        raise ValueError("Invalid base64url encoding")
+    return decoded
+
+
+class Verifier:
+    def __init__(
+        self,
+        issuer: str,
+        client_id: str,
+        jwks: JWKSStore,
+        leeway: float = 0,
+    ) -> None:
+        """Verifies the tokens issued by a user pool for an app client
+
+        The issuer, audience, allowed algorithms, required claims and leeway
+        are fixed when the verifier is created, so a single instance can be
+        shared by all requests and threads without reading the Flask config.
+
+        Parameters
+        ----------
+        issuer : str
+            The issuer URL of the user pool
+        client_id : str
+            The user pool app client ID, the audience of the tokens
+        jwks : JWKSStore
+            The store of the user pool public keys
+        leeway : float, optional
+            Default leeway in seconds for the expiration check, by default 0
+        """
+        self.issuer = issuer
+        self.client_id = client_id
+        self.jwks = jwks
+        self.leeway = leeway
+
+    def _get_key(self, kid: str) -> RSAPublicKey:
+        """Find the parsed RSA public key for a key ID
+
+        Raises
+        ------
+        TokenVerifyError
+            If the key is not in the user pool key set
+        CognitoError
+            If the request to the user pool JWK endpoint fails
+        CircuitOpenError
+            If the circuit breaker of the user pool JWK endpoint is open
+        """
+        try:
+            return self.jwks.get_key(kid)
+        except KeyNotFoundError as err:
+            raise TokenVerifyError("Token signing key is not in the key set") from err
+        except (PyJWKClientError, HTTPError) as err:
+            if isinstance(err.__cause__, CircuitOpenError):
+                raise CircuitOpenError(str(err.__cause__)) from err
+            raise CognitoError("Error getting public keys from Cognito") from err
+
+    def _precheck(self, token: str, leeway: float) -> _Token:
+        """Reject tokens that cannot be valid without any signature verification
+
+        The token is split once and the header and payload are read from the
+        unverified segments, so garbage, expired or foreign tokens are
+        rejected before the public key is looked up or the signature verified.
+
+        Returns
+        -------
+        _Token
+            The unverified header, payload and signature of the token
+
+        Raises
+        ------
+        TokenVerifyError
+            If the token is malformed, uses the wrong algorithm, has no key ID,
+            was not issued by the user pool or has expired
+        """
+        try:
+            signing_input, _, signature_segment = token.rpartition(".")
+            header_segment, payload_segment = signing_input.split(".")
+            header = json.loads(_b64decode(header_segment))
+            payload = json.loads(_b64decode(payload_segment))
+            signature = _b64decode(signature_segment)
+        except (ValueError, RecursionError) as err:
+            raise TokenVerifyError("Token is not valid") from err
+
+        if not isinstance(header, dict) or not isinstance(payload, dict):
+            raise TokenVerifyError("Token is not valid")
+
+        if header.get("alg") not in ALGORITHMS:
+            raise TokenVerifyError("Token algorithm is not allowed")
+
+        if not isinstance(header.get("kid"), str):
+            raise TokenVerifyError("Token has no key ID")
+
+        if payload.get("iss") != self.issuer:
+            raise TokenVerifyError("Token was not issued by this user pool")
+
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)) or isinstance(exp, bool):
+            raise TokenVerifyError("Token has no valid expiry")
+
+        if exp <= time.time() - leeway:
+            raise TokenVerifyError("Token has expired")
+
+        return _Token(header, payload, signing_input.encode(), signature)
+
+    def _decode(
+        self,
+        token: str,
+        options: Dict[str, Any],
+        leeway: float,
+    ) -> Dict[str, Any]:
+        """Validate the contents, claims and signature of a JWT
+
+        Parameters
+        ----------
+        token : str
+            Token in JWT format
+        options : Dict[str, Any]
+            Decoding and validation options, see ``pyjwt.jwt.decode``
+        leeway : float
+            Leeway in seconds for the expiration check
+
+        Returns
+        -------
+        Dict[str, Any]
+            Verified claims from the JWT
+
+        Raises
+        ------
+        TokenVerifyError
+            If claims or signature are invalid
+        CognitoError
+            If the request to the user pool JWK endpoint fails
+        """
+        parsed = self._precheck(token, leeway)
+        key = self._get_key(parsed.header["kid"])
+        return self._verify(token, parsed, key, options=options, leeway=leeway)
+
+    def _verify(
+        self,
+        token: str,
+        parsed: _Token,
+        key: RSAPublicKey,
+        options: Dict[str, Any],
+        leeway: float,
+    ) -> Dict[str, Any]:
+        """Verify the signature and claims of a pre-checked JWT with its key
+
+        Raises
+        ------
+        TokenVerifyError
+            If claims or signature are invalid
+        """
+        try:
+            return jwt.decode(
+                jwt=token,
+                key=key,
+                algorithms=ALGORITHMS,
+                audience=self.client_id,
+                issuer=self.issuer,
+                leeway=leeway,
+                options=options,  # type: ignore[arg-type]
+            )
+        except jwt.PyJWTError as err:
+            raise TokenVerifyError("Token is not valid") from err
+
+    def verify_access(
+        self,
+        token: str,
+        leeway: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Verify the claims & signature of an access token
+
+        Parameters
+        ----------
+        token : str
+            The encoded JWT
+        leeway : Optional[float], optional
+            Override the leeway of the verifier for this token
+
+        Returns
+        -------
+        Dict[str, Any]
+            The verified claims from the encoded JWT
+
+        Raises
+        ------
+        TokenVerifyError
+            If any checks fail
+        CognitoError
+            If the request to the user pool JWK endpoint fails
+        """
+        claims = self._decode(
+            token,
+            options=ACCESS_TOKEN_OPTIONS,
+            leeway=self.leeway if leeway is None else leeway,
+        )
+        self._check_client_id(claims)
+        return claims
+
+    def _check_client_id(self, claims: Dict[str, Any]) -> None:
+        # Cognito does not set an audience, but should populate client_id
+        if claims["client_id"] != self.client_id:
+            raise TokenVerifyError("Token was not issued for this client id")
+
+    def verify_id(
+        self,
+        token: str,
+        nonce: Optional[str] = None,
+        leeway: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Verify the claims & signature of an ID token
+
+        Parameters
+        ----------
+        token : str
+            The encoded JWT
+        nonce : Optional[str]
+            An optional nonce value to validate to prevent replay attacks
+        leeway : Optional[float], optional
+            Override the leeway of the verifier for this token
+
+        Returns
+        -------
+        Dict[str, Any]
+            The OIDC claims from the encoded JWT
+
+        Raises
+        ------
+        TokenVerifyError
+            If any checks fail
+        CognitoError
+            If the request to the user pool JWK endpoint fails
+        """
+        claims = self._decode(
+            token,
+            options=ID_TOKEN_OPTIONS,
+            leeway=self.leeway if leeway is None else leeway,
+        )
+        self.check_nonce(claims, nonce)
+        return claims
+
+    def verify_many(
+        self,
+        tokens: Iterable[str],
+        token_use: str = "access",
+        leeway: Optional[float] = None,
+        max_workers: Optional[int] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> List[VerifyResult]:
+        """Verify a batch of access or ID tokens in parallel
+
+        Every token is pre-checked and the public key is looked up once per
+        distinct key ID, then the signatures are verified on a thread pool
+        (``cryptography`` releases the GIL while verifying).
+
+        Parameters
+        ----------
+        tokens : Iterable[str]
+            The encoded JWTs
+        token_use : str, optional
+            "access" or "id", by default "access"
+        leeway : Optional[float], optional
+            Override the leeway of the verifier for these tokens
+        max_workers : Optional[int], optional
+            Number of threads to verify with, by default as many as
+            ``ThreadPoolExecutor`` uses
+        executor : Optional[ThreadPoolExecutor], optional
+            Verify on this thread pool instead of creating one for the batch.
+            A process pool cannot be used, as the parsed tokens and keys are
+            not sent to other processes (see ``AWS_COGNITO_VERIFY_PROCESSES``)
+
+        Returns
+        -------
+        List[VerifyResult]
+            The claims or the error for each token, in the order of ``tokens``
+
+        Raises
+        ------
+        ValueError
+            If ``token_use`` is not "access" or "id"
+        TypeError
+            If ``executor`` is not a thread pool
+        """
+        if token_use not in ("access", "id"):
+            raise ValueError(f"Unknown token use: {token_use}")
+        if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+            raise TypeError("Tokens can only be verified on a ThreadPoolExecutor")
+
+        options = ACCESS_TOKEN_OPTIONS if token_use == "access" else ID_TOKEN_OPTIONS
+        leeway = self.leeway if leeway is None else leeway
+        keys: Dict[str, Union[RSAPublicKey, FlaskCognitoError]] = {}
+        results: List[VerifyResult] = []
+        jobs: List[Tuple[int, str, _Token, RSAPublicKey]] = []
+
+        for token in tokens:
+            result = VerifyResult()
+            results.append(result)
+            try:
+                if not token:
+                    raise TokenVerifyError("No token provided")
+                parsed = self._precheck(token, leeway)
+            except TokenVerifyError as err:
+                result.error = err
+                continue
+
+            kid = parsed.header["kid"]
+            if kid not in keys:
+                try:
+                    keys[kid] = self._get_key(kid)
+                except FlaskCognitoError as err:
+                    keys[kid] = err
+
+            key = keys[kid]
+            if isinstance(key, FlaskCognitoError):
+                result.error = key
+            else:
+                jobs.append((len(results) - 1, token, parsed, key))
+
+        def verify(job: Tuple[int, str, _Token, RSAPublicKey]) -> None:
+            index, token, parsed, key = job
+            try:
+                claims = self._verify(token, parsed, key, options, leeway)
+                if token_use == "access":
+                    self._check_client_id(claims)
+                results[index].claims = claims
+            except FlaskCognitoError as err:
+                results[index].error = err
+
+        if executor is not None:
+            list(executor.map(verify, jobs))
+        elif len(jobs) > 1 and max_workers != 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(verify, jobs))
+        else:
+            for job in jobs:
+                verify(job)
+
+        return results
+
+    @staticmethod
+    def check_nonce(claims: Dict[str, Any], nonce: Optional[str]) -> None:
+        """Check the nonce of verified ID token claims to prevent replay attacks
+
+        Raises
+        ------
+        TokenVerifyError
+            If a nonce is given and does not match the claims
+        """
+        if nonce and claims.get("nonce") != nonce:
+            raise TokenVerifyError("Token nonce check failed")
+
+    def needs_io(self, token: str) -> bool:
+        """Return True if verifying ``token`` may block, e.g. to download keys
+
+        Tokens that cannot be parsed do not need any I/O to be rejected.
+        """
+        try:
+            header = json.loads(_b64decode(token.split(".", 1)[0]))
+            kid = header.get("kid")
+        except (ValueError, RecursionError, AttributeError):
+            return False
+        return isinstance(kid, str) and not self.jwks.has_key(kid)
+
+    def close(self) -> None:
+        """Release any resources held by the verifier"""
+
+
+class FastVerifier(Verifier):
+    """A verifier that checks Cognito tokens without going through PyJWT
+
+    Cognito tokens always have the same profile (RS256, a known issuer and
+    known claims), so the token is split and parsed once by the pre-checks,
+    the signature is verified directly with the cached ``cryptography`` key
+    and the claims are checked with plain comparisons. It accepts and rejects
+    exactly the same tokens as ``Verifier``; tokens with headers that Cognito
+    does not set are passed to PyJWT.
+    """
+
+    def _verify(
+        self,
+        token: str,
+        parsed: _Token,
+        key: RSAPublicKey,
+        options: Dict[str, Any],
+        leeway: float,
+    ) -> Dict[str, Any]:
+        if not COGNITO_HEADERS.issuperset(parsed.header):
+            return super()._verify(token, parsed, key, options=options, leeway=leeway)
+
+        if not self._check_signature(parsed, key):
+            raise TokenVerifyError("Token is not valid")
+
+        self._check_claims(parsed.payload, options=options, leeway=leeway)
+        return parsed.payload
+
+    def _check_signature(self, parsed: _Token, key: RSAPublicKey) -> bool:
+        """Return True if the RS256 signature of the token is valid"""
+        try:
+            key.verify(parsed.signature, parsed.signing_input, PKCS1v15(), SHA256())
+        except InvalidSignature:
+            return False
+        return True
+
+    def _check_claims(
+        self,
+        claims: Dict[str, Any],
+        options: Dict[str, Any],
+        leeway: float,
+    ) -> None:
+        """Check the claims the same way as ``jwt.decode``
+
+        The issuer and a numeric expiry have already been checked by the
+        pre-checks.
+
+        Raises
+        ------
+        TokenVerifyError
+            If any claim is missing or invalid
+        """
+        for claim in options["require"]:
+            if claims.get(claim) is None:
+                raise TokenVerifyError("Token is not valid")
+
+        now = time.time()
+        try:
+            if "iat" in claims and int(claims["iat"]) > now + leeway:
+                raise TokenVerifyError("Token is not valid")
+            if int(claims["exp"]) <= now - leeway:
+                raise TokenVerifyError("Token is not valid")
+        except (ValueError, TypeError, OverflowError) as err:
+            raise TokenVerifyError("Token is not valid") from err
+
+        if options["verify_aud"]:
+            aud = claims.get("aud")
+            if not aud:
+                raise TokenVerifyError("Token is not valid")
+            if isinstance(aud, str):
+                aud = [aud]
+            if not isinstance(aud, list) or self.client_id not in aud:
+                raise TokenVerifyError("Token is not valid")
+            if any(not isinstance(value, str) for value in aud):
+                raise TokenVerifyError("Token is not valid")
+
+        for claim in ("sub", "jti"):
+            if claim in claims and not isinstance(claims[claim], str):
+                raise TokenVerifyError("Token is not valid")
+
+
+class OffloadVerifier(FastVerifier):
+    def __init__(
+        self,
+        issuer: str,
+        client_id: str,
+        jwks: JWKSStore,
+        leeway: float = 0,
+        processes: int = 1,
+        timeout: float = 1,
+    ) -> None:
+        """A fast verifier that checks signatures on a pool of processes
+
+        Only the RSA signature check is sent to the pool; the pre-checks and
+        claims checks stay in the calling process. Signatures that cannot be
+        checked on the pool are checked in the calling process.
+
+        Parameters
+        ----------
+        issuer : str
+            The issuer URL of the user pool
+        client_id : str
+            The user pool app client ID, the audience of the tokens
+        jwks : JWKSStore
+            The store of the user pool public keys
+        leeway : float, optional
+            Default leeway in seconds for the expiration check, by default 0
+        processes : int, optional
+            Number of worker processes, by default 1
+        timeout : float, optional
+            Maximum time (in seconds) to wait for a worker before verifying a
+            signature in the calling process, by default 1
+        """
+        super().__init__(issuer, client_id, jwks=jwks, leeway=leeway)
+        self.offloader = SignatureOffloader(jwks, processes=processes, timeout=timeout)
+
+    def _check_signature(self, parsed: _Token, key: RSAPublicKey) -> bool:
+        valid = self.offloader.verify(
+            parsed.header["kid"],
+            signing_input=parsed.signing_input,
+            signature=parsed.signature,
+        )
+        if valid is None:
+            return super()._check_signature(parsed, key)
+        return valid
+
+    def needs_io(self, token: str) -> bool:
+        # Waits for the worker processes
+        return True
+
+    def close(self) -> None:
+        self.offloader.close()
+
+
+_verifiers: Dict[Tuple[str, str], Verifier] = {}
+_verifiers_lock = threading.Lock()
+
+
+def get_verifier(cfg: Config) -> Verifier:
+    """Return the process-wide verifier for the user pool client in ``cfg``
+
+    Parameters
+    ----------
+    cfg : Config
+        The extension configuration
+
+    Returns
+    -------
+    Verifier
+        The verifier shared by all requests for this user pool client: an
+        ``OffloadVerifier`` if ``AWS_COGNITO_VERIFY_PROCESSES`` is set, or a
+        ``FastVerifier`` if ``AWS_COGNITO_FAST_VERIFY`` is set
+    """
+    key = (cfg.issuer, cfg.user_pool_client_id)
+    verifier = _verifiers.get(key)
+    if verifier is None:
+        with _verifiers_lock:
+            verifier = _verifiers.get(key)
+            if verifier is None:
+                kwargs: Dict[str, Any] = {
+                    "issuer": key[0],
+                    "client_id": key[1],
+                    "jwks": get_jwks_store(cfg),
+                    "leeway": cfg.cognito_expiration_leeway,
+                }
+                if cfg.verify_processes:
+                    verifier = OffloadVerifier(
+                        processes=cfg.verify_processes,
+                        timeout=cfg.verify_process_timeout,
+                        **kwargs,
+                    )
+                elif cfg.fast_verify:
+                    verifier = FastVerifier(**kwargs)
+                else:
+                    verifier = Verifier(**kwargs)
+                _verifiers[key] = verifier
+    return verifier
+
+
+def clear_verifiers(cfg: Optional[Config] = None) -> None:
+    """Close and remove the verifiers (e.g. between tests)
+
+    Parameters
+    ----------
+    cfg : Optional[Config], optional
+        Only remove the verifier for the user pool client in ``cfg``, by
+        default all verifiers are removed
+    """
+    with _verifiers_lock:
+        if cfg is None:
+            verifiers = list(_verifiers.values())
+            _verifiers.clear()
+        else:
+            key = (cfg.issuer, cfg.user_pool_client_id)
+            verifier = _verifiers.pop(key, None)
+            verifiers = [verifier] if verifier is not None else []
+    for verifier in verifiers:
+        verifier.close()
 
 
 class TokenService:
     def __init__(self, cfg: Config):
         self.cfg = cfg
-        self.jwk = PyJWKClient(self.cfg.jwk_endpoint, cache_keys=True)
+        self.verifier = get_verifier(self.cfg)
+        self.jwks = self.verifier.jwks
+        self.claims_cache = get_claims_cache(self.cfg)
+        self.rejected_cache = get_rejected_cache(self.cfg)
         self.fernet = Fernet(self.get_encryption_key(self.cfg))
 
     @staticmethod
@@ -44,84 +707,120 @@ class TokenService:
         Raises
         ------
         CognitoError
-            If the PyJWTClient raises or the request to the user pool JWK
-            endpoint fails
+            If the key is not in the user pool key set or the request to the
+            user pool JWK endpoint fails
         """
+        kid = jwt.get_unverified_header(token).get("kid", "")
         try:
-            return self.jwk.get_signing_key_from_jwt(token)
+            return self.jwks.get_signing_key(kid)
         except (PyJWKClientError, HTTPError) as err:
             raise CognitoError("Error getting public keys from Cognito") from err
 
-    def _jwt_validate(
+    def _check_rejected(self, key: CacheKey) -> None:
+        """Raise if a token was recently rejected
+
+        Raises
+        ------
+        TokenVerifyError
+            If the token is in the rejected token cache
+        """
+        if self.rejected_cache is not None:
+            if (reason := self.rejected_cache.get(key)) is not None:
+                raise TokenVerifyError(f"Token was recently rejected: {reason}")
+
+    def _reject(self, key: CacheKey, token: str, err: TokenVerifyError) -> None:
+        """Remember that a token failed verification
+
+        A token signed with a key that is not in the key set is not
+        remembered, as it may be valid once the rotated keys are downloaded.
+        """
+        if isinstance(err.__cause__, KeyNotFoundError):
+            return
+        if self.rejected_cache is not None:
+            reason = str(err.__cause__ or err)
+            self.rejected_cache.put(key, reason=reason, size=len(token))
+
+    def verify_access_token(
         self,
         token: str,
-        options: Dict[str, bool],
         leeway: float = 0,
-        required: Optional[Iterable[str]] = None,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
-        """Validate the contents and claims of a JSON Web Token (JWT)
+        """Verify the claims & signature of a JWT access token from Cognito
+
+        This will check the audience, issuer, expiry and validate the signature
+        of the JWT matches the public keys from the user pool
 
         Parameters
         ----------
-        token : str
-            Token in JWT format
-        leeway : float, optional
-            Leeway in seconds if validating expiry, by default 0
-        options : Dict[str, bool]
-            extended decoding and validation options, by default None
-            See ``pyjwt.jwt.decode`` for options.
-        required : Iterable[str], optional
-            List of claims that must be present.
-            Will set "aud", "iss", "exp", "iat" by default.
+        access_token : str
+            The encoded JWT from Cognito
+        leeway : float
+            A time margin in seconds for the expiration check
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
 
         Returns
         -------
         Dict[str, Any]
-            Verified claims from the JWT
+            The verified claims from the encoded JWT
 
         Raises
         ------
         TokenVerifyError
-            If claims or signature are invalid
+            If not token is passed, or any checks fail
         """
+        if not token:
+            raise TokenVerifyError("No token provided")
+
+        cache = self.claims_cache if use_cache else None
+        key = ("access", token_digest(token))
+        if cache is not None:
+            if (cached := cache.get(key)) is not None:
+                return cached
+        if use_cache:
+            self._check_rejected(key)
+
         try:
-            claims = jwt.decode(
-                jwt=token,
-                key=self.get_public_key(token).key,
-                algorithms=["RS256"],
-                audience=self.cfg.user_pool_client_id,
-                issuer=self.cfg.issuer,
-                leeway=leeway,
-                options=options,
-                required=required or ["aud", "iss", "exp", "iat"],
-            )
+            claims = self.verifier.verify_access(token, leeway=leeway)
+        except TokenVerifyError as err:
+            self._reject(key, token, err)
+            raise
 
-        except jwt.PyJWTError as err:
-            raise TokenVerifyError("Token is not valid") from err
+        if cache is not None:
+            cache.put(key, claims, leeway=leeway, size=len(token))
 
         return claims
 
-    def verify_access_token(
+    def verify_id_token(
         self,
         token: str,
         leeway: float = 0,
+        nonce: Optional[str] = None,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
-        """Verify the claims & signature of a JWT access token from Cognito
+        """Verify the claims & signature of an id token in JWT format from Cognito
 
         This will check the audience, issuer, expiry and validate the signature
         of the JWT matches the public keys from the user pool
 
         Parameters
         ----------
-        access_token : str
-            The encoded JWT from Cognito
-        leeway : float
+        token : str
+            The encoded JWT
+        leeway : flaot
             A time margin in seconds for the expiration check
+        nonce : Optional[str]
+            An optional nonce value to validate to prevent replay attacks
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
 
         Returns
         -------
         Dict[str, Any]
-            The verified claims from the encoded JWT
+            The OIDC claims from the encoded JWT
 
         Raises
         ------
@@ -131,36 +830,76 @@ class TokenService:
         if not token:
             raise TokenVerifyError("No token provided")
 
-        # Verify the contents and signature of the JWT
-        claims = self._jwt_validate(
-            token=token,
-            leeway=leeway,
-            options={
-                "verify_signature": True,
-                "verify_aud": False,  # JWT from Cognito will set client_id
-                "verify_iss": True,
-                "verify_exp": True,
-                "verify_iat": True,
-                "verify_nbf": False,  # Not issued
-            },
-        )
+        cache = self.claims_cache if use_cache else None
+        key = ("id", token_digest(token))
+        claims = cache.get(key) if cache is not None else None
 
-        # Cognito does not set an audience, but should populate client_id
-        if claims["client_id"] != self.cfg.user_pool_client_id:
-            raise TokenVerifyError("Token was not issued for this client id")
+        if claims is None:
+            if use_cache:
+                self._check_rejected(key)
+
+            try:
+                # The nonce is checked below, as it differs between requests
+                claims = self.verifier.verify_id(token, leeway=leeway)
+            except TokenVerifyError as err:
+                self._reject(key, token, err)
+                raise
 
+            if cache is not None:
+                cache.put(key, claims, leeway=leeway, size=len(token))
+
+        self.verifier.check_nonce(claims, nonce)
         return claims
 
-    def verify_id_token(
+    async def verify_access_token_async(
+        self,
+        token: str,
+        leeway: float = 0,
+        use_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """Verify an access token without blocking the event loop
+
+        The same as ``verify_access_token``, but if the public keys need to be
+        downloaded (or the signature is verified on a process pool) the token
+        is verified in a thread. Concurrent coroutines share the key store and
+        caches with each other and with synchronous requests.
+
+        Parameters
+        ----------
+        token : str
+            The encoded JWT from Cognito
+        leeway : float
+            A time margin in seconds for the expiration check
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
+
+        Returns
+        -------
+        Dict[str, Any]
+            The verified claims from the encoded JWT
+
+        Raises
+        ------
+        TokenVerifyError
+            If not token is passed, or any checks fail
+        """
+        if token and self.verifier.needs_io(token):
+            return await asyncio.to_thread(
+                self.verify_access_token, token, leeway, use_cache
+            )
+        return self.verify_access_token(token, leeway, use_cache)
+
+    async def verify_id_token_async(
         self,
         token: str,
         leeway: float = 0,
         nonce: Optional[str] = None,
+        use_cache: bool = True,
     ) -> Dict[str, Any]:
-        """Verify the claims & signature of an id token in JWT format from Cognito
+        """Verify an ID token without blocking the event loop
 
-        This will check the audience, issuer, expiry and validate the signature
-        of the JWT matches the public keys from the user pool
+        See ``verify_access_token_async``.
 
         Parameters
         ----------
@@ -170,6 +909,9 @@ class TokenService:
             A time margin in seconds for the expiration check
         nonce : Optional[str]
             An optional nonce value to validate to prevent replay attacks
+        use_cache : bool
+            Use the claims cache and rejected token cache (if enabled) when
+            this token was recently verified or rejected, by default True
 
         Returns
         -------
@@ -181,28 +923,80 @@ class TokenService:
         TokenVerifyError
             If not token is passed, or any checks fail
         """
-        if not token:
-            raise TokenVerifyError("No token provided")
+        if token and self.verifier.needs_io(token):
+            return await asyncio.to_thread(
+                self.verify_id_token, token, leeway, nonce, use_cache
+            )
+        return self.verify_id_token(token, leeway, nonce, use_cache)
+
+    def verify_access_tokens(
+        self,
+        tokens: Iterable[str],
+        leeway: float = 0,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> List[VerifyResult]:
+        """Verify the claims & signatures of many access tokens at once
+
+        The tokens are verified in parallel, on ``AWS_COGNITO_BATCH_WORKERS``
+        threads unless an ``executor`` is given, with a single public key
+        lookup per key ID. The claims cache and rejected token cache are not
+        used.
+
+        Parameters
+        ----------
+        tokens : Iterable[str]
+            The encoded JWTs from Cognito
+        leeway : float
+            A time margin in seconds for the expiration check
+        executor : Optional[ThreadPoolExecutor], optional
+            A thread pool to verify the tokens on
 
-        # Verify the contents and signature of the JWT
-        claims = self._jwt_validate(
-            token=token,
+        Returns
+        -------
+        List[VerifyResult]
+            For each token in order, either the verified claims or the error
+            (``TokenVerifyError`` or ``CognitoError``)
+        """
+        return self.verifier.verify_many(
+            tokens,
+            token_use="access",
             leeway=leeway,
-            options={
-                "verify_signature": True,
-                "verify_aud": True,  # ID token does contain correct audience
-                "verify_iss": True,
-                "verify_exp": True,
-                "verify_iat": True,
-                "verify_nbf": False,  # Not issued
-            },
+            max_workers=self.cfg.batch_workers,
+            executor=executor,
         )
 
-        # Check nonce value to prevent replay attacks
-        if nonce and claims["nonce"] != nonce:
-            raise TokenVerifyError("Token nonce check failed")
+    def verify_id_tokens(
+        self,
+        tokens: Iterable[str],
+        leeway: float = 0,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> List[VerifyResult]:
+        """Verify the claims & signatures of many ID tokens at once
 
-        return claims
+        See ``verify_access_tokens``. Nonces are not checked.
+
+        Parameters
+        ----------
+        tokens : Iterable[str]
+            The encoded JWTs from Cognito
+        leeway : float
+            A time margin in seconds for the expiration check
+        executor : Optional[ThreadPoolExecutor], optional
+            A thread pool to verify the tokens on
+
+        Returns
+        -------
+        List[VerifyResult]
+            For each token in order, either the verified claims or the error
+            (``TokenVerifyError`` or ``CognitoError``)
+        """
+        return self.verifier.verify_many(
+            tokens,
+            token_use="id",
+            leeway=leeway,
+            max_workers=self.cfg.batch_workers,
+            executor=executor,
+        )
 
     def encrypt_token(self, token: str) -> str:
         """Symmetrically encrypt a token using Fernet with the Flask `SECRET_KEY`
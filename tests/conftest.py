@@ -1,9 +1,13 @@
-from typing import Dict, Generator, List
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional
 
+import jwt
 import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
 from flask import Flask, Response, make_response
 from flask.testing import FlaskClient
-from jwt import PyJWKSet
+from jwt.algorithms import RSAAlgorithm
 from pytest_mock import MockerFixture
 
 from flask_cognito_lib import CognitoAuth
@@ -15,15 +19,24 @@ from flask_cognito_lib.decorators import (
     cognito_logout,
     cognito_refresh_callback,
 )
+from flask_cognito_lib.services.breaker_svc import clear_breakers
+from flask_cognito_lib.services.hedge_svc import clear_hedgers
+from flask_cognito_lib.services.http_svc import clear_http_sessions
+from flask_cognito_lib.services.jwks_svc import clear_jwks_stores
+from flask_cognito_lib.services.refresh_svc import clear_refresh_coalescers
+from flask_cognito_lib.services.revoke_svc import clear_revoke_queues
+from flask_cognito_lib.services.token_cache import clear_token_caches
+from flask_cognito_lib.services.token_svc import clear_verifiers
 from flask_cognito_lib.utils import CognitoTokenResponse
 
+TEST_KID = "test-signing-key"
+
 
 @pytest.fixture(autouse=True)
 def app() -> Generator[Flask, None, None]:
     """Create application for the tests."""
 
     _app = Flask(__name__)
-    CognitoAuth(_app)
 
     ctx = _app.test_request_context()
     ctx.push()
@@ -46,6 +59,7 @@ def app() -> Generator[Flask, None, None]:
     _app.config["AWS_COGNITO_COOKIE_AGE_SECONDS"] = 1e9
 
     _app.testing = True
+    CognitoAuth(_app)
 
     # ----------------
     # Testing routes
@@ -110,8 +124,16 @@ def client(app: Flask) -> Generator[FlaskClient, None, None]:
     yield cl
 
 
+@pytest.fixture(scope="session")
+def signing_key() -> RSAPrivateKey:
+    # A key pair to sign test tokens with, its public key is in the user pool
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
 @pytest.fixture
-def jwks() -> Dict[str, List[Dict[str, str]]]:
+def jwks(signing_key: RSAPrivateKey) -> Dict[str, List[Dict[str, str]]]:
+    test_jwk = RSAAlgorithm.to_jwk(signing_key.public_key(), as_dict=True)
+    test_jwk.update({"alg": "RS256", "kid": TEST_KID, "use": "sig"})
     return {
         "keys": [
             {
@@ -130,10 +152,46 @@ def jwks() -> Dict[str, List[Dict[str, str]]]:
                 "n": "xaEhQcrn4hEXvAy5iCSTy0Tt_6MlvEk00k8eiJkRN8t-2YRZrU1-DK9FNY2tm9YxwFV1ynPSkkHkUPY3CWQt_zInhc8bx8ZjtzwqdApbkU_2A00LcUd_8VzmfGOToQ80EvTZ5QZvxQQxqcoOopX0WnysqFQT413isUaC4WTQcxb0nC78UZFW0t__xFuwtti-cwvWSUWdv_tLFBqBvhlvohENoCAQrXGsK64QCAj4dsagk2dsmrgdiOyihwnW4zx3Dcu4hDQMEcbMm4b76UN4_084k4rEpwcoDjq9wBx9QVUt9Xt81C2OWBkBz4UDX0QtAvTvl_RzErVDEwFtCEVfDQ",  # noqa: E501
                 "use": "sig",
             },
+            test_jwk,
         ]
     }
 
 
+@pytest.fixture
+def make_token(signing_key: RSAPrivateKey) -> Callable[..., str]:
+    """Return a function that signs a (currently valid) Cognito style token"""
+
+    def _make_token(
+        token_use: str = "access",
+        claims: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        now = int(time.time())
+        payload: Dict[str, Any] = {
+            "sub": "9048d38f-8174-49b9-8d59-3238172823d8",
+            "cognito:groups": ["admin"],
+            "iss": "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_c7O90SNDF",
+            "token_use": token_use,
+            "auth_time": now,
+            "exp": now + 3600,
+            "iat": now,
+        }
+        if token_use == "access":
+            payload["client_id"] = "4lln66726pp3f4gi1krj0sta9h"
+        else:
+            payload["aud"] = "4lln66726pp3f4gi1krj0sta9h"
+
+        payload.update(claims or {})
+        return jwt.encode(
+            {k: v for k, v in payload.items() if v is not None},
+            signing_key,
+            algorithm="RS256",
+            headers={"kid": TEST_KID, **(headers or {})},
+        )
+
+    return _make_token
+
+
 @pytest.fixture
 def cfg() -> Config:
     return Config()
@@ -150,12 +208,25 @@ def cfg_override() -> Config:
 
 
 @pytest.fixture(autouse=True)
-def jwk_patch(mocker: MockerFixture, jwks: Dict[str, List[Dict[str, str]]]) -> None:
+def jwk_patch(
+    mocker: MockerFixture, jwks: Dict[str, List[Dict[str, str]]]
+) -> Generator[None, None, None]:
     # Return the keys from the user pool without hitting the real endpoint
     mocker.patch(
-        "jwt.jwks_client.PyJWKClient.get_jwk_set",
-        return_value=PyJWKSet.from_dict(jwks),
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        return_value=jwks,
     )
+    yield
+    # Key stores and caches are shared across the process, start each test
+    # from scratch
+    clear_revoke_queues(timeout=5)
+    clear_jwks_stores()
+    clear_token_caches()
+    clear_verifiers()
+    clear_http_sessions()
+    clear_breakers()
+    clear_hedgers()
+    clear_refresh_coalescers()
 
 
 @pytest.fixture
@@ -245,6 +316,7 @@ def client_with_cookie_refresh(
     cl = app.test_client()
     cl.application.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
     cl.application.config["AWS_COGNITO_REFRESH_COOKIE_ENCRYPTED"] = False
+    cl.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
     cl.set_cookie(key=cfg.COOKIE_NAME, value=access_token)
     cl.set_cookie(key=cfg.COOKIE_NAME_REFRESH, value=refresh_token)
     yield cl
@@ -271,6 +343,7 @@ def client_with_cookie_refresh_encrypted(
     cl = app.test_client()
     cl.application.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
     cl.application.config["AWS_COGNITO_REFRESH_COOKIE_ENCRYPTED"] = True
+    cl.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
     cl.set_cookie(key=cfg.COOKIE_NAME, value=access_token)
     cl.set_cookie(key=cfg.COOKIE_NAME_REFRESH, value=refresh_token_encrypted)
     yield cl
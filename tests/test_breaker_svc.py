@@ -0,0 +1,153 @@
+from typing import Callable, List, Tuple
+
+import pytest
+import requests
+from flask import Flask
+from pytest_mock import MockerFixture
+from requests import Response
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CircuitOpenError, CognitoError
+from flask_cognito_lib.services.breaker_svc import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    get_breaker,
+)
+from flask_cognito_lib.services.cognito_svc import CognitoService
+from flask_cognito_lib.services.jwks_svc import JWKSClient
+from flask_cognito_lib.services.token_svc import TokenService
+
+
+def test_breaker_trips_and_recovers(mocker: MockerFixture) -> None:
+    clock = mocker.patch("flask_cognito_lib.services.breaker_svc.time.monotonic")
+    clock.return_value = 0.0
+    breaker = CircuitBreaker("token", failure_rate=0.5, window=4, min_calls=4)
+    transitions: List[Tuple[str, str, str]] = []
+    breaker.add_listener(lambda *args: transitions.append(args))
+
+    # not enough calls yet to trip
+    for ok in (False, False, True):
+        breaker.record(ok, elapsed=0.1, probe=breaker.before_request())
+    assert breaker.state == CLOSED
+
+    breaker.record(False, elapsed=0.1, probe=breaker.before_request())
+    assert breaker.state == OPEN
+
+    # fails fast while open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # a single probe is let through once the open period has passed
+    clock.return_value = 30.0
+    probe = breaker.before_request()
+    assert probe and breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    # a failed probe opens the breaker again...
+    breaker.record(False, elapsed=0.1, probe=probe)
+    assert breaker.state == OPEN
+
+    # ...and a successful one closes it
+    clock.return_value = 60.0
+    breaker.record(True, elapsed=0.1, probe=breaker.before_request())
+    assert breaker.state == CLOSED
+
+    assert transitions == [
+        ("token", CLOSED, OPEN),
+        ("token", OPEN, HALF_OPEN),
+        ("token", HALF_OPEN, OPEN),
+        ("token", OPEN, HALF_OPEN),
+        ("token", HALF_OPEN, CLOSED),
+    ]
+    stats = breaker.stats()
+    assert (stats.state, stats.rejected, stats.transitions) == (CLOSED, 2, 5)
+
+
+def test_breaker_slow_calls() -> None:
+    breaker = CircuitBreaker("token", failure_rate=1, min_calls=2, slow_call=1)
+    breaker.record(True, elapsed=0.5)
+    breaker.record(True, elapsed=2)
+    assert breaker.stats().failure_rate == 0.5
+
+    breaker.record(True, elapsed=2)
+    assert breaker.state == CLOSED
+    assert breaker.stats().failure_rate == pytest.approx(2 / 3)
+
+
+def test_get_breaker(app: Flask, cfg: Config) -> None:
+    assert get_breaker(cfg.token_endpoint, cfg) is None
+
+    app.config["AWS_COGNITO_BREAKER_FAILURE_RATE"] = 0.5
+    breaker = get_breaker(cfg.token_endpoint, cfg)
+    assert breaker is not None
+    assert get_breaker(cfg.token_endpoint, cfg) is breaker
+    assert get_breaker(cfg.revoke_endpoint, cfg) is not breaker
+
+
+def response(status: int, content: bytes = b"") -> Response:
+    resp = Response()
+    resp.status_code = status
+    resp._content = content
+    return resp
+
+
+def test_cognito_service_breaker(
+    app: Flask,
+    cfg: Config,
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_BREAKER_FAILURE_RATE"] = 0.5
+    app.config["AWS_COGNITO_BREAKER_MIN_CALLS"] = 2
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+    post = mocker.patch(
+        "requests.Session.post",
+        side_effect=lambda **kw: response(503, b'{"error": "unavailable"}'),
+    )
+
+    cognito = CognitoService(cfg)
+    for _ in range(2):
+        with pytest.raises(CognitoError, match="unavailable"):
+            cognito.exchange_refresh_token("test_refresh_token")
+
+    # fails fast without a request
+    with pytest.raises(CircuitOpenError):
+        cognito.exchange_refresh_token("test_refresh_token")
+    assert post.call_count == 2
+
+    # other endpoints have their own breaker
+    post.side_effect = None
+    post.return_value = response(200)
+    cognito.revoke_refresh_token("test_refresh_token")
+
+    stats = app.extensions[cfg.APP_EXTENSION_KEY].breaker_stats()
+    assert stats["token"].state == OPEN
+    assert stats["revoke"].state == CLOSED
+    assert stats["jwks"].state == CLOSED
+
+
+def test_jwks_breaker(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    # undo the patched fetch_data from the jwk_patch fixture
+    mocker.stopall()
+    app.config["AWS_COGNITO_BREAKER_FAILURE_RATE"] = 1
+    app.config["AWS_COGNITO_BREAKER_MIN_CALLS"] = 1
+    get = mocker.patch.object(
+        requests.Session, "get", side_effect=requests.ConnectionError("down")
+    )
+
+    with pytest.raises(CognitoError) as err:
+        TokenService(cfg).verify_access_token(make_token())
+    assert not isinstance(err.value, CircuitOpenError)
+
+    # the JWKS endpoint is not called again while the breaker is open
+    with pytest.raises(CircuitOpenError):
+        TokenService(cfg).verify_access_token(make_token(), use_cache=False)
+    assert get.call_count == 1
+    assert isinstance(TokenService(cfg).jwks._client, JWKSClient)
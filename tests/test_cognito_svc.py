@@ -1,10 +1,13 @@
+import asyncio
+import json
 import re
+from typing import Any, Dict
 
 import pytest
 import requests
 from flask import Flask
 from pytest_mock import MockerFixture
-from requests import JSONDecodeError
+from requests import JSONDecodeError, Response
 
 from flask_cognito_lib.config import Config
 from flask_cognito_lib.exceptions import CognitoError
@@ -46,7 +49,7 @@ def test_exchange_code_for_token_requests_error(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         side_effect=requests.exceptions.RequestException("404"),
     )
 
@@ -60,7 +63,7 @@ def test_exchange_code_for_token(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(json=lambda: {"access_token": "test_access_token"}),
     )
 
@@ -75,7 +78,7 @@ def test_exchange_code_for_token_with_public_client(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(json=lambda: {"access_token": "test_access_token"}),
     )
 
@@ -92,7 +95,7 @@ def test_exchange_code_for_token_error(
 ) -> None:
     error_code = "some error code"
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: {
                 "error": error_code,
@@ -115,7 +118,7 @@ def test_exchange_code_for_token_error_description(
     error_code = "some error code"
     error_description = "some error description"
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: {
                 "error": error_code,
@@ -137,7 +140,7 @@ def test_exchange_code_for_token_error_json(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: raise_exception(JSONDecodeError("Expecting value", "", 0))
         ),
@@ -156,7 +159,7 @@ def test_refresh_token(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: {
                 "access_token": "new_test_access_token",
@@ -178,7 +181,7 @@ def test_refresh_token_typo(
 ) -> None:
     # Check the function works under the old name that had a typo
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: {
                 "access_token": "new_test_access_token",
@@ -199,7 +202,7 @@ def test_revoke_refresh_token(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
     )
 
     cognito = CognitoService(cfg)
@@ -211,7 +214,7 @@ def test_revoke_refresh_token_error_json(
     mocker: MockerFixture,
 ) -> None:
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: raise_exception(JSONDecodeError("Expecting value", "", 0))
         ),
@@ -220,3 +223,119 @@ def test_revoke_refresh_token_error_json(
     # Non-JSON response should not raise an exception
     cognito = CognitoService(cfg)
     cognito.revoke_refresh_token(refresh_token="test_refresh_token")
+
+
+def test_async_token_exchange(
+    cfg: Config,
+    mocker: MockerFixture,
+) -> None:
+    post = mocker.patch(
+        "requests.Session.post",
+        return_value=mocker.Mock(json=lambda: {"access_token": "test_access_token"}),
+    )
+
+    async def exchange() -> None:
+        cognito = CognitoService(cfg)
+        token = await cognito.exchange_code_for_token_async(
+            code="test_code", code_verifier="asdf"
+        )
+        assert token.access_token == "test_access_token"
+        token = await cognito.exchange_refresh_token_async("test_refresh_token")
+        assert token.access_token == "test_access_token"
+        await cognito.revoke_refresh_token_async("test_refresh_token")
+
+    asyncio.run(exchange())
+    grants = [c.kwargs["data"].get("grant_type") for c in post.call_args_list]
+    assert grants == ["authorization_code", "refresh_token", None]
+
+
+def response(status: int, body: Dict[str, str], **headers: str) -> Response:
+    resp = Response()
+    resp.status_code = status
+    resp._content = json.dumps(body).encode()
+    resp.headers.update(headers)
+    return resp
+
+
+@pytest.fixture
+def retries(app: Flask, mocker: MockerFixture) -> Any:
+    app.config["AWS_COGNITO_RETRY_MAX_ATTEMPTS"] = 3
+    app.config["AWS_COGNITO_RETRY_JITTER"] = 0
+    return mocker.patch("flask_cognito_lib.services.cognito_svc.time.sleep")
+
+
+def test_retry_with_backoff(cfg: Config, mocker: MockerFixture, retries: Any) -> None:
+    ok = response(200, {"access_token": "test_access_token"})
+    post = mocker.patch(
+        "requests.Session.post",
+        side_effect=[
+            response(503, {"error": "unavailable"}),
+            requests.ConnectionError("reset"),
+            ok,
+        ],
+    )
+
+    token = CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert token.access_token == "test_access_token"
+    assert post.call_count == 3
+    assert [c.args[0] for c in retries.call_args_list] == [0.1, 0.2]
+
+    # gives up after the maximum number of attempts
+    post.side_effect = [response(503, {"error": "unavailable"})] * 3 + [ok]
+    with pytest.raises(CognitoError):
+        CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert post.call_count == 6
+
+    # client errors are not retried
+    post.side_effect = [response(400, {"error": "invalid_grant"}), ok]
+    with pytest.raises(CognitoError, match="invalid_grant"):
+        CognitoService(cfg).revoke_refresh_token("test_refresh_token")
+    assert post.call_count == 7
+
+
+def test_retry_after(cfg: Config, mocker: MockerFixture, retries: Any) -> None:
+    ok = response(200, {"access_token": "test_access_token"})
+    throttled = response(
+        429, {"error": "TooManyRequestsException"}, **{"Retry-After": "2"}
+    )
+    post = mocker.patch("requests.Session.post", side_effect=[throttled, ok])
+
+    CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    retries.assert_called_once_with(2.0)
+
+    # not retried if asked to wait longer than the maximum delay
+    throttled.headers["Retry-After"] = "60"
+    post.side_effect = [throttled, ok]
+    with pytest.raises(CognitoError, match="TooManyRequestsException"):
+        CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert retries.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "failure, retried",
+    [
+        (requests.exceptions.ConnectTimeout("connect"), True),
+        (response(429, {"error": "TooManyRequestsException"}), True),
+        (requests.exceptions.ReadTimeout("read"), False),
+        (requests.ConnectionError("reset"), False),
+        (response(500, {"error": "server_error"}), False),
+    ],
+)
+def test_retry_authorization_code(
+    cfg: Config,
+    mocker: MockerFixture,
+    retries: Any,
+    failure: Any,
+    retried: bool,
+) -> None:
+    # the code must not be sent again if Cognito may have consumed it
+    ok = response(200, {"access_token": "test_access_token"})
+    mocker.patch("requests.Session.post", side_effect=[failure, ok])
+
+    cognito = CognitoService(cfg)
+    if retried:
+        cognito.exchange_code_for_token(code="test_code", code_verifier="asdf")
+    else:
+        with pytest.raises(CognitoError):
+            cognito.exchange_code_for_token(code="test_code", code_verifier="asdf")
+    assert retries.call_count == int(retried)
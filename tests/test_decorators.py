@@ -1,15 +1,27 @@
+import asyncio
 from base64 import urlsafe_b64encode
 from hashlib import sha256
 
 import pytest
 from cryptography.fernet import Fernet
-from flask import Flask, session
+from flask import Flask, Response, make_response, session
 from flask.testing import FlaskClient
 from pytest_mock import MockerFixture
 
 from flask_cognito_lib.config import Config
-from flask_cognito_lib.decorators import get_token_from_cookie, remove_from_session
-from flask_cognito_lib.exceptions import CognitoError, TokenVerifyError
+from flask_cognito_lib.decorators import (
+    auth_required_async,
+    cognito_login_callback_async,
+    cognito_refresh_callback_async,
+    get_token_from_cookie,
+    remove_from_session,
+)
+from flask_cognito_lib.exceptions import (
+    AuthorisationRequiredError,
+    CognitoError,
+    CognitoGroupRequiredError,
+    TokenVerifyError,
+)
 
 
 def test_remove_from_session(client: FlaskClient) -> None:
@@ -91,6 +103,7 @@ def test_cognito_custom_state(client: FlaskClient, cfg: Config) -> None:
 
 def test_cognito_custom_scopes(client: FlaskClient, app: Flask, cfg: Config) -> None:
     app.config["AWS_COGNITO_SCOPES"] = ["openid", "profile", "phone", "email"]
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
     response = client.get("/login")
 
     # should 302 redirect to cognito
@@ -184,6 +197,7 @@ def test_cognito_login_callback_refresh(
 ) -> None:
     client.application.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
     client.application.config["AWS_COGNITO_REFRESH_COOKIE_ENCRYPTED"] = False
+    client.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
 
     with client as c:
         with c.session_transaction() as sess:
@@ -211,6 +225,7 @@ def test_cognito_login_callback_refresh_encrypted(
 ) -> None:
     client.application.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
     client.application.config["AWS_COGNITO_REFRESH_COOKIE_ENCRYPTED"] = True
+    client.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
 
     fernet = Fernet(
         urlsafe_b64encode(sha256(cfg.secret_key).digest()),
@@ -246,6 +261,7 @@ def test_cognito_login_cookie_domain(
 ) -> None:
     # set a domain for the cookie
     client.application.config["AWS_COGNITO_COOKIE_DOMAIN"] = ".example.com"
+    client.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
 
     with client as c:
         with c.session_transaction() as sess:
@@ -271,6 +287,7 @@ def test_cognito_login_cookie_samesite(
     # set a domain for the cookie
     client.application.config["AWS_COGNITO_COOKIE_DOMAIN"] = ".example.com"
     client.application.config["AWS_COGNITO_COOKIE_SAMESITE"] = "Strict"
+    client.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
 
     with client as c:
         with c.session_transaction() as sess:
@@ -305,6 +322,7 @@ def test_cognito_refresh_missing_token(
     refresh_token_response: None,
 ) -> None:
     client.application.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
+    client.application.extensions[Config.APP_EXTENSION_KEY].reload_config()
 
     with pytest.raises(CognitoError, match="No refresh token provided"):
         client.get("/refresh")
@@ -395,6 +413,7 @@ def test_auth_required_expired_token(
 ) -> None:
     # 403 if the token verification has failed
     app.config["AWS_COGNITO_EXPIRATION_LEEWAY"] = 0
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
     client.set_cookie(key=cfg.COOKIE_NAME, value=access_token)
     response = client.get("/private")
     assert response.status_code == 403
@@ -407,6 +426,17 @@ def test_auth_required_valid_token(client_with_cookie: FlaskClient) -> None:
     assert response.data.decode("utf-8") == "ok"
 
 
+def test_auth_required_uses_request_app_context(
+    client_with_cookie: FlaskClient,
+    mocker: MockerFixture,
+) -> None:
+    # the decorator does not push another app context (the request reuses
+    # the one already pushed by the app fixture)
+    app_context = mocker.spy(Flask, "app_context")
+    assert client_with_cookie.get("/private").status_code == 200
+    assert app_context.call_count == 0
+
+
 def test_auth_required_all_groups_valid(client_with_cookie: FlaskClient) -> None:
     # Has access to this route as the token has the correct group membership
     response = client_with_cookie.get("/valid_group")
@@ -430,6 +460,7 @@ def test_auth_required_extension_dislabled(
 ) -> None:
     # Return page with 200 OK if the extension is disabled (bypass Cognito)
     app.config["AWS_COGNITO_DISABLED"] = True
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
     response = client.get("/private")
     assert response.status_code == 200
     assert response.data.decode("utf-8") == "ok"
@@ -506,3 +537,90 @@ def test_auth_required_any_group_no_groups(
 
     response_data = response.data.decode("utf-8")
     assert "No groups found in claims" in response_data
+
+
+async def ok() -> Response:
+    return make_response("ok")
+
+
+def test_auth_required_async(
+    app: Flask,
+    cfg: Config,
+    access_token: str,
+) -> None:
+    # Flask runs async views with asgiref, call the view directly instead
+    view = auth_required_async(groups=["admin"])(ok)
+    cookie = {"Cookie": f"{cfg.COOKIE_NAME}={access_token}"}
+    with app.test_request_context("/private", headers=cookie):
+        assert asyncio.run(view()).get_data() == b"ok"
+
+    with app.test_request_context("/private"):
+        with pytest.raises(AuthorisationRequiredError):
+            asyncio.run(view())
+
+    view = auth_required_async(groups=["other"])(ok)
+    with app.test_request_context("/private", headers=cookie):
+        with pytest.raises(CognitoGroupRequiredError):
+            asyncio.run(view())
+
+
+def test_cognito_login_callback_async(
+    app: Flask,
+    cfg: Config,
+    access_token: str,
+    id_token: str,
+    mocker: MockerFixture,
+) -> None:
+    post = mocker.patch(
+        "requests.Session.post",
+        return_value=mocker.Mock(
+            json=lambda: {"access_token": access_token, "id_token": id_token}
+        ),
+    )
+
+    view = cognito_login_callback_async(ok)
+    with app.test_request_context("/postlogin?code=abc&state=5678__custom"):
+        session["code_verifier"] = "1234"
+        session["state"] = "5678__custom"
+        session["nonce"] = "MSln6nvPIIBVMhsNUOtUCtssceUKz4dhCRZi5QZRU4A="
+
+        response = asyncio.run(view())
+        assert response.get_data() == b"ok"
+        assert post.call_args.kwargs["data"]["code"] == "abc"
+
+        cookies_set = response.headers.getlist("Set-Cookie")
+        assert cookies_set[0].startswith(f"{cfg.COOKIE_NAME}={access_token}")
+        assert cookies_set[1].startswith(f"{cfg.COOKIE_NAME_ID}={id_token}")
+
+        assert "nonce" not in session
+        assert session["state"] == "custom"
+        assert "claims" in session
+        assert "user_info" in session
+
+
+def test_cognito_refresh_callback_async(
+    app: Flask,
+    cfg: Config,
+    access_token: str,
+    refresh_token: str,
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_REFRESH_FLOW_ENABLED"] = True
+    app.config["AWS_COGNITO_REFRESH_COOKIE_ENCRYPTED"] = False
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+    mocker.patch(
+        "requests.Session.post",
+        return_value=mocker.Mock(json=lambda: {"access_token": access_token}),
+    )
+
+    view = cognito_refresh_callback_async(ok)
+    cookie = {"Cookie": f"{cfg.COOKIE_NAME_REFRESH}={refresh_token}"}
+    with app.test_request_context("/refresh", headers=cookie):
+        response = asyncio.run(view())
+        cookies_set = response.headers.getlist("Set-Cookie")
+        assert cookies_set[0].startswith(f"{cfg.COOKIE_NAME}={access_token}")
+        assert "claims" in session
+
+    with app.test_request_context("/refresh"):
+        with pytest.raises(CognitoError, match="No refresh token"):
+            asyncio.run(view())
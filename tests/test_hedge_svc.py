@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Any, Callable, Generator, List
+
+import pytest
+from flask import Flask
+from pytest_mock import MockerFixture
+from requests import Response
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.services.cognito_svc import CognitoService
+from flask_cognito_lib.services.hedge_svc import MIN_SAMPLES, Hedger, get_hedger
+
+
+@pytest.fixture
+def release() -> Generator[threading.Event, None, None]:
+    # Unblocks the slow calls left running at the end of a test
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def slow_then_fast(release: threading.Event, results: List[Any]) -> Callable[..., Any]:
+    """Return a function where the first call blocks until released"""
+    calls = iter(range(len(results)))
+
+    def call(*args: Any, **kwargs: Any) -> Any:
+        n = next(calls)
+        if n == 0:
+            release.wait(5)
+        result = results[n]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call
+
+
+def test_hedger(release: threading.Event) -> None:
+    hedger = Hedger(percentile=95, initial_delay=0.01)
+
+    fn = slow_then_fast(release, ["slow", "hedge"])
+    assert hedger.run(fn) == "hedge"
+
+    # a fast call is not hedged
+    assert hedger.run(lambda: "fast") == "fast"
+
+    stats = hedger.stats()
+    assert (stats.requests, stats.hedged, stats.hedge_wins) == (2, 1, 1)
+    hedger.close()
+
+
+def test_hedger_rate_limited(release: threading.Event) -> None:
+    hedger = Hedger(percentile=95, max_rate=0.5, initial_delay=0.01)
+    release.set()
+
+    def slow() -> str:
+        time.sleep(0.05)
+        return "ok"
+
+    for _ in range(4):
+        hedger.run(slow)
+
+    # the budget allows every other request to be hedged
+    assert hedger.stats().hedged == 2
+    hedger.close()
+
+
+def test_hedger_errors(release: threading.Event) -> None:
+    hedger = Hedger(percentile=95, max_rate=1, initial_delay=0.01)
+
+    # the first call to succeed is used...
+    fn = slow_then_fast(release, ["slow", ValueError("hedge")])
+    threading.Timer(0.05, release.set).start()
+    assert hedger.run(fn) == "slow"
+
+    # ...and an error is only raised if both fail
+    blocked = threading.Event()
+    fn = slow_then_fast(blocked, [ValueError("first"), ValueError("hedge")])
+    threading.Timer(0.05, blocked.set).start()
+    with pytest.raises(ValueError):
+        hedger.run(fn)
+    assert hedger.stats().hedged == 2
+    hedger.close()
+
+
+def test_hedger_busy(release: threading.Event) -> None:
+    hedger = Hedger(percentile=95, max_rate=1, initial_delay=0.01, max_workers=1)
+    caller = threading.get_ident()
+    threads = []
+
+    def call() -> str:
+        threads.append(threading.get_ident())
+        release.wait(5)
+        return "ok"
+
+    # the only worker is held by a slow request...
+    slow = threading.Thread(target=hedger.run, args=(call,))
+    slow.start()
+    while not threads:
+        time.sleep(0.001)
+
+    # ...so the next one is sent from the calling thread, and not hedged
+    threading.Timer(0.05, release.set).start()
+    assert hedger.run(call) == "ok"
+    slow.join()
+    assert threads[0] != caller and threads[1:] == [caller]
+    assert hedger.stats().hedged == 0
+
+    # as are requests once the hedger is closed
+    hedger.close()
+    assert hedger.run(lambda: threading.get_ident()) == caller
+
+
+def test_hedger_delay() -> None:
+    hedger = Hedger(percentile=90, initial_delay=2)
+    assert hedger.delay() == 2
+
+    for _ in range(MIN_SAMPLES):
+        hedger.run(lambda: None)
+    assert hedger.delay() < 2
+    hedger.close()
+
+
+def test_get_hedger(app: Flask, cfg: Config) -> None:
+    assert get_hedger(cfg.token_endpoint, cfg) is None
+
+    app.config["AWS_COGNITO_HEDGE_PERCENTILE"] = 95
+    hedger = get_hedger(cfg.token_endpoint, cfg)
+    assert hedger is not None and hedger.percentile == 95
+    assert get_hedger(cfg.token_endpoint, cfg) is hedger
+
+
+def response(access_token: str) -> Response:
+    resp = Response()
+    resp.status_code = 200
+    resp._content = f'{{"access_token": "{access_token}"}}'.encode()
+    return resp
+
+
+def test_cognito_service_hedging(
+    app: Flask,
+    cfg: Config,
+    mocker: MockerFixture,
+    release: threading.Event,
+) -> None:
+    app.config["AWS_COGNITO_HEDGE_PERCENTILE"] = 95
+    app.config["AWS_COGNITO_HEDGE_INITIAL_DELAY"] = 0.01
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+
+    post = mocker.patch(
+        "requests.Session.post",
+        side_effect=slow_then_fast(release, [response("slow"), response("hedge")]),
+    )
+    token = CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert token.access_token == "hedge"
+    assert post.call_count == 2
+
+    stats = app.extensions[cfg.APP_EXTENSION_KEY].hedge_stats()
+    assert (stats.hedged, stats.hedge_wins) == (1, 1)
+
+    # a single-use authorisation code is never sent twice
+    def slow_post(**kwargs: Any) -> Response:
+        time.sleep(0.05)
+        return response("code")
+
+    post.side_effect = slow_post
+    token = CognitoService(cfg).exchange_code_for_token(
+        code="test_code", code_verifier="asdf"
+    )
+    assert token.access_token == "code"
+    assert post.call_count == 3
@@ -0,0 +1,90 @@
+import pytest
+import requests
+from flask import Flask
+from jwt import PyJWKClientError
+from pytest_mock import MockerFixture
+from requests.cookies import MockRequest, create_cookie
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.services.cognito_svc import CognitoService
+from flask_cognito_lib.services.http_svc import (
+    RetryPolicy,
+    clear_http_sessions,
+    get_http_session,
+    get_timeout,
+    parse_retry_after,
+)
+from flask_cognito_lib.services.jwks_svc import JWKSClient
+
+
+def test_get_http_session() -> None:
+    session = get_http_session("https://example.com/oauth2/token", pool_size=4)
+    assert get_http_session("https://example.com/oauth2/revoke") is session
+    assert get_http_session("https://other.example.com/") is not session
+
+    adapter = session.get_adapter("https://example.com/")
+    assert adapter._pool_maxsize == 4  # type: ignore[attr-defined]
+
+    # cookies set by one response are never sent with another user's request
+    cookie = create_cookie("XSRF-TOKEN", "abc", domain="example.com")
+    request = requests.Request("POST", "https://example.com/oauth2/token")
+    policy = session.cookies._policy  # type: ignore[attr-defined]
+    assert not policy.set_ok(cookie, MockRequest(request.prepare()))
+
+    clear_http_sessions()
+    assert get_http_session("https://example.com/") is not session
+
+
+def test_cognito_service_session(
+    app: Flask,
+    cfg: Config,
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_HTTP_CONNECT_TIMEOUT"] = 2
+    app.config["AWS_COGNITO_HTTP_READ_TIMEOUT"] = 3
+    assert get_timeout(cfg) == (2, 3)
+
+    post = mocker.patch(
+        "requests.Session.post",
+        return_value=mocker.Mock(json=lambda: {"access_token": "test_access_token"}),
+    )
+    CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    CognitoService(cfg).revoke_refresh_token("test_refresh_token")
+
+    assert [c.kwargs["timeout"] for c in post.call_args_list] == [(2, 3), (2, 3)]
+    assert get_http_session(cfg.token_endpoint) is get_http_session(cfg.revoke_endpoint)
+
+
+def test_jwks_client_fetch_data(mocker: MockerFixture) -> None:
+    # undo the patched fetch_data from the jwk_patch fixture
+    mocker.stopall()
+    session = requests.Session()
+    client = JWKSClient("https://example.com/jwks.json", session, timeout=(1, 2))
+    get = mocker.patch.object(session, "get")
+
+    get.return_value.json.return_value = {"keys": []}
+    assert client.fetch_data() == {"keys": []}
+    assert get.call_args.kwargs["timeout"] == (1, 2)
+
+    get.return_value.json.return_value = ["not", "an", "object"]
+    with pytest.raises(PyJWKClientError, match="JSON object"):
+        client.fetch_data()
+
+    get.side_effect = requests.ConnectionError("unreachable")
+    with pytest.raises(PyJWKClientError, match="unreachable"):
+        client.fetch_data()
+
+
+def test_retry_policy(mocker: MockerFixture) -> None:
+    mocker.patch("flask_cognito_lib.services.http_svc.random.random", return_value=0.5)
+    policy = RetryPolicy(max_attempts=5, base_delay=1, max_delay=3, jitter=0.5)
+
+    assert [policy.delay(n) for n in (1, 2, 3)] == [0.75, 1.5, 2.25]
+    assert policy.delay(1, retry_after="2") == 2
+    assert policy.delay(1, retry_after="10") == float("inf")
+    # an unparseable header falls back to the backoff
+    assert policy.delay(1, retry_after="soon") == 0.75
+
+    mocker.patch("flask_cognito_lib.services.http_svc.time.time", return_value=0)
+    assert parse_retry_after("Thu, 01 Jan 1970 00:00:30 GMT") == 30
+    assert parse_retry_after("-5") == 0
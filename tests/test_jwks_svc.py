@@ -0,0 +1,393 @@
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from flask import Flask
+from jwt import PyJWKClientError
+from pytest_mock import MockerFixture
+
+from flask_cognito_lib import CognitoAuth
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.services.jwks_svc import (
+    JWKSStore,
+    _Flight,
+    clear_jwks_stores,
+    get_jwks_store,
+)
+from flask_cognito_lib.services.token_svc import TokenService
+
+KID = "2gH42FHBLdfSv1YQwmql6bi45sX3dovsvvuCXQQ6Uaw="
+
+
+def test_store_shared_between_token_services(
+    cfg: Config,
+    access_token: str,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+
+    # a new TokenService is created for every request
+    for _ in range(3):
+        TokenService(cfg).verify_access_token(access_token, leeway=1e9)
+
+    assert fetch.call_count == 1
+
+
+def test_get_jwks_store_keyed_by_issuer(app: Flask, cfg: Config) -> None:
+    store = get_jwks_store(cfg)
+    assert get_jwks_store(cfg) is store
+
+    app.config["AWS_COGNITO_USER_POOL_ID"] = "eu-west-1_other"
+    assert get_jwks_store(cfg) is not store
+
+
+def test_get_jwks_store_ttl(app: Flask, cfg: Config) -> None:
+    app.config["AWS_COGNITO_JWKS_CACHE_TTL"] = 60
+    assert get_jwks_store(cfg).ttl == 60
+
+
+def test_store_refetch_after_ttl(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    clock = mocker.patch("flask_cognito_lib.services.jwks_svc.time.monotonic")
+    clock.return_value = 1000.0
+
+    store = JWKSStore("https://example.com/jwks.json", ttl=10)
+    store.get_signing_key(KID)
+    store.get_signing_key(KID)
+    assert fetch.call_count == 1
+
+    clock.return_value = 1011.0
+    assert store.expired
+    store.get_signing_key(KID)
+    assert fetch.call_count == 2
+
+
+def test_store_unknown_kid(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    clock = mocker.patch("flask_cognito_lib.services.jwks_svc.time.monotonic")
+    clock.return_value = 1000.0
+
+    store = JWKSStore("https://example.com/jwks.json", min_refetch_interval=30)
+    with pytest.raises(PyJWKClientError, match="Unable to find a signing key"):
+        store.get_signing_key("unknown")
+
+    # the keys were only just downloaded, so they are not downloaded again
+    assert fetch.call_count == 1
+
+    # but are downloaded once the minimum interval has passed (key rotation)
+    clock.return_value = 1031.0
+    with pytest.raises(PyJWKClientError, match="Unable to find a signing key"):
+        store.get_signing_key("unknown")
+    assert fetch.call_count == 2
+
+
+def test_store_invalid_key_set(mocker: MockerFixture) -> None:
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        return_value={"keys": []},
+    )
+
+    with pytest.raises(PyJWKClientError):
+        JWKSStore("https://example.com/jwks.json").get_signing_key(KID)
+
+
+def test_store_stale_if_error(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    clock = mocker.patch("flask_cognito_lib.services.jwks_svc.time.monotonic")
+    clock.return_value = 1000.0
+
+    store = JWKSStore("https://example.com/jwks.json", ttl=10, max_staleness=60)
+    store.get_signing_key(KID)
+
+    # Cognito is unreachable, the last good keys are served within the window
+    fetch.side_effect = PyJWKClientError("unreachable")
+    clock.return_value = 1050.0
+    assert store.get_signing_key(KID).key_id == KID
+
+    stats = store.stats()
+    assert stats.stale
+    assert stats.error_count == 1
+    assert stats.last_error == "unreachable"
+    assert stats.last_refresh_age == 50.0
+
+    # ...but not once the max staleness has passed
+    clock.return_value = 1071.0
+    with pytest.raises(PyJWKClientError):
+        store.get_signing_key(KID)
+
+
+def test_store_stale_while_revalidate(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    clock = mocker.patch("flask_cognito_lib.services.jwks_svc.time.monotonic")
+    clock.return_value = 1000.0
+
+    store = JWKSStore("https://example.com/jwks.json", ttl=10, max_staleness=60)
+    store.get_signing_key(KID)
+
+    # another thread is downloading the keys, serve the expired set
+    clock.return_value = 1020.0
+    store._inflight = _Flight()
+    assert store.get_signing_key(KID).key_id == KID
+    assert fetch.call_count == 1
+
+
+def test_store_background_refresher(
+    app: Flask,
+    cfg: Config,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    refreshed = threading.Event()
+
+    def fetch_data() -> Dict[str, List[Dict[str, str]]]:
+        refreshed.set()
+        return jwks
+
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        side_effect=fetch_data,
+    )
+    app.config["AWS_COGNITO_JWKS_REFRESH_INTERVAL"] = 60
+
+    store = get_jwks_store(cfg)
+    assert store.refresher_running
+    assert store.refresh_interval == 60
+
+    # keys are downloaded in the background without any request
+    assert refreshed.wait(5)
+    store.stop_refresher(timeout=5)
+    assert not store.stats().refresher_running
+    assert store.stats().refresh_count == 1
+    assert store.stats().key_count == 3
+
+
+def test_jwks_stats(app: Flask, cfg: Config, access_token: str) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    assert auth.jwks_stats().last_refresh_age is None
+
+    auth.verify_access_token(access_token, leeway=1e9)
+    stats = auth.jwks_stats()
+    assert stats.last_refresh_age is not None
+    assert not stats.stale
+
+
+def test_store_single_flight_unknown_kid(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    release = threading.Event()
+    calls = []
+
+    def fetch_data() -> Dict[str, List[Dict[str, str]]]:
+        calls.append(1)
+        release.wait(5)
+        return jwks
+
+    clock = mocker.patch("flask_cognito_lib.services.jwks_svc.time.monotonic")
+    clock.return_value = 1000.0
+    store = JWKSStore("https://example.com/jwks.json", min_refetch_interval=30)
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    store.get_jwk_set()
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        side_effect=fetch_data,
+    )
+    clock.return_value = 1100.0
+
+    # Many requests with a token signed by a newly rotated key arrive together
+    errors = []
+
+    def verify() -> None:
+        try:
+            store.get_signing_key("rotated")
+        except PyJWKClientError as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=verify) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while not store.refreshing:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(errors) == 8
+
+
+def test_store_single_flight_error(mocker: MockerFixture) -> None:
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        side_effect=ValueError("not json"),
+    )
+
+    store = JWKSStore("https://example.com/jwks.json")
+    with pytest.raises(PyJWKClientError, match="not json"):
+        store.get_signing_key(KID)
+    assert not store.refreshing
+
+
+def test_store_snapshot_roundtrip(
+    tmp_path: Path,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    path = str(tmp_path / "jwks.json")
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+
+    # the snapshot is written after every successful download
+    store = JWKSStore("https://example.com/jwks.json", snapshot_path=path)
+    store.get_jwk_set()
+    assert json.loads(Path(path).read_text())["jwks"] == jwks
+    assert list(tmp_path.iterdir()) == [tmp_path / "jwks.json"]
+
+    # a new process can verify without downloading the keys
+    fresh = JWKSStore("https://example.com/jwks.json")
+    assert fresh.load_snapshot(path, max_age=60)
+    assert fresh.get_signing_key(KID).key_id == KID
+    assert fetch.call_count == 1
+
+
+def test_store_snapshot_age(
+    tmp_path: Path,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    path = str(tmp_path / "jwks.json")
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    JWKSStore("https://example.com/jwks.json", snapshot_path=path).get_jwk_set()
+
+    # written 80000 seconds ago, past the TTL but within the max age
+    saved_at = json.loads(Path(path).read_text())["saved_at"]
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.time.time",
+        return_value=saved_at + 80000,
+    )
+    store = JWKSStore("https://example.com/jwks.json", ttl=3600)
+    assert store.load_snapshot(path, max_age=86400)
+    assert store.expired
+    assert store.age == pytest.approx(80000, abs=60)
+
+    # so the keys are downloaded again on first use
+    store.get_signing_key(KID)
+    assert fetch.call_count == 2
+    assert not store.expired
+
+
+def test_store_snapshot_rejected(
+    tmp_path: Path,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    path = str(tmp_path / "jwks.json")
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    JWKSStore("https://example.com/jwks.json", snapshot_path=path).get_jwk_set()
+
+    # missing file
+    assert not JWKSStore("https://example.com/jwks.json").load_snapshot(
+        str(tmp_path / "missing.json"), max_age=60
+    )
+
+    # for a different user pool
+    assert not JWKSStore("https://example.com/other.json").load_snapshot(
+        path, max_age=60
+    )
+
+    # too old
+    mocker.patch("flask_cognito_lib.services.jwks_svc.time.time", return_value=1e12)
+    assert not JWKSStore("https://example.com/jwks.json").load_snapshot(
+        path, max_age=60
+    )
+
+    # corrupt
+    Path(path).write_text("{")
+    assert not JWKSStore("https://example.com/jwks.json").load_snapshot(
+        path, max_age=60
+    )
+
+
+def test_init_app_loads_snapshot(
+    app: Flask,
+    cfg: Config,
+    tmp_path: Path,
+    access_token: str,
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    path = str(tmp_path / "jwks.json")
+    app.config["AWS_COGNITO_JWKS_SNAPSHOT_PATH"] = path
+    get_jwks_store(cfg).get_jwk_set()
+    clear_jwks_stores()
+
+    # a new worker starts and verifies a token without any network call
+    fetch = mocker.patch("flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data")
+    CognitoAuth().init_app(app)
+    TokenService(cfg).verify_access_token(access_token, leeway=1e9)
+    fetch.assert_not_called()
+
+
+def test_store_key_index(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    store = JWKSStore("https://example.com/jwks.json")
+
+    key = store.get_key(KID)
+    assert isinstance(key, RSAPublicKey)
+    assert key.public_numbers() == store.get_signing_key(KID).key.public_numbers()
+
+    # the index is read without going back through the key set
+    lookup = mocker.patch.object(store, "get_signing_key")
+    assert store.get_key(KID) is key
+    lookup.assert_not_called()
+
+
+def test_store_key_index_unknown_kid(
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data", return_value=jwks
+    )
+    store = JWKSStore("https://example.com/jwks.json")
+
+    with pytest.raises(PyJWKClientError, match="Unable to find a signing key"):
+        store.get_key("unknown")
@@ -0,0 +1,103 @@
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask
+from jwt.algorithms import RSAAlgorithm
+from pytest_mock import MockerFixture
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.services.jwks_svc import JWKSStore
+from flask_cognito_lib.services.token_svc import (
+    OffloadVerifier,
+    TokenService,
+    get_verifier,
+)
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_c7O90SNDF"
+CLIENT_ID = "4lln66726pp3f4gi1krj0sta9h"
+
+
+def test_offload_verifier(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+) -> None:
+    app.config["AWS_COGNITO_VERIFY_PROCESSES"] = 1
+    # long enough for the workers to start on a slow machine
+    app.config["AWS_COGNITO_VERIFY_PROCESS_TIMEOUT"] = 30
+    verifier = get_verifier(cfg)
+    assert isinstance(verifier, OffloadVerifier)
+
+    token = make_token()
+    claims = TokenService(cfg).verify_access_token(token, leeway=0)
+    assert claims["token_use"] == "access"
+
+    signing_input, signature = token.rsplit(".", 1)
+    tampered = f"{signing_input}.{'B' if signature[0] == 'A' else 'A'}{signature[1:]}"
+    results = TokenService(cfg).verify_access_tokens([token, tampered])
+    assert [r.ok for r in results] == [True, False]
+
+    stats = verifier.offloader.stats()
+    assert stats.pool_running
+    assert (stats.offloaded, stats.inline) == (3, 0)
+
+
+def test_offload_keys_pushed_on_change(
+    make_token: Callable[..., str],
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    store = JWKSStore("https://example.com/jwks.json", min_refetch_interval=0)
+    verifier = OffloadVerifier(ISSUER, CLIENT_ID, jwks=store, timeout=30)
+    try:
+        assert verifier.verify_access(make_token())
+        assert verifier.offloader.stats().pool_restarts == 0
+
+        # the user pool keys are rotated
+        rotated = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = RSAAlgorithm.to_jwk(rotated.public_key(), as_dict=True)
+        jwk.update({"kid": "rotated", "alg": "RS256", "use": "sig"})
+        mocker.patch(
+            "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+            return_value={"keys": [*jwks["keys"], jwk]},
+        )
+        token = jwt.encode(
+            jwt.decode(make_token(), options={"verify_signature": False}),
+            rotated,
+            algorithm="RS256",
+            headers={"kid": "rotated"},
+        )
+
+        # the new keys are pushed to a new pool that verifies the token
+        assert verifier.verify_access(token)
+        stats = verifier.offloader.stats()
+        assert stats.pool_restarts == 1
+        assert (stats.offloaded, stats.inline) == (2, 0)
+    finally:
+        verifier.close()
+    assert not verifier.offloader.stats().pool_running
+
+
+def test_offload_timeout(
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    store = JWKSStore("https://example.com/jwks.json")
+    verifier = OffloadVerifier(ISSUER, CLIENT_ID, jwks=store, timeout=30)
+    try:
+        assert verifier.verify_access(make_token())
+
+        # a worker that never answers does not hold up the request
+        verifier.offloader.timeout = 0.01
+        pool = verifier.offloader._get_pool()
+        pending: Future = Future()
+        mocker.patch.object(pool, "submit", return_value=pending)
+        assert verifier.verify_access(make_token())
+        assert pending.cancelled()
+
+        stats = verifier.offloader.stats()
+        assert (stats.offloaded, stats.inline, stats.timeouts) == (1, 1, 1)
+    finally:
+        verifier.close()
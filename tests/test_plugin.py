@@ -1,40 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
 import pytest
-from flask import Flask
+from flask import Flask, Response, jsonify, request
+from flask.testing import FlaskClient
 from pytest_mock import MockerFixture
 
 from flask_cognito_lib import CognitoAuth
-from flask_cognito_lib.config import Config
-from flask_cognito_lib.exceptions import CognitoError
+from flask_cognito_lib.config import Config, ConfigSnapshot
+from flask_cognito_lib.decorators import auth_required
+from flask_cognito_lib.exceptions import CognitoError, ConfigurationError
+from flask_cognito_lib.services.cognito_svc import CognitoService
+from flask_cognito_lib.services.jwks_svc import _stores, get_jwks_store
+from flask_cognito_lib.services.token_svc import FastVerifier, TokenService, Verifier
 
 
-def test_plugin_init(cfg: Config) -> None:
-    app = Flask(__name__)
-    CognitoAuth(app)
-    assert cfg.APP_EXTENSION_KEY in app.extensions
+@pytest.fixture
+def new_app(app: Flask) -> Flask:
+    # An app that the extension has not been initialised with yet
+    new_app = Flask(__name__)
+    new_app.config.update(app.config)
+    return new_app
+
+
+def test_plugin_init(new_app: Flask, cfg: Config) -> None:
+    CognitoAuth(new_app)
+    assert cfg.APP_EXTENSION_KEY in new_app.extensions
 
 
 def test_plugin_init_with_config_override(cfg_override: Config) -> None:
+    # custom configs are not read at startup
     app = Flask(__name__)
     CognitoAuth(app, cfg=cfg_override)
-    assert (
-        app.extensions[cfg_override.APP_EXTENSION_KEY].cfg.logout_redirect
-        == cfg_override.logout_redirect
-    )
+    with app.app_context():
+        assert (
+            app.extensions[cfg_override.APP_EXTENSION_KEY].cfg.logout_redirect
+            == cfg_override.logout_redirect
+        )
+
 
+def test_plugin_lazy_init(new_app: Flask, cfg: Config) -> None:
+    CognitoAuth().init_app(new_app)
+    assert cfg.APP_EXTENSION_KEY in new_app.extensions
 
-def test_plugin_lazy_init(cfg: Config) -> None:
+
+def test_plugin_init_missing_config() -> None:
+    # fails at startup rather than on the first request
+    with pytest.raises(ConfigurationError):
+        CognitoAuth(Flask(__name__))
+
+    # unless the extension is disabled
     app = Flask(__name__)
-    CognitoAuth().init_app(app)
-    assert cfg.APP_EXTENSION_KEY in app.extensions
+    app.config["AWS_COGNITO_DISABLED"] = True
+    CognitoAuth(app)
+
+
+def test_plugin_init_token_only(
+    new_app: Flask,
+    cfg: Config,
+    access_token: str,
+) -> None:
+    # an app that only verifies tokens needs no login or logout URLs
+    for key in ("AWS_COGNITO_REDIRECT_URL", "AWS_COGNITO_LOGOUT_URL"):
+        del new_app.config[key]
+    del new_app.config["AWS_COGNITO_DOMAIN"]
+    auth = CognitoAuth(new_app)
+
+    with new_app.app_context():
+        assert auth.token_service.verify_access_token(access_token, leeway=1e9)
+        # ...which are read from the app config on use
+        with pytest.raises(ConfigurationError):
+            auth.cfg.logout_endpoint
+        new_app.config["AWS_COGNITO_DOMAIN"] = "https://auth.example.com"
+        assert auth.cfg.token_endpoint == "https://auth.example.com/oauth2/token"
+
+
+def test_plugin_set_config(app: Flask, cfg: Config, cfg_override: Config) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    token_service = auth.token_service
+
+    # replaces the config of the current app, and its services
+    auth.cfg = cfg_override
+    assert auth.cfg is cfg_override
+    assert auth.token_service is not token_service
+    assert auth.token_service.cfg is cfg_override
+
+
+def test_plugin_config_snapshot(app: Flask, cfg: Config) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    snapshot = auth.cfg
+    assert isinstance(snapshot, ConfigSnapshot)
+    assert snapshot.token_endpoint == cfg.token_endpoint
+    with pytest.raises(AttributeError):
+        snapshot.region = "us-east-1"  # type: ignore[misc]
+
+    # app config changes are only used once reloaded
+    app.config["AWS_REGION"] = "us-east-1"
+    assert auth.cfg.region == "eu-west-1"
+    auth.reload_config()
+    assert auth.cfg.region == "us-east-1"
+    assert auth.cfg.issuer.startswith("https://cognito-idp.us-east-1.")
+
+    # a failed reload keeps the previous snapshot
+    del app.config["AWS_REGION"]
+    with pytest.raises(ConfigurationError):
+        auth.reload_config()
+    assert auth.cfg.region == "us-east-1"
+
+
+def test_plugin_multiple_apps(app: Flask, new_app: Flask) -> None:
+    # one extension shared by apps for different user pools
+    auth = CognitoAuth()
+    new_app.config["AWS_COGNITO_USER_POOL_ID"] = "us-east-1_B"
+    new_app.config["AWS_REGION"] = "us-east-1"
+    other = Flask(__name__)
+    other.config.update(app.config)
+    auth.init_app(other)
+    auth.init_app(new_app)
+
+    with other.app_context():
+        assert auth.cfg.user_pool_id == app.config["AWS_COGNITO_USER_POOL_ID"]
+        token_service = auth.token_service
+        assert token_service.cfg is auth.cfg
+    with new_app.app_context():
+        assert auth.cfg.user_pool_id == "us-east-1_B"
+        assert auth.token_service is not token_service
+        assert auth.token_service.verifier.issuer.endswith("/us-east-1_B")
+
+    # the app must be known when there is more than one...
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(RuntimeError):
+            pool.submit(lambda: auth.cfg).result()
+
+    # ...and registered with the extension
+    with Flask(__name__).app_context(), pytest.raises(RuntimeError):
+        auth.cfg
+
+
+def test_plugin_reload_shared_objects(app: Flask, cfg: Config) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    verifier = auth.token_service.verifier
+    assert (type(verifier), verifier.jwks.ttl, verifier.leeway) == (Verifier, 3600, 1e9)
+
+    # the process-wide objects are built again from the new config
+    app.config["AWS_COGNITO_FAST_VERIFY"] = True
+    app.config["AWS_COGNITO_JWKS_CACHE_TTL"] = 5
+    app.config["AWS_COGNITO_EXPIRATION_LEEWAY"] = 30
+    auth.reload_config()
+    verifier = auth.token_service.verifier
+    assert isinstance(verifier, FastVerifier)
+    assert (verifier.jwks.ttl, verifier.leeway) == (5, 30)
+
+
+def test_plugin_reload_custom_config(
+    app: Flask,
+    cfg: Config,
+    cfg_override: Config,
+    access_token: str,
+) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    auth.cfg = cfg_override
+    auth.token_service.verify_access_token(access_token, leeway=1e9)
+    old_store = get_jwks_store(cfg_override)
+    old_issuer = cfg_override.issuer
+
+    # the custom config already returns the new user pool when reloaded, but
+    # the objects of the old one are removed
+    app.config["AWS_COGNITO_USER_POOL_ID"] = "eu-west-1_B"
+    new_store = get_jwks_store(cfg_override)
+    auth.reload_config()
+    assert old_issuer not in _stores
+    assert get_jwks_store(cfg_override) is new_store
+    assert new_store is not old_store
+
+
+def test_plugin_reload_token_only(new_app: Flask) -> None:
+    # without a domain nothing is keyed by the token or revoke endpoints
+    del new_app.config["AWS_COGNITO_DOMAIN"]
+    auth = CognitoAuth(new_app)
+    with new_app.app_context():
+        auth.reload_config()
 
 
 def test_plugin_lazy_init_with_config_override(cfg_override: Config) -> None:
     app = Flask(__name__)
     CognitoAuth().init_app(app, cfg=cfg_override)
-    assert (
-        app.extensions[cfg_override.APP_EXTENSION_KEY].cfg.logout_redirect
-        == cfg_override.logout_redirect
-    )
+    with app.app_context():
+        assert (
+            app.extensions[cfg_override.APP_EXTENSION_KEY].cfg.logout_redirect
+            == cfg_override.logout_redirect
+        )
 
 
 def test_plugin_get_tokens_parameters_state(app: Flask, cfg: Config) -> None:
@@ -70,7 +225,7 @@ def test_plugin_get_tokens(
 ) -> None:
     cls = app.extensions[cfg.APP_EXTENSION_KEY]
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(json=lambda: {"access_token": "test_access_token"}),
     )
     tokens = cls.get_tokens(
@@ -88,7 +243,7 @@ def test_plugin_exchange_refresh_token(
 ) -> None:
     cls = app.extensions[cfg.APP_EXTENSION_KEY]
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
         return_value=mocker.Mock(
             json=lambda: {
                 "access_token": "new_test_access_token",
@@ -110,7 +265,94 @@ def test_plugin_revoke_refresh_token(
 ) -> None:
     cls = app.extensions[cfg.APP_EXTENSION_KEY]
     mocker.patch(
-        "requests.post",
+        "requests.Session.post",
     )
 
     cls.revoke_refresh_token(refresh_token="test_refresh_token")
+
+
+def test_plugin_services_shared(new_app: Flask, mocker: MockerFixture) -> None:
+    token_factory = mocker.Mock(side_effect=TokenService)
+    cognito_factory = mocker.Mock(side_effect=CognitoService)
+    auth = CognitoAuth(
+        new_app,
+        _token_service_factory=token_factory,
+        _cognito_service_factory=cognito_factory,
+    )
+
+    # the same services are used by every request
+    with new_app.test_request_context():
+        token_service = auth.token_service
+        cognito_service = auth.cognito_service
+    with new_app.test_request_context():
+        assert auth.token_service is token_service
+        assert auth.cognito_service is cognito_service
+
+    # and every thread
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        services = list(pool.map(lambda _: auth.token_service, range(8)))
+    assert all(s is token_service for s in services)
+    assert token_factory.call_count == 1
+    assert cognito_factory.call_count == 1
+
+    # created again with the new config once reloaded
+    with new_app.app_context():
+        auth.reload_config()
+        assert auth.token_service is not token_service
+        assert auth.token_service.cfg is auth.cfg
+    assert token_factory.call_count == 2
+
+
+def test_plugin_current_claims(
+    app: Flask,
+    client: FlaskClient,
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    token = make_token()
+
+    def verify() -> Dict[str, Any]:
+        return auth.verify_access_token(
+            token=request.cookies[cfg.COOKIE_NAME],
+            leeway=auth.cfg.cognito_expiration_leeway,
+        )
+
+    @app.before_request
+    def check() -> None:
+        if request.path == "/claims":
+            verify()
+
+    @app.route("/claims")
+    @auth_required()
+    def claims() -> Response:
+        # the guards and helpers share the claims verified in this request,
+        # each with its own copy
+        claims = verify()
+        assert claims == auth.current_claims
+        claims["sub"] = "someone else"
+        assert verify()["sub"] != "someone else"
+        assert auth.current_claims["sub"] != "someone else"
+        return jsonify(auth.current_claims)
+
+    decode = mocker.spy(Verifier, "_decode")
+    client.set_cookie(key=cfg.COOKIE_NAME, value=token)
+    response = client.get("/claims")
+    assert response.status_code == 200
+    assert response.get_json()["sub"] == "9048d38f-8174-49b9-8d59-3238172823d8"
+    assert decode.call_count == 1
+
+    # a new request verifies the token again
+    assert client.get("/claims").status_code == 200
+    assert decode.call_count == 2
+
+    # unless the cache is bypassed
+    with app.test_request_context(headers={"Cookie": f"{cfg.COOKIE_NAME}={token}"}):
+        assert auth.current_claims is None
+        verified = verify()
+        assert auth.current_claims == verified
+        auth.verify_access_token(
+            token=token, leeway=auth.cfg.cognito_expiration_leeway, use_cache=False
+        )
+        assert decode.call_count == 4
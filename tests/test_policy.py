@@ -0,0 +1,225 @@
+from typing import Callable
+
+import pytest
+from flask import Blueprint, Flask, Response, make_response
+from flask.testing import FlaskClient
+from pytest_mock import MockerFixture
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import ConfigurationError
+from flask_cognito_lib.policy import Policy, PolicyIndex
+
+
+def test_policy_index_resolve() -> None:
+    admin = Policy(groups=("admin",))
+    index = PolicyIndex(
+        {
+            "/": Policy(),
+            "/admin": admin,
+            "/admin/public/": None,
+            "api.health": None,
+        },
+        default=None,
+    )
+
+    # the endpoint rule wins, then the longest prefix
+    assert index.resolve("api.health", "/admin/health") is None
+    assert index.resolve("admin.edit", "/admin/<int:id>") is admin
+    assert index.resolve("admin.edit", "/admin") is admin
+    assert index.resolve("admin.docs", "/admin/public/docs") is None
+    # prefixes match whole path segments
+    assert index.resolve("admins", "/admins") == Policy()
+
+    assert PolicyIndex({}).resolve("home", "/") == Policy()
+
+
+@pytest.fixture
+def protected_app(app: Flask, cfg: Config) -> Flask:
+    api = Blueprint("api", __name__, url_prefix="/api")
+
+    @api.route("/health")
+    def health() -> Response:
+        return make_response("ok")
+
+    @api.route("/items")
+    def items() -> Response:
+        return make_response("ok")
+
+    @api.route("/admin/users")
+    def users() -> Response:
+        return make_response("ok")
+
+    @api.route("/admin/reports")
+    def reports() -> Response:
+        return make_response("ok")
+
+    app.extensions[cfg.APP_EXTENSION_KEY].protect(
+        api,
+        {
+            "api.health": None,
+            "/api/admin": Policy(groups=("admin",)),
+            "api.reports": Policy(groups=("admin", "reporter"), any_group=True),
+        },
+    )
+    app.register_blueprint(api)
+    return app
+
+
+def test_protect_blueprint(
+    protected_app: Flask,
+    client: FlaskClient,
+    cfg: Config,
+    make_token: Callable[..., str],
+) -> None:
+    # public endpoint, and routes outside the blueprint are not affected
+    assert client.get("/api/health").status_code == 200
+    assert client.get("/private").status_code == 403
+    assert client.get("/api/missing").status_code == 404
+
+    # the default policy requires a login
+    assert client.get("/api/items").status_code == 403
+    client.set_cookie(key=cfg.COOKIE_NAME, value=make_token())
+    assert client.get("/api/items").status_code == 200
+
+    # groups are checked as with auth_required
+    assert client.get("/api/admin/users").status_code == 200
+    assert client.get("/api/admin/reports").status_code == 200
+    client.set_cookie(
+        key=cfg.COOKIE_NAME, value=make_token(claims={"cognito:groups": ["reporter"]})
+    )
+    assert client.get("/api/admin/users").status_code == 403
+    assert client.get("/api/admin/reports").status_code == 200
+
+
+def test_protect_catch_all_route(
+    app: Flask,
+    cfg: Config,
+    client: FlaskClient,
+    make_token: Callable[..., str],
+) -> None:
+    api = Blueprint("api", __name__, url_prefix="/api")
+
+    @api.route("/<path:page>")
+    def pages(page: str) -> Response:
+        return make_response(page)
+
+    @api.route("/docs/<path:page>")
+    def docs(page: str) -> Response:
+        return make_response(page)
+
+    index = app.extensions[cfg.APP_EXTENSION_KEY].protect(
+        api,
+        {"/api/admin": Policy(groups=("reporter",)), "/api/docs": None},
+    )
+    app.register_blueprint(api)
+    client.set_cookie(key=cfg.COOKIE_NAME, value=make_token())
+
+    # the prefix is matched against the path, not the "/api/<path:page>" rule
+    assert client.get("/api/items").status_code == 200
+    assert client.get("/api/admin/users").status_code == 403
+    assert client.get("/api/administrators").status_code == 200
+
+    # which is only looked up per request when a prefix can match part of it
+    assert index._index is not None
+    assert ("api.pages", "/api/<path:page>") not in index._index
+    assert index._index[("api.docs", "/api/docs/<path:page>")] is None
+
+
+def test_protect_index_built_once(
+    protected_app: Flask,
+    client: FlaskClient,
+    mocker: MockerFixture,
+) -> None:
+    build = mocker.spy(PolicyIndex, "build")
+    for _ in range(3):
+        client.get("/api/health")
+    assert build.call_count == 1
+
+
+def test_protect_app_unknown_endpoint(app: Flask, cfg: Config) -> None:
+    with pytest.raises(ConfigurationError, match="missing"):
+        app.extensions[cfg.APP_EXTENSION_KEY].protect(app, {"missing": None})
+
+
+def test_protect_blueprint_unknown_endpoint(app: Flask, cfg: Config) -> None:
+    auth = app.extensions[cfg.APP_EXTENSION_KEY]
+    api = Blueprint("api", __name__, url_prefix="/api")
+    auth.protect(api, {"api.missing": None})
+
+    # checked when the blueprint is registered
+    with pytest.raises(ConfigurationError, match="api.missing"):
+        app.register_blueprint(api)
+
+
+def test_protect_nested_blueprint(
+    app: Flask,
+    cfg: Config,
+    client: FlaskClient,
+) -> None:
+    parent = Blueprint("parent", __name__, url_prefix="/parent")
+    child = Blueprint("child", __name__, url_prefix="/child")
+
+    @child.route("/public")
+    def public() -> Response:
+        return make_response("ok")
+
+    @child.route("/private")
+    def private() -> Response:
+        return make_response("ok")
+
+    # named relative to the child, registered as "parent.child.public"
+    app.extensions[cfg.APP_EXTENSION_KEY].protect(child, {"child.public": None})
+    parent.register_blueprint(child)
+    app.register_blueprint(parent)
+
+    for _ in range(2):
+        assert client.get("/parent/child/public").status_code == 200
+        assert client.get("/parent/child/private").status_code == 403
+
+
+def test_protect_nested_unknown_endpoint(app: Flask, cfg: Config) -> None:
+    parent = Blueprint("parent", __name__, url_prefix="/parent")
+    child = Blueprint("child", __name__, url_prefix="/child")
+    app.extensions[cfg.APP_EXTENSION_KEY].protect(child, {"child.typo": None})
+    parent.register_blueprint(child)
+
+    # checked when the child is registered, within its parent
+    with pytest.raises(ConfigurationError, match="parent.child.typo"):
+        app.register_blueprint(parent)
+
+
+def test_protect_unregistered_unknown_endpoint(
+    app: Flask,
+    cfg: Config,
+    client: FlaskClient,
+) -> None:
+    api = Blueprint("api", __name__, url_prefix="/api")
+    nested = Blueprint("v1", __name__, url_prefix="/v1")
+
+    @nested.route("/items")
+    def items() -> Response:
+        return make_response("ok")
+
+    api.register_blueprint(nested)
+    app.extensions[cfg.APP_EXTENSION_KEY].protect(
+        api, {"api.v1.items": None, "api.v1.missing": None}
+    )
+
+    # nested blueprints are registered after the check, so their endpoints
+    # are checked once, on the first request
+    app.register_blueprint(api)
+    with pytest.raises(ConfigurationError, match="api.v1.missing"):
+        client.get("/api/v1/items")
+    assert client.get("/api/v1/items").status_code == 200
+
+
+def test_protect_disabled(
+    protected_app: Flask,
+    cfg: Config,
+    client: FlaskClient,
+) -> None:
+    assert client.get("/api/items").status_code == 403
+
+    protected_app.config["AWS_COGNITO_DISABLED"] = True
+    protected_app.extensions[cfg.APP_EXTENSION_KEY].reload_config()
+    assert client.get("/api/items").status_code == 200
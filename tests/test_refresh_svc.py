@@ -0,0 +1,240 @@
+import fcntl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+from cryptography.fernet import Fernet
+from flask import Flask
+from pytest_mock import MockerFixture
+from requests import Response
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CognitoError
+from flask_cognito_lib.services.cognito_svc import CognitoService
+from flask_cognito_lib.services.refresh_svc import (
+    FileRefreshBackend,
+    RefreshBackend,
+    RefreshCoalescer,
+    clear_refresh_coalescers,
+    get_refresh_backend,
+    get_refresh_coalescer,
+)
+from flask_cognito_lib.services.token_cache import token_digest
+from flask_cognito_lib.utils import CognitoTokenResponse
+
+
+def test_concurrent_refreshes_share_a_request(
+    app: Flask,
+    cfg: Config,
+    mocker: MockerFixture,
+) -> None:
+    tabs = 5
+    waiting = threading.Barrier(tabs)
+    release = threading.Event()
+
+    def post(**kwargs: Any) -> Response:
+        release.wait(5)
+        resp = Response()
+        resp.status_code = 200
+        resp._content = b'{"access_token": "new_access_token"}'
+        return resp
+
+    post_mock = mocker.patch("requests.Session.post", side_effect=post)
+
+    def refresh(token: str) -> CognitoTokenResponse:
+        with app.app_context():
+            waiting.wait(5)
+            return CognitoService(cfg).exchange_refresh_token(token)
+
+    with ThreadPoolExecutor(max_workers=tabs) as pool:
+        futures = [pool.submit(refresh, "test_refresh_token") for _ in range(tabs)]
+        while get_refresh_coalescer(cfg).coalesced < tabs - 1:
+            time.sleep(0.01)
+        release.set()
+        responses: List[CognitoTokenResponse] = [f.result() for f in futures]
+
+    assert post_mock.call_count == 1
+    assert all(r.access_token == "new_access_token" for r in responses)
+    # every caller gets its own copy
+    assert len({id(r) for r in responses}) == tabs
+
+    # once finished, the next refresh sends a new request
+    CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert post_mock.call_count == 2
+
+
+def test_refresh_errors_not_cached() -> None:
+    coalescer = RefreshCoalescer(ttl=60)
+    calls = []
+
+    def fail() -> CognitoTokenResponse:
+        calls.append(1)
+        raise CognitoError("invalid_grant")
+
+    for _ in range(2):
+        with pytest.raises(CognitoError):
+            coalescer.exchange("token", fail)
+    assert len(calls) == 2
+
+
+def test_refresh_cache(mocker: MockerFixture) -> None:
+    clock = mocker.patch("flask_cognito_lib.services.token_cache.time.time")
+    clock.return_value = 1000.0
+    coalescer = RefreshCoalescer(ttl=60)
+    request = mocker.Mock(
+        side_effect=lambda: CognitoTokenResponse(access_token="a", expires_in=30)
+    )
+
+    assert coalescer.exchange("token", request).access_token == "a"
+    assert coalescer.exchange("token", request).access_token == "a"
+    assert request.call_count == 1
+
+    # other refresh tokens are not shared
+    coalescer.exchange("other", request)
+    assert request.call_count == 2
+
+    # dropped once the new tokens expire, before the TTL
+    clock.return_value = 1031.0
+    coalescer.exchange("token", request)
+    assert request.call_count == 3
+
+
+def test_refresh_not_cached_by_default(cfg: Config, mocker: MockerFixture) -> None:
+    assert get_refresh_coalescer(cfg).ttl == 0
+    request = mocker.Mock(return_value=CognitoTokenResponse(access_token="a"))
+
+    get_refresh_coalescer(cfg).exchange("token", request)
+    get_refresh_coalescer(cfg).exchange("token", request)
+    assert request.call_count == 2
+
+
+def test_file_backend_shares_between_processes(tmp_path: Path) -> None:
+    # Separate backends stand in for the workers, as each has its own locks
+    workers = 4
+    key = Fernet.generate_key()
+    backends = [FileRefreshBackend(str(tmp_path), key) for _ in range(workers)]
+    waiting = threading.Barrier(workers)
+    calls: List[int] = []
+
+    def request() -> CognitoTokenResponse:
+        calls.append(1)
+        time.sleep(0.1)
+        return CognitoTokenResponse(access_token="a", expires_in=3600)
+
+    def refresh(backend: FileRefreshBackend) -> CognitoTokenResponse:
+        waiting.wait(5)
+        return backend.exchange(token_digest("token"), request)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        responses = list(pool.map(refresh, backends))
+
+    assert len(calls) == 1
+    assert all(r.access_token == "a" for r in responses)
+    assert sum(b.shared for b in backends) == workers - 1
+
+    # the response is encrypted on disk
+    (result,) = tmp_path.glob("*.result")
+    assert b'"a"' not in result.read_bytes()
+
+    # other refresh tokens are not shared
+    backends[0].exchange(token_digest("other"), request)
+    assert len(calls) == 2
+
+
+def test_file_backend_expiry(tmp_path: Path, mocker: MockerFixture) -> None:
+    clock = mocker.patch("flask_cognito_lib.services.refresh_svc.time.time")
+    clock.return_value = 1000.0
+    backend = FileRefreshBackend(str(tmp_path), Fernet.generate_key(), ttl=10)
+    request = mocker.Mock(
+        side_effect=lambda: CognitoTokenResponse(access_token="a", expires_in=5)
+    )
+
+    backend.exchange(token_digest("token"), request)
+    backend.exchange(token_digest("token"), request)
+    assert request.call_count == 1
+
+    # dropped once the new tokens expire, before the TTL
+    clock.return_value = 1006.0
+    backend.exchange(token_digest("token"), request)
+    assert request.call_count == 2
+
+    # a response written with another key is ignored
+    other = FileRefreshBackend(str(tmp_path), Fernet.generate_key())
+    other.exchange(token_digest("token"), request)
+    assert request.call_count == 3
+
+
+def test_file_backend_locks_per_token(tmp_path: Path, mocker: MockerFixture) -> None:
+    backend = FileRefreshBackend(str(tmp_path), Fernet.generate_key(), ttl=10)
+    request = mocker.Mock(return_value=CognitoTokenResponse(access_token="a"))
+    digest = token_digest("token")
+    other = bytes([digest[0]]) + token_digest("other")[1:]
+
+    # an exchange of another refresh token is in flight...
+    with open(tmp_path / f"{digest.hex()}.lock", "w") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+
+        # ...which does not hold up this one
+        started = time.monotonic()
+        backend.exchange(other, request)
+        assert time.monotonic() - started < 1
+        assert request.call_count == 1
+
+        # lock files are removed once expired, unless held
+        mocker.patch(
+            "flask_cognito_lib.services.refresh_svc.time.time",
+            return_value=time.time() + 60,
+        )
+        backend.exchange(token_digest("new"), request)
+        locks = {p.name for p in tmp_path.glob("*.lock")}
+        assert f"{digest.hex()}.lock" in locks
+        assert f"{other.hex()}.lock" not in locks
+
+
+def test_file_backend_write_error(tmp_path: Path, mocker: MockerFixture) -> None:
+    backend = FileRefreshBackend(str(tmp_path), Fernet.generate_key())
+    request = mocker.Mock(return_value=CognitoTokenResponse(access_token="a"))
+
+    # the result file cannot be written
+    digest = token_digest("token")
+    (tmp_path / f"{digest.hex()}.result").mkdir()
+    assert backend.exchange(digest, request).access_token == "a"
+    assert request.call_count == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_refresh_backend_abstract() -> None:
+    class Incomplete(RefreshBackend):
+        pass
+
+    # fails when constructed rather than on the first refresh
+    with pytest.raises(TypeError, match="exchange"):
+        Incomplete()  # type: ignore[abstract]
+
+
+def test_cognito_service_lock_dir(
+    app: Flask,
+    cfg: Config,
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    assert get_refresh_backend(cfg) is None
+
+    app.config["AWS_COGNITO_REFRESH_LOCK_DIR"] = str(tmp_path)
+    post = mocker.patch("requests.Session.post")
+    post.return_value.json.return_value = {"access_token": "a"}
+
+    CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    # a restarted worker reuses the response written by the first one
+    clear_refresh_coalescers()
+    token = CognitoService(cfg).exchange_refresh_token("test_refresh_token")
+    assert token.access_token == "a"
+    assert post.call_count == 1
+
+    # a custom backend takes precedence
+    backend = mocker.Mock(spec=RefreshBackend)
+    app.config["AWS_COGNITO_REFRESH_BACKEND"] = backend
+    assert get_refresh_backend(cfg) is backend
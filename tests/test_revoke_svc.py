@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import Any, List
+
+import pytest
+import requests
+from flask import Flask
+from flask.testing import FlaskClient
+from pytest_mock import MockerFixture
+from requests import Response
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import CircuitOpenError, CognitoError
+from flask_cognito_lib.services.revoke_svc import (
+    RevokeQueue,
+    get_revoke_queue,
+    is_transient,
+)
+
+
+def transient_error() -> CognitoError:
+    try:
+        raise CognitoError("down") from requests.ConnectionError("down")
+    except CognitoError as err:
+        return err
+
+
+def test_is_transient() -> None:
+    assert is_transient(transient_error())
+    assert is_transient(CircuitOpenError("open"))
+    assert not is_transient(CognitoError("CognitoError: invalid_token"))
+
+
+def test_revoke_queue_retries() -> None:
+    revoke_queue = RevokeQueue(max_size=10, max_attempts=3, retry_delay=0.001)
+    calls: List[str] = []
+
+    def flaky() -> None:
+        calls.append("flaky")
+        if len(calls) < 3:
+            raise transient_error()
+
+    def invalid() -> None:
+        calls.append("invalid")
+        raise CognitoError("CognitoError: invalid_token")
+
+    assert revoke_queue.submit(flaky)
+    assert revoke_queue.submit(invalid)
+    while revoke_queue.stats().failed < 1:
+        time.sleep(0.01)
+
+    # transient errors are retried, but other errors are not
+    assert calls == ["flaky", "flaky", "flaky", "invalid"]
+    stats = revoke_queue.stats()
+    assert (stats.depth, stats.revoked, stats.retried, stats.failed) == (0, 1, 2, 1)
+
+    # no more retries once closing, so the queue drains quickly
+    calls.clear()
+    release = threading.Event()
+
+    def blocked() -> None:
+        release.wait(5)
+
+    revoke_queue.submit(blocked)
+    revoke_queue.submit(flaky)
+    threading.Timer(0.05, release.set).start()
+    revoke_queue.close(timeout=5)
+    assert calls == ["flaky"]
+
+
+def test_revoke_queue_bounded_and_drained() -> None:
+    revoke_queue = RevokeQueue(max_size=2)
+    started = threading.Event()
+    release = threading.Event()
+    calls: List[int] = []
+
+    def blocked() -> None:
+        started.set()
+        release.wait(5)
+
+    revoke_queue.submit(blocked)
+    started.wait(5)
+    assert revoke_queue.submit(lambda: calls.append(1))
+    assert revoke_queue.submit(lambda: calls.append(2))
+    assert not revoke_queue.submit(lambda: calls.append(3))
+    assert revoke_queue.stats().depth == 2
+
+    # the queued jobs are run before the worker stops, and no more are taken
+    release.set()
+    revoke_queue.close(timeout=5)
+    assert not revoke_queue.submit(lambda: calls.append(4))
+    assert calls == [1, 2]
+    stats = revoke_queue.stats()
+    assert (stats.depth, stats.revoked, stats.rejected) == (0, 3, 2)
+
+
+def test_get_revoke_queue(app: Flask, cfg: Config) -> None:
+    assert get_revoke_queue(cfg) is None
+    assert app.extensions[cfg.APP_EXTENSION_KEY].revoke_stats() is None
+
+    app.config["AWS_COGNITO_REVOKE_QUEUE_SIZE"] = 10
+    revoke_queue = get_revoke_queue(cfg)
+    assert revoke_queue is not None and revoke_queue.max_size == 10
+    assert get_revoke_queue(cfg) is revoke_queue
+
+
+def test_logout_revokes_in_background(
+    app: Flask,
+    client_with_cookie_refresh: FlaskClient,
+    cfg: Config,
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_REVOKE_QUEUE_SIZE"] = 10
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+    release = threading.Event()
+
+    def post_revoke(**kwargs: Any) -> Response:
+        release.wait(5)
+        resp = Response()
+        resp.status_code = 200
+        resp._content = b""
+        return resp
+
+    post = mocker.patch("requests.Session.post", side_effect=post_revoke)
+
+    # returns while the revocation is still waiting on Cognito
+    response = client_with_cookie_refresh.get("/logout")
+    assert response.status_code == 302
+
+    release.set()
+    revoke_queue = get_revoke_queue(cfg)
+    assert revoke_queue is not None
+    revoke_queue.close(timeout=5)
+    assert post.call_count == 1
+    assert post.call_args.kwargs["url"] == cfg.revoke_endpoint
+    assert revoke_queue.stats().revoked == 1
+
+
+@pytest.mark.parametrize("queue_size", [0, 1])
+def test_logout_revokes_inline(
+    app: Flask,
+    client_with_cookie_refresh: FlaskClient,
+    mocker: MockerFixture,
+    queue_size: int,
+) -> None:
+    app.config["AWS_COGNITO_REVOKE_QUEUE_SIZE"] = queue_size
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+    revoke = mocker.patch(
+        "flask_cognito_lib.decorators.cognito_auth.revoke_refresh_token",
+    )
+    if queue_size:
+        # a full queue revokes before returning
+        mocker.patch.object(RevokeQueue, "submit", return_value=False)
+
+    client_with_cookie_refresh.get("/logout")
+    assert revoke.call_count == 1
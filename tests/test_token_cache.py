@@ -0,0 +1,239 @@
+import time
+from typing import Callable, Dict, List
+
+import pytest
+from flask import Flask, Response, make_response
+from flask.testing import FlaskClient
+from pytest_mock import MockerFixture
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.decorators import auth_required
+from flask_cognito_lib.exceptions import CognitoError, TokenVerifyError
+from flask_cognito_lib.services.token_cache import (
+    ClaimsCache,
+    RejectedTokenCache,
+    get_claims_cache,
+    get_rejected_cache,
+    token_digest,
+)
+from flask_cognito_lib.services.token_svc import TokenService, Verifier
+
+
+def test_claims_cache_hit_and_miss() -> None:
+    cache = ClaimsCache()
+    key = ("access", token_digest("token"))
+    assert cache.get(key) is None
+
+    cache.put(key, {"exp": time.time() + 600, "sub": "a"}, leeway=0, size=5)
+    claims = cache.get(key)
+    assert claims is not None and claims["sub"] == "a"
+
+    # callers get a copy that does not change the cached claims
+    claims["sub"] = "b"
+    assert cache.get(key)["sub"] == "a"  # type: ignore[index]
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries, stats.size_bytes) == (2, 1, 1, 5)
+
+
+def test_claims_cache_expiry(mocker: MockerFixture) -> None:
+    clock = mocker.patch("flask_cognito_lib.services.token_cache.time.time")
+    clock.return_value = 1000.0
+    cache = ClaimsCache(max_ttl=60)
+
+    # expires at the max TTL...
+    cache.put(("access", b"a"), {"exp": 5000}, leeway=0, size=1)
+    # ...or the token expiry less the leeway, whichever is first
+    cache.put(("access", b"b"), {"exp": 1040}, leeway=10, size=1)
+    # already expired, not cached
+    cache.put(("access", b"c"), {"exp": 1005}, leeway=10, size=1)
+    assert cache.stats().entries == 2
+
+    clock.return_value = 1030.0
+    assert cache.get(("access", b"a")) is not None
+    assert cache.get(("access", b"b")) is None
+
+    clock.return_value = 1060.0
+    assert cache.get(("access", b"a")) is None
+    assert cache.stats().entries == 0
+
+
+def test_claims_cache_bounded() -> None:
+    exp = time.time() + 600
+    cache = ClaimsCache(max_entries=2, max_bytes=100)
+
+    cache.put(("access", b"a"), {"exp": exp}, leeway=0, size=10)
+    cache.put(("access", b"b"), {"exp": exp}, leeway=0, size=10)
+    cache.get(("access", b"a"))
+    cache.put(("access", b"c"), {"exp": exp}, leeway=0, size=10)
+
+    # least recently used entry is evicted when there are too many entries
+    assert cache.get(("access", b"b")) is None
+    assert cache.get(("access", b"a")) is not None
+
+    # ...or the entries are too large
+    cache.put(("access", b"d"), {"exp": exp}, leeway=0, size=95)
+    assert cache.stats().entries == 1
+    assert cache.stats().size_bytes == 95
+
+    # an entry larger than the whole cache is never added
+    cache.put(("access", b"e"), {"exp": exp}, leeway=0, size=101)
+    assert cache.get(("access", b"e")) is None
+
+
+def test_get_claims_cache(app: Flask, cfg: Config) -> None:
+    assert get_claims_cache(cfg) is None
+
+    app.config["AWS_COGNITO_CLAIMS_CACHE_TTL"] = 30
+    app.config["AWS_COGNITO_CLAIMS_CACHE_MAX_ENTRIES"] = 10
+    cache = get_claims_cache(cfg)
+    assert cache is not None
+    assert (cache.max_ttl, cache.max_entries) == (30, 10)
+    assert get_claims_cache(cfg) is cache
+
+
+def test_token_service_claims_cache(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_CLAIMS_CACHE_TTL"] = 30
+    token = make_token()
+    id_token = make_token(token_use="id", claims={"nonce": "abc"})
+
+    decode = mocker.spy(Verifier, "_decode")
+    for _ in range(3):
+        # a new TokenService is created for every request
+        claims = TokenService(cfg).verify_access_token(token)
+        assert claims["token_use"] == "access"
+        TokenService(cfg).verify_id_token(id_token, nonce="abc")
+    assert decode.call_count == 2
+
+    # the nonce is still checked for cached ID tokens
+    with pytest.raises(Exception, match="nonce"):
+        TokenService(cfg).verify_id_token(id_token, nonce="wrong")
+
+    # bypass the cache
+    TokenService(cfg).verify_access_token(token, use_cache=False)
+    assert decode.call_count == 3
+
+    stats = get_claims_cache(cfg).stats()  # type: ignore[union-attr]
+    assert (stats.hits, stats.misses) == (5, 2)
+
+
+def test_auth_required_bypass_cache(
+    app: Flask,
+    cfg: Config,
+    client: FlaskClient,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    @app.route("/sensitive")
+    @auth_required(use_cache=False)
+    def sensitive() -> Response:
+        return make_response("ok")
+
+    app.config["AWS_COGNITO_CLAIMS_CACHE_TTL"] = 30
+    app.config["AWS_COGNITO_EXPIRATION_LEEWAY"] = 0
+    app.extensions[Config.APP_EXTENSION_KEY].reload_config()
+    client.set_cookie(key=cfg.COOKIE_NAME, value=make_token())
+    decode = mocker.spy(Verifier, "_decode")
+
+    assert client.get("/private").status_code == 200
+    assert client.get("/private").status_code == 200
+    assert decode.call_count == 1
+
+    assert client.get("/sensitive").status_code == 200
+    assert client.get("/sensitive").status_code == 200
+    assert decode.call_count == 3
+
+    stats = app.extensions[cfg.APP_EXTENSION_KEY].claims_cache_stats()
+    assert stats.hits == 1
+
+
+def test_rejected_cache(mocker: MockerFixture) -> None:
+    clock = mocker.patch("flask_cognito_lib.services.token_cache.time.time")
+    clock.return_value = 1000.0
+    cache = RejectedTokenCache(ttl=10)
+    key = ("access", token_digest("token"))
+
+    cache.put(key, reason="Signature has expired", size=5)
+    assert cache.get(key) == "Signature has expired"
+
+    clock.return_value = 1010.0
+    assert cache.get(key) is None
+    assert cache.stats().entries == 0
+
+
+def test_token_service_rejected_cache(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_REJECTED_CACHE_TTL"] = 10
+    expired = make_token(claims={"exp": int(time.time()) - 60})
+    other_client = make_token(claims={"client_id": "other"})
+
+    decode = mocker.spy(Verifier, "_decode")
+    with pytest.raises(TokenVerifyError, match="Token has expired"):
+        TokenService(cfg).verify_access_token(expired)
+
+    # the same token is rejected again without being verified
+    for _ in range(3):
+        with pytest.raises(TokenVerifyError, match="recently rejected: Token has"):
+            TokenService(cfg).verify_access_token(expired)
+    assert decode.call_count == 1
+
+    for _ in range(2):
+        with pytest.raises(TokenVerifyError, match="client id"):
+            TokenService(cfg).verify_access_token(other_client)
+    assert decode.call_count == 2
+
+    # bypass the cache
+    with pytest.raises(TokenVerifyError, match="Token has expired"):
+        TokenService(cfg).verify_access_token(expired, use_cache=False)
+    assert decode.call_count == 3
+
+    cache = get_rejected_cache(cfg)
+    assert cache is not None
+    assert (cache.stats().hits, cache.stats().entries) == (4, 2)
+
+
+def test_rejected_cache_ignores_jwks_errors(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_REJECTED_CACHE_TTL"] = 10
+    token = make_token(token_use="id")
+    fetch = mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        side_effect=CognitoError("unreachable"),
+    )
+
+    with pytest.raises(CognitoError):
+        TokenService(cfg).verify_id_token(token)
+    assert get_rejected_cache(cfg).stats().entries == 0  # type: ignore[union-attr]
+
+    # once the keys can be downloaded the token is verified as normal
+    fetch.side_effect = None
+    fetch.return_value = jwks
+    assert TokenService(cfg).verify_id_token(token)["token_use"] == "id"
+
+
+def test_rejected_cache_ignores_unknown_keys(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+) -> None:
+    app.config["AWS_COGNITO_REJECTED_CACHE_TTL"] = 10
+    token = make_token(headers={"kid": "rotated"})
+
+    for _ in range(2):
+        with pytest.raises(TokenVerifyError, match="not in the key set"):
+            TokenService(cfg).verify_access_token(token)
+    assert get_rejected_cache(cfg).stats().entries == 0  # type: ignore[union-attr]
@@ -1,9 +1,18 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
 import pytest
 from flask import Flask
+from jwt.utils import base64url_decode, base64url_encode
+from pytest_mock import MockerFixture
 
 from flask_cognito_lib.config import Config
 from flask_cognito_lib.exceptions import CognitoError, TokenVerifyError
-from flask_cognito_lib.services.token_svc import TokenService
+from flask_cognito_lib.services.jwks_svc import JWKSClient, JWKSStore
+from flask_cognito_lib.services.token_svc import TokenService, get_verifier
 
 
 def test_verify_no_access_token(cfg: Config) -> None:
@@ -94,3 +103,209 @@ def test_decrypt_token_error(app: Flask, cfg: Config, refresh_token: str) -> Non
     with pytest.raises(CognitoError, match="Error decrypting token"):
         serv = TokenService(cfg=cfg)
         serv.decrypt_token(refresh_token)
+
+
+@pytest.mark.parametrize(
+    "headers, claims, match",
+    [
+        ({"alg": "none"}, {}, "algorithm is not allowed"),
+        ({"alg": "HS256"}, {}, "algorithm is not allowed"),
+        ({"kid": None}, {}, "no key ID"),
+        ({}, {"iss": "https://example.com"}, "not issued by this user pool"),
+        ({}, {"exp": None}, "no valid expiry"),
+        ({}, {"exp": "tomorrow"}, "no valid expiry"),
+        ({}, {"exp": int(time.time()) - 60}, "Token has expired"),
+    ],
+)
+def test_precheck(
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+    headers: Dict[str, Any],
+    claims: Dict[str, Any],
+    match: str,
+) -> None:
+    token = make_token(claims=claims)
+    header, payload, signature = token.split(".")
+    if headers:
+        # re-encode the header without signing again, as a forged token would
+        decoded = json.loads(base64url_decode(header))
+        decoded.update(headers)
+        decoded = {k: v for k, v in decoded.items() if v is not None}
+        header = base64url_encode(json.dumps(decoded).encode()).decode()
+
+    get_key = mocker.spy(JWKSStore, "get_key")
+    with pytest.raises(TokenVerifyError, match=match):
+        TokenService(cfg).verify_access_token(f"{header}.{payload}.{signature}")
+
+    # rejected before the public key is looked up
+    get_key.assert_not_called()
+
+
+@pytest.mark.parametrize("token", ["garbage", "a.b.c", "a.b.c.d", "e30.e30.sig"])
+def test_precheck_malformed(cfg: Config, token: str) -> None:
+    with pytest.raises(TokenVerifyError):
+        TokenService(cfg).verify_access_token(token)
+
+
+def test_precheck_unknown_kid(cfg: Config, make_token: Callable[..., str]) -> None:
+    token = make_token(headers={"kid": "unknown"})
+    with pytest.raises(TokenVerifyError, match="not in the key set"):
+        TokenService(cfg).verify_access_token(token)
+
+
+def test_get_verifier(app: Flask, cfg: Config) -> None:
+    verifier = get_verifier(cfg)
+    assert (verifier.issuer, verifier.client_id) == (
+        cfg.issuer,
+        "4lln66726pp3f4gi1krj0sta9h",
+    )
+    assert verifier.leeway == 1e9
+
+    # shared by every TokenService for the same user pool client
+    assert TokenService(cfg).verifier is verifier
+
+    app.config["AWS_COGNITO_USER_POOL_CLIENT_ID"] = "other"
+    assert get_verifier(cfg) is not verifier
+
+
+def test_verifier(cfg: Config, access_token: str, id_token: str) -> None:
+    verifier = get_verifier(cfg)
+
+    # the configured leeway is used by default...
+    assert verifier.verify_access(access_token)["token_use"] == "access"
+    assert verifier.verify_id(id_token)["token_use"] == "id"
+
+    # ...and can be overridden per token
+    with pytest.raises(TokenVerifyError, match="Token has expired"):
+        verifier.verify_access(access_token, leeway=0)
+
+
+def test_verifier_required_claims(
+    cfg: Config,
+    make_token: Callable[..., str],
+) -> None:
+    verifier = get_verifier(cfg)
+
+    with pytest.raises(TokenVerifyError, match="Token is not valid"):
+        verifier.verify_access(make_token(claims={"client_id": None}))
+
+    with pytest.raises(TokenVerifyError, match="Token is not valid"):
+        verifier.verify_id(make_token(token_use="id", claims={"iat": None}))
+
+    # a nonce is expected but the token has none
+    with pytest.raises(TokenVerifyError, match="nonce"):
+        verifier.verify_id(make_token(token_use="id"), nonce="abc")
+
+
+def test_verify_access_tokens(
+    app: Flask,
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    app.config["AWS_COGNITO_BATCH_WORKERS"] = 4
+    valid = [make_token(claims={"username": f"user{i}"}) for i in range(20)]
+    tokens = [
+        *valid,
+        "",
+        "garbage",
+        make_token(claims={"exp": int(time.time()) - 60}),
+        make_token(claims={"client_id": "other"}),
+        make_token(headers={"kid": "unknown"}),
+        make_token(headers={"kid": "unknown"}),
+    ]
+
+    get_key = mocker.spy(JWKSStore, "get_key")
+    results = TokenService(cfg).verify_access_tokens(tokens, leeway=0)
+
+    # results are in the same order as the tokens
+    assert [r.claims["username"] for r in results[:20]] == [  # type: ignore[index]
+        f"user{i}" for i in range(20)
+    ]
+    assert all(r.ok for r in results[:20])
+    assert all(not r.ok and r.claims is None for r in results[20:])
+    assert all(isinstance(r.error, TokenVerifyError) for r in results[20:])
+    assert "client id" in str(results[23].error)
+
+    # the key is looked up once per key ID
+    assert get_key.call_count == 2
+
+
+def test_verify_id_tokens(
+    cfg: Config,
+    make_token: Callable[..., str],
+    id_token: str,
+) -> None:
+    tokens = [make_token(token_use="id"), id_token, make_token()]
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = TokenService(cfg).verify_id_tokens(tokens, executor=pool)
+
+    assert results[0].ok
+    assert "Token has expired" in str(results[1].error)
+    # an access token has no audience
+    assert isinstance(results[2].error, TokenVerifyError)
+
+
+def test_verify_tokens_process_pool(
+    cfg: Config,
+    make_token: Callable[..., str],
+) -> None:
+    # the jobs are closures over the parsed tokens, so cannot be pickled
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(TypeError, match="ThreadPoolExecutor"):
+            TokenService(cfg).verify_access_tokens(
+                [make_token()],
+                executor=pool,  # type: ignore[arg-type]
+            )
+
+
+def test_verify_tokens_jwks_error(
+    cfg: Config,
+    make_token: Callable[..., str],
+    mocker: MockerFixture,
+) -> None:
+    mocker.patch(
+        "flask_cognito_lib.services.jwks_svc.JWKSClient.fetch_data",
+        side_effect=CognitoError("unreachable"),
+    )
+
+    results = TokenService(cfg).verify_access_tokens([make_token(), make_token()])
+    assert all(isinstance(r.error, CognitoError) for r in results)
+
+
+def test_verify_tokens_async(
+    cfg: Config,
+    make_token: Callable[..., str],
+    jwks: Dict[str, List[Dict[str, str]]],
+    mocker: MockerFixture,
+) -> None:
+    tokens = [make_token(claims={"username": f"user{i}"}) for i in range(5)]
+
+    def slow_fetch() -> Dict[str, Any]:
+        time.sleep(0.1)
+        return jwks
+
+    fetch = mocker.patch.object(JWKSClient, "fetch_data", side_effect=slow_fetch)
+    to_thread = mocker.spy(asyncio, "to_thread")
+
+    async def verify_all() -> List[Dict[str, Any]]:
+        service = TokenService(cfg)
+        return await asyncio.gather(
+            *(service.verify_access_token_async(t) for t in tokens),
+            service.verify_id_token_async(make_token(token_use="id")),
+        )
+
+    # the keys are downloaded once in a thread, shared by all the coroutines
+    claims = asyncio.run(verify_all())
+    assert [c["username"] for c in claims[:5]] == [f"user{i}" for i in range(5)]
+    assert fetch.call_count == 1
+    assert to_thread.call_count == 6
+
+    # once the keys are cached the tokens are verified without a thread
+    asyncio.run(verify_all())
+    assert to_thread.call_count == 6
+
+    with pytest.raises(TokenVerifyError):
+        asyncio.run(TokenService(cfg).verify_access_token_async("garbage"))
@@ -0,0 +1,243 @@
+"""The fast path must accept and reject exactly the same tokens as PyJWT
+
+Both verifiers run the same pre-checks before the signature is verified, so
+they are also compared with ``jwt.decode`` alone, the path without them.
+"""
+
+import json
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from cryptography.hazmat.primitives.hashes import SHA256
+from flask import Flask
+from jwt.utils import base64url_encode
+
+from flask_cognito_lib.config import Config
+from flask_cognito_lib.exceptions import TokenVerifyError
+from flask_cognito_lib.services.jwks_svc import JWKSStore, get_jwks_store
+from flask_cognito_lib.services.token_svc import (
+    ACCESS_TOKEN_OPTIONS,
+    ALGORITHMS,
+    ID_TOKEN_OPTIONS,
+    FastVerifier,
+    Verifier,
+    clear_verifiers,
+    get_verifier,
+)
+
+from .conftest import TEST_KID
+
+ISSUER = "https://cognito-idp.eu-west-1.amazonaws.com/eu-west-1_c7O90SNDF"
+CLIENT_ID = "4lln66726pp3f4gi1krj0sta9h"
+OTHER_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+Segment = Union[Dict[str, Any], str]
+
+
+def forge(
+    key: RSAPrivateKey,
+    header: Segment,
+    payload: Segment,
+    signature: Optional[str] = None,
+) -> str:
+    """Sign any header and payload, given as dicts or raw JSON strings"""
+
+    def encode(segment: Segment) -> str:
+        raw = segment if isinstance(segment, str) else json.dumps(segment)
+        return base64url_encode(raw.encode()).decode()
+
+    signing_input = f"{encode(header)}.{encode(payload)}"
+    if signature is None:
+        sig = key.sign(signing_input.encode(), PKCS1v15(), SHA256())
+        signature = base64url_encode(sig).decode()
+    return f"{signing_input}.{signature}"
+
+
+def claims(token_use: str, **overrides: Any) -> Dict[str, Any]:
+    now = int(time.time())
+    payload: Dict[str, Any] = {
+        "sub": "9048d38f-8174-49b9-8d59-3238172823d8",
+        "iss": ISSUER,
+        "token_use": token_use,
+        "exp": now + 3600,
+        "iat": now,
+        "jti": "0fe29a9e-6e94-479b-987b-e45696d5843a",
+    }
+    if token_use == "access":
+        payload["client_id"] = CLIENT_ID
+    else:
+        payload["aud"] = CLIENT_ID
+    payload.update(overrides)
+    return {k: v for k, v in payload.items() if v is not None}
+
+
+HEADER = {"alg": "RS256", "kid": TEST_KID}
+
+Case = Callable[[RSAPrivateKey, str], str]
+
+CASES: Dict[str, Case] = {
+    "valid": lambda k, t: forge(k, HEADER, claims(t)),
+    "valid with typ": lambda k, t: forge(k, {**HEADER, "typ": "JWT"}, claims(t)),
+    "valid with extra claims": lambda k, t: forge(
+        k, HEADER, claims(t, scope="openid", groups=["a"])
+    ),
+    "float exp": lambda k, t: forge(k, HEADER, claims(t, exp=time.time() + 60.5)),
+    "expired": lambda k, t: forge(k, HEADER, claims(t, exp=int(time.time()) - 1)),
+    "expires now": lambda k, t: forge(k, HEADER, claims(t, exp=int(time.time()))),
+    "exp as string": lambda k, t: forge(k, HEADER, claims(t, exp="9999999999")),
+    "exp infinite": lambda k, t: forge(
+        k, HEADER, json.dumps(claims(t)).replace('"exp": ', '"exp": Infinity, "x": ')
+    ),
+    "exp nan": lambda k, t: forge(
+        k, HEADER, json.dumps(claims(t)).replace('"exp": ', '"exp": NaN, "x": ')
+    ),
+    "no exp": lambda k, t: forge(k, HEADER, claims(t, exp=None)),
+    "iat in future": lambda k, t: forge(
+        k, HEADER, claims(t, iat=int(time.time()) + 600)
+    ),
+    "iat as string": lambda k, t: forge(k, HEADER, claims(t, iat="1647961493")),
+    "iat not a number": lambda k, t: forge(k, HEADER, claims(t, iat="yesterday")),
+    "iat null": lambda k, t: forge(k, HEADER, json.dumps({**claims(t), "iat": None})),
+    "no iat": lambda k, t: forge(k, HEADER, claims(t, iat=None)),
+    "wrong issuer": lambda k, t: forge(k, HEADER, claims(t, iss="https://evil")),
+    "no issuer": lambda k, t: forge(k, HEADER, claims(t, iss=None)),
+    "wrong client id": lambda k, t: forge(k, HEADER, claims(t, client_id="other")),
+    "no client id": lambda k, t: forge(k, HEADER, {**claims(t), "client_id": None}),
+    "wrong audience": lambda k, t: forge(k, HEADER, claims(t, aud="other")),
+    "audience list": lambda k, t: forge(k, HEADER, claims(t, aud=["x", CLIENT_ID])),
+    "audience list mismatch": lambda k, t: forge(k, HEADER, claims(t, aud=["x"])),
+    "audience list non-string": lambda k, t: forge(
+        k, HEADER, claims(t, aud=[CLIENT_ID, 1])
+    ),
+    "audience object": lambda k, t: forge(
+        k, HEADER, claims(t, aud={CLIENT_ID: CLIENT_ID})
+    ),
+    "empty audience": lambda k, t: forge(k, HEADER, claims(t, aud="")),
+    "sub not a string": lambda k, t: forge(k, HEADER, claims(t, sub=1)),
+    "jti not a string": lambda k, t: forge(k, HEADER, claims(t, jti=["a"])),
+    "payload not an object": lambda k, t: forge(k, HEADER, "[1, 2]"),
+    "payload not json": lambda k, t: forge(k, HEADER, "{"),
+    "payload deeply nested": lambda k, t: forge(k, HEADER, "[" * 100000),
+    "header not an object": lambda k, t: forge(k, '"RS256"', claims(t)),
+    "alg none": lambda k, t: forge(k, {**HEADER, "alg": "none"}, claims(t), ""),
+    "alg HS256": lambda k, t: forge(k, {**HEADER, "alg": "HS256"}, claims(t)),
+    "alg RS512": lambda k, t: forge(k, {**HEADER, "alg": "RS512"}, claims(t)),
+    "no kid": lambda k, t: forge(k, {"alg": "RS256"}, claims(t)),
+    "kid not a string": lambda k, t: forge(k, {**HEADER, "kid": 1}, claims(t)),
+    "unknown kid": lambda k, t: forge(k, {**HEADER, "kid": "unknown"}, claims(t)),
+    "crit header": lambda k, t: forge(k, {**HEADER, "crit": ["exp"]}, claims(t)),
+    "b64 header": lambda k, t: forge(k, {**HEADER, "b64": False}, claims(t)),
+    "signed by another key": lambda k, t: forge(OTHER_KEY, HEADER, claims(t)),
+    "empty signature": lambda k, t: forge(k, HEADER, claims(t), ""),
+    "signature junk": lambda k, t: forge(k, HEADER, claims(t)) + "!",
+    "signature padded": lambda k, t: forge(k, HEADER, claims(t)) + "==",
+    "signature truncated": lambda k, t: forge(k, HEADER, claims(t))[:-2],
+    "tampered payload": lambda k, t: ".".join(
+        (
+            forge(k, HEADER, claims(t)).split(".")[0],
+            base64url_encode(json.dumps(claims(t, sub="admin")).encode()).decode(),
+            forge(k, HEADER, claims(t)).split(".")[2],
+        )
+    ),
+    "too many segments": lambda k, t: forge(k, HEADER, claims(t)) + ".x",
+    "too few segments": lambda k, t: forge(k, HEADER, claims(t)).rsplit(".", 1)[0],
+    "not a token": lambda k, t: "garbage",
+}
+
+
+# Cases the pre-checks reject although jwt.decode accepts them
+PRECHECK_STRICTER = {
+    # PyJWT reads a numeric string as a number, Cognito always sets a number
+    "exp as string",
+}
+
+
+def reference(jwks: JWKSStore, token: str, token_use: str) -> Any:
+    """Verify with ``jwt.decode`` alone, as the verifiers did before the pre-checks"""
+    options = ACCESS_TOKEN_OPTIONS if token_use == "access" else ID_TOKEN_OPTIONS
+    try:
+        key = jwks.get_key(jwt.get_unverified_header(token)["kid"])
+        claims = jwt.decode(
+            token,
+            key=key,
+            algorithms=ALGORITHMS,
+            audience=CLIENT_ID,
+            issuer=ISSUER,
+            options=options,  # type: ignore[arg-type]
+        )
+    except (jwt.PyJWTError, KeyError, RecursionError):
+        return "rejected"
+    if token_use == "access" and claims["client_id"] != CLIENT_ID:
+        return "rejected"
+    return claims
+
+
+def outcome(verifier: Verifier, token: str, token_use: str) -> Any:
+    try:
+        if token_use == "access":
+            return verifier.verify_access(token)
+        return verifier.verify_id(token)
+    except TokenVerifyError:
+        return "rejected"
+
+
+@pytest.mark.parametrize("token_use", ["access", "id"])
+@pytest.mark.parametrize("case", CASES)
+def test_fast_verifier_parity(
+    cfg: Config,
+    signing_key: RSAPrivateKey,
+    case: str,
+    token_use: str,
+) -> None:
+    jwks = get_jwks_store(cfg)
+    verifier = Verifier(ISSUER, CLIENT_ID, jwks=jwks)
+    fast = FastVerifier(ISSUER, CLIENT_ID, jwks=jwks)
+
+    token = CASES[case](signing_key, token_use)
+    expected = outcome(verifier, token, token_use)
+    assert outcome(fast, token, token_use) == expected
+
+    if case in PRECHECK_STRICTER:
+        assert expected == "rejected"
+        assert reference(jwks, token, token_use) != "rejected"
+    else:
+        assert reference(jwks, token, token_use) == expected
+
+
+@pytest.mark.parametrize("token_use", ["access", "id"])
+def test_fast_verifier_parity_leeway(
+    cfg: Config,
+    signing_key: RSAPrivateKey,
+    token_use: str,
+) -> None:
+    jwks = get_jwks_store(cfg)
+    verifier = Verifier(ISSUER, CLIENT_ID, jwks=jwks, leeway=60)
+    fast = FastVerifier(ISSUER, CLIENT_ID, jwks=jwks, leeway=60)
+
+    now = int(time.time())
+    for overrides in ({"exp": now - 30}, {"exp": now - 90}, {"iat": now + 30}):
+        token = forge(signing_key, HEADER, claims(token_use, **overrides))
+        assert outcome(fast, token, token_use) == outcome(verifier, token, token_use)
+
+
+def test_fast_verifier_accepts_valid(
+    cfg: Config,
+    signing_key: RSAPrivateKey,
+) -> None:
+    # guard against the parity suite passing because both paths reject all
+    fast = FastVerifier(ISSUER, CLIENT_ID, jwks=get_jwks_store(cfg))
+    token = CASES["valid"](signing_key, "access")
+    assert fast.verify_access(token)["client_id"] == CLIENT_ID
+
+
+def test_get_fast_verifier(app: Flask, cfg: Config) -> None:
+    assert type(get_verifier(cfg)) is Verifier
+
+    clear_verifiers()
+    app.config["AWS_COGNITO_FAST_VERIFY"] = True
+    assert type(get_verifier(cfg)) is FastVerifier